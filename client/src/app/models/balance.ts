@@ -0,0 +1,8 @@
+import { User } from './user';
+
+export class Balance {
+    user: User
+    debt: number
+    credit: number
+    total: number
+}
@@ -16,7 +16,7 @@ export class DebtTicketPipe implements PipeTransform {
           id: dbDebtTicket.id,
           market: 'Generic',
           owner: dbDebtTicket.userFrom,
-          products: dbDebtTicket.ticket.items,
+          products: dbDebtTicket.ticket.items || [],
           timestamp: dbDebtTicket.ticket.timestamp,
           totalPrice: dbDebtTicket.totalPrice,
           paidPrice: dbDebtTicket.paidPrice,
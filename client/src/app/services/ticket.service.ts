@@ -1,7 +1,7 @@
 import { HttpClient } from '@angular/common/http';
 import { Injectable } from '@angular/core';
-import { Observable } from 'rxjs';
-import { first, map } from 'rxjs/operators';
+import { EMPTY, Observable } from 'rxjs';
+import { expand, first, map, reduce } from 'rxjs/operators';
 import { DebtTicket, Ticket } from '../models/ticket';
 import { User } from '../models/user';
 import { LoginService } from './login.service';
@@ -27,28 +27,39 @@ export class TicketService {
         return await this.http.patch(`${environment.serverUrl}/ticket/${ticket.id}`, { items: ticket.products }).pipe(first()).toPromise()
     }
 
+    // the lists come in pages, newest first: the next one starts at the cursor in the X-Next-Cursor header
+    private getAllPages(url: string): Observable<any[]> {
+        const getPage = (cursor?: string) =>
+            this.http.get<any[]>(url, { observe: 'response', params: cursor ? { cursor } : {} })
+        return getPage().pipe(
+            expand(response => response.headers.has('X-Next-Cursor') ? getPage(response.headers.get('X-Next-Cursor')) : EMPTY),
+            reduce((all, response) => all.concat(response.body), [])
+        )
+    }
+
     getTicketsOfLoggedUser(): Observable<Ticket[]> {
-        return this.http.get(`${environment.serverUrl}/tickets`)
+        return this.getAllPages(`${environment.serverUrl}/tickets`)
             .pipe(first(), map(tickets => this.loggedUserTicketPipe.transform(tickets)))
     }
 
     getPassedTicketsOfLoggedUser(): Observable<Ticket[]> {
-        return this.http.get(`${environment.serverUrl}/tickets`)
+        return this.getAllPages(`${environment.serverUrl}/tickets`)
             .pipe(first(), map(tickets => this.loggedUserTicketPipe.transform(tickets)))
     }
 
-    getDebtTicketsOf(user: User): Observable<DebtTicket[]> {
-        return this.http.get(`${environment.serverUrl}/debt/${user.id}`)
+    // the 'summary' view leaves out the items of the tickets
+    getDebtTicketsOf(user: User, view = 'full'): Observable<DebtTicket[]> {
+        return this.http.get(`${environment.serverUrl}/debt/${user.id}`, { params: { view } })
             .pipe(map(debtsTicket => this.debtTicketPipe.transform(debtsTicket)))
     }
 
-    getCreditTicketsFrom(user: User): Observable<DebtTicket[]> {
-        return this.http.get(`${environment.serverUrl}/credit/${user.id}`)
+    getCreditTicketsFrom(user: User, view = 'full'): Observable<DebtTicket[]> {
+        return this.http.get(`${environment.serverUrl}/credit/${user.id}`, { params: { view } })
             .pipe(map(debtsTicket => this.debtTicketPipe.transform(debtsTicket)))
     }
 
     getPaidTickets(): Observable<DebtTicket[]> {
-        return this.http.get(`${environment.serverUrl}/debt-paid`)
+        return this.getAllPages(`${environment.serverUrl}/debt-paid`)
             .pipe(map(debtsTicket => this.debtTicketPipe.transform(debtsTicket)))
     }
 
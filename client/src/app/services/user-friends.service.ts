@@ -2,6 +2,7 @@ import { Injectable } from '@angular/core';
 import { Observable } from 'rxjs';
 import { User } from '../models/user';
 import { UserFriends } from '../models/user-friends';
+import { Balance } from '../models/balance';
 import { first, map } from 'rxjs/operators';
 import { HttpClient } from '@angular/common/http';
 import { environment } from 'src/environments/environment';
@@ -20,9 +21,29 @@ export class UserFriendsService {
   ) {
   }
 
-  getUserFriends(): Observable<UserFriends> {
+  // the server returns a page of the users whose username starts with the prefix
+  getUserFriends(prefix: string = ''): Observable<UserFriends> {
+    return this.getUserFriendsPage(prefix).pipe(map(page => page.userFriends))
+  }
+
+  // the next page starts at the cursor, which is undefined after the last one
+  getUserFriendsPage(prefix: string = '', cursor?: string): Observable<{ userFriends: UserFriends, nextCursor?: string }> {
+    const loggedUser: User = this.loginService.getLoggedUser()
+    const params = cursor ? { q: prefix, cursor } : { q: prefix }
+    return this.http.get<any[]>(`${environment.serverUrl}/users`, { params, observe: 'response' })
+      .pipe(map(response => ({
+        userFriends: this.userFriendsPipe.transform(response.body, loggedUser),
+        nextCursor: response.headers.get('X-Next-Cursor') || undefined,
+      })))
+  }
+
+  // the open debts and credits with every friend, aggregated by the server
+  getBalances(): Observable<Balance[]> {
     const loggedUser: User = this.loginService.getLoggedUser()
-    return this.http.get(`${environment.serverUrl}/users`)
-      .pipe(map(userFriends => this.userFriendsPipe.transform(userFriends, loggedUser)))
+    return this.http.get<any[]>(`${environment.serverUrl}/balances`)
+      .pipe(map(balances => balances.map(balance => ({
+        ...balance,
+        user: this.userFriendsPipe.transform([balance.user], loggedUser).friends[0],
+      }))))
   }
 }
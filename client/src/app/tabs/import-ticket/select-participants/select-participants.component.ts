@@ -22,14 +22,19 @@ export class SelectParticipantsComponent implements OnInit {
   }
 
   async  ngOnInit() {
-    this.userFriendsObs = this.userFriendsService.getUserFriends()
+    this.search('')
+  }
+
+  search(prefix: string) {
+    this.userFriendsObs = this.userFriendsService.getUserFriends(prefix)
     this.userFriendsObs.subscribe(userFriends => {
       this.userFriends = userFriends
     })
   }
 
   updateParticipants(user: User) {
-    let index: number = this.participants.indexOf(user)
+    // the users are new objects after every search, so they are matched by id
+    let index: number = this.participants.findIndex(participant => participant.id === user.id)
     if (index === -1)
       this.participants.push(user)
     else
@@ -37,7 +42,7 @@ export class SelectParticipantsComponent implements OnInit {
   }
 
   isSelected(user: User): boolean {
-    return this.participants.includes(user)
+    return this.participants.some(participant => participant.id === user.id)
   }
 
 }
\ No newline at end of file
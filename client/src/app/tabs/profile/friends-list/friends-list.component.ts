@@ -1,6 +1,5 @@
 import { Component, OnInit } from '@angular/core';
 import { PopoverController, ToastController } from '@ionic/angular';
-import { Observable } from 'rxjs';
 import { User } from 'src/app/models/user';
 import { UserFriends } from 'src/app/models/user-friends';
 import { UserFriendsService } from 'src/app/services/user-friends.service';
@@ -12,9 +11,10 @@ import {LoginService} from '../../../services/login.service';
   styleUrls: ['./friends-list.component.scss'],
 })
 export class FriendsListComponent implements OnInit {
-  userFriendsObs: Observable<UserFriends>
   userFriends: UserFriends
   loggedUserEmail: string
+  prefix = ''
+  nextCursor: string
   constructor(
     private userFriendsService: UserFriendsService,
     private loginService: LoginService,
@@ -24,9 +24,23 @@ export class FriendsListComponent implements OnInit {
 
   async ngOnInit() {
     this.loggedUserEmail = await (await this.loginService.getLoggedUser()).email
-    this.userFriendsObs = this.userFriendsService.getUserFriends()
-    this.userFriendsObs.subscribe(userFriends => {
-      this.userFriends = userFriends
+    this.search('')
+  }
+
+  search(prefix: string) {
+    this.prefix = prefix
+    this.userFriendsService.getUserFriendsPage(prefix).subscribe(page => {
+      this.userFriends = page.userFriends
+      this.nextCursor = page.nextCursor
+    })
+  }
+
+  // the users come in pages, the next one is loaded when the list is scrolled to its end
+  loadNextPage(event) {
+    this.userFriendsService.getUserFriendsPage(this.prefix, this.nextCursor).subscribe(page => {
+      this.userFriends.friends.push(...page.userFriends.friends)
+      this.nextCursor = page.nextCursor
+      event.target.complete()
     })
   }
 }
\ No newline at end of file
@@ -1,14 +1,11 @@
 import {Component, OnInit} from '@angular/core';
 import {Router} from '@angular/router';
 import {PopoverController} from '@ionic/angular';
-import {Observable} from 'rxjs';
 import {User} from 'src/app/models/user';
 import {UserFriends} from 'src/app/models/user-friends';
 import {UserFriendsService} from 'src/app/services/user-friends.service';
 import {InboxMessage} from '../../models/inbox-message';
-import {DebtTicket} from '../../models/ticket';
 import {LoginService} from '../../services/login.service';
-import {TicketService} from '../../services/ticket.service';
 
 
 @Component({
@@ -18,7 +15,6 @@ import {TicketService} from '../../services/ticket.service';
 })
 
 export class StatusPage {
-    userFriendsObs: Observable<UserFriends>;
     userFriends: UserFriends;
 
     debts = {};
@@ -30,54 +26,26 @@ export class StatusPage {
 
     newMessages = 0;
 
-    private ticketsByFriendObs: Observable<DebtTicket[]>;
-    private ticketsByMeObs: Observable<DebtTicket[]>;
-
     //private inboxMessagesObs: Observable<InboxMessage[]>;
 
 
     constructor(private userFriendsService: UserFriendsService,
-                private ticketService: TicketService,
                 private loginService: LoginService,
                 private router: Router,
                 private popoverController: PopoverController,
 ) {
     }
 
-    updateTotals(user: User) {
-        this.total[user.email] = 0.0;
-        this.total[user.email] -= parseFloat(this.debts[user.email]);
-        this.total[user.email] += parseFloat(this.credits[user.email]);
-        this.total[user.email] = this.total[user.email].toFixed(2);
-    }
-
     async ionViewWillEnter() {
         this.user = this.loginService.getLoggedUser();
-        this.userFriendsObs = this.userFriendsService.getUserFriends();
-        this.userFriendsObs.subscribe(userFriends => {
-            this.userFriends = userFriends;
-            for (const user of this.userFriends.friends) {
-                this.ticketsByFriendObs = this.ticketService.getDebtTicketsOf(user);
-                this.ticketsByFriendObs.subscribe(tArr => {
-                    this.debts[user.email] = 0.0;
-                    tArr.forEach(t => this.debts[user.email] += (t.totalPrice - t.paidPrice));
-                    this.debts[user.email] = this.debts[user.email].toFixed(2);
-                    this.updateTotals(user);
-                });
-
-                this.ticketsByMeObs = this.ticketService.getCreditTicketsFrom(user);
-                this.ticketsByMeObs.subscribe(tArr => {
-                    this.credits[user.email] = 0.0;
-
-                    tArr.forEach(t => this.credits[user.email] += (t.totalPrice - t.paidPrice));
-                    this.credits[user.email] = this.credits[user.email].toFixed(2);
-                        
-                    tArr.forEach(t => console.log('TICKET OWNER:', t.owner));
-
-                    this.updateTotals(user);
-                });
-
+        // a single request for the friends with open debts or credits and their amounts, however many they are
+        this.userFriendsService.getBalances().subscribe(balances => {
+            for (const balance of balances) {
+                this.debts[balance.user.email] = balance.debt.toFixed(2);
+                this.credits[balance.user.email] = balance.credit.toFixed(2);
+                this.total[balance.user.email] = balance.total.toFixed(2);
             }
+            this.userFriends = {friends: balances.map(balance => balance.user)};
             this.noFriends = this.userFriends.friends.length === 0;
         });
         // this.inboxMessagesObs = await this.messagesRepositoryService.retrieveLoggedUserInbox();
@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+from config import TestConfig
+from webapp import create_app, db
+from webapp.api.metrics import QUERY_COUNT_HEADER
+from webapp.api.seed import seed_world, DEFAULT_PASSWORD
+
+PERCENTILES = (50, 95, 99)
+
+
+class TestClientDriver:
+    # the requests go through the whole WSGI stack of the app, in process
+    name = 'test-client'
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, token=None, body=None):
+        started_at = time.perf_counter()
+        response = self.client.open('/api' + path, method=method, headers=_headers(token),
+                                    data=json.dumps(body) if body is not None else None)
+        elapsed = time.perf_counter() - started_at
+        return response.status_code, response.headers, response.get_json(silent=True), elapsed
+
+
+class HTTPDriver:
+    # the requests go to a server started apart, e.g. `python main.py`, seeded with `flask seed`
+    name = 'http'
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def request(self, method, path, token=None, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        http_request = urllib.request.Request(self.url + '/api' + path, data=data, method=method,
+                                              headers=_headers(token))
+        started_at = time.perf_counter()
+        try:
+            with urllib.request.urlopen(http_request) as response:
+                status, headers, payload = response.status, response.headers, response.read()
+        except urllib.error.HTTPError as error:
+            status, headers, payload = error.code, error.headers, error.read()
+        elapsed = time.perf_counter() - started_at
+
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            payload = None
+        return status, headers, payload, elapsed
+
+
+def _headers(token):
+    headers = {'Content-Type': 'application/json'}
+    if token is not None:
+        headers['Authorization'] = 'Bearer {}'.format(token)
+    return headers
+
+
+def _percentile(sorted_values, percentile):
+    # nearest rank
+    index = max(int(round(percentile / 100.0 * len(sorted_values))) - 1, 0)
+    return sorted_values[index]
+
+
+class Session:
+    # a logged user, with the ids its requests refer to
+    def __init__(self, driver, username, password):
+        status, _, payload, _ = driver.request('POST', '/auth', body={'username': username, 'password': password})
+        if status != 200:
+            raise SystemExit("Cannot log in as '{}' ({}).".format(username, status))
+        self.username = username
+        self.token = payload['token']
+
+        _, _, balances, _ = driver.request('GET', '/balances', self.token)
+        debtors = [balance['user']['id'] for balance in balances if balance['credit'] > 0]
+        creditors = [balance['user']['id'] for balance in balances if balance['debt'] > 0]
+        self.debtor_id = debtors[0] if debtors else None
+        self.creditor_id = creditors[0] if creditors else None
+        self.friend_names = [balance['user']['username'] for balance in balances][:3]
+
+        _, _, tickets, _ = driver.request('GET', '/tickets?limit=1&view=summary', self.token)
+        self.ticket_id = tickets[0]['id'] if tickets else None
+
+    def new_ticket(self):
+        participants = [{'username': name} for name in [self.username] + self.friend_names]
+        return {'items': [{'name': 'item{}'.format(i), 'price': 2.5 + i, 'quantity': 1,
+                           'participants': participants[:i + 1]} for i in range(len(participants))]}
+
+
+def endpoints(session):
+    # (name, method, path, body); the ones missing an id in the seeded world are skipped
+    yield 'GET /users', 'GET', '/users', None
+    yield 'GET /users?q=', 'GET', '/users?q=user1', None
+    yield 'GET /tickets', 'GET', '/tickets', None
+    yield 'GET /tickets?view=summary', 'GET', '/tickets?view=summary', None
+    yield 'GET /debts', 'GET', '/debts', None
+    yield 'GET /debts?view=summary', 'GET', '/debts?view=summary', None
+    yield 'GET /credits', 'GET', '/credits', None
+    yield 'GET /debt-paid', 'GET', '/debt-paid', None
+    yield 'GET /my-ticket', 'GET', '/my-ticket', None
+    yield 'GET /balances', 'GET', '/balances', None
+    yield 'GET /settlement-plan', 'GET', '/settlement-plan', None
+    if session.creditor_id is not None:
+        yield 'GET /debt/<id>', 'GET', '/debt/{}'.format(session.creditor_id), None
+    if session.debtor_id is not None:
+        yield 'GET /credit/<id>', 'GET', '/credit/{}'.format(session.debtor_id), None
+    if session.ticket_id is not None:
+        yield 'GET /ticket/<id>', 'GET', '/ticket/{}'.format(session.ticket_id), None
+        yield 'PATCH /ticket/<id>', 'PATCH', '/ticket/{}'.format(session.ticket_id), session.new_ticket()
+    yield 'POST /tickets', 'POST', '/tickets', session.new_ticket()
+
+
+def run_endpoint(driver, sessions, method, path_by_session, body_by_session, n_requests, n_warmup):
+    for i in range(n_warmup):
+        session = sessions[i % len(sessions)]
+        driver.request(method, path_by_session[session], session.token, body_by_session[session])
+
+    latencies, query_counts, statuses = [], [], {}
+    started_at = time.perf_counter()
+    for i in range(n_requests):
+        session = sessions[i % len(sessions)]
+        status, headers, _, elapsed = driver.request(method, path_by_session[session], session.token,
+                                                     body_by_session[session])
+        latencies.append(elapsed)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        if headers.get(QUERY_COUNT_HEADER) is not None:
+            query_counts.append(int(headers[QUERY_COUNT_HEADER]))
+    wall_time = time.perf_counter() - started_at
+
+    latencies.sort()
+    result = {'requests': n_requests, 'statuses': statuses, 'throughput': n_requests / wall_time,
+              'mean': sum(latencies) / len(latencies) * 1000}
+    for percentile in PERCENTILES:
+        result['p{}'.format(percentile)] = _percentile(latencies, percentile) * 1000
+    # the query counts are known only when the server sends the debug headers
+    result['queries'] = sum(query_counts) / len(query_counts) if query_counts else None
+    result['maxQueries'] = max(query_counts) if query_counts else None
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_results(results, baseline):
+    baseline_endpoints = baseline['endpoints'] if baseline is not None else {}
+    print('{:<28} {:>9} {:>9} {:>9} {:>10} {:>8} {:>12}'.format('endpoint', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)',
+                                                              'req/s', 'queries', 'p95 vs base'))
+    for name, result in results['endpoints'].items():
+        compared = baseline_endpoints.get(name)
+        change = '{:+.1f}%'.format((result['p95'] / compared['p95'] - 1) * 100) if compared else '-'
+        queries = '{:.1f}'.format(result['queries']) if result['queries'] is not None else '-'
+        print('{:<28} {:>9.2f} {:>9.2f} {:>9.2f} {:>10.1f} {:>8} {:>12}'.format(
+            name, result['p50'], result['p95'], result['p99'], result['throughput'], queries, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drives every endpoint against a seeded world and reports the '
+                                                 'latency percentiles, the throughput and the query count of each.')
+    parser.add_argument('--url', help='The URL of a running server, seeded with `flask seed`; without it the app '
+                                      'runs in process on a temporary database.')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--tickets', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=200, help='The requests per endpoint.')
+    parser.add_argument('--warmup', type=int, default=10, help='The requests per endpoint before measuring.')
+    parser.add_argument('--sessions', type=int, default=5, help='The requests rotate among the most active users.')
+    parser.add_argument('--first-user-id', type=int, default=1, help='The id of the first seeded user.')
+    parser.add_argument('--password', default=DEFAULT_PASSWORD)
+    parser.add_argument('--output', help='Where to write the results as JSON.')
+    parser.add_argument('--baseline', help='The JSON results of a previous run to compare with.')
+    args = parser.parse_args()
+
+    path = None
+    if args.url is not None:
+        driver = HTTPDriver(args.url)
+        world = None
+    else:
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+
+        class BenchmarkConfig(TestConfig):
+            DEBUG = False
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+            BCRYPT_LOG_ROUNDS = 4
+            SQL_METRICS_HEADERS = True
+            RESPONSE_CACHE_BACKEND = None
+
+        app = create_app(BenchmarkConfig)
+        app.app_context().push()
+        db.create_all()
+        world = seed_world(args.users, args.tickets, seed=args.seed, password=args.password)
+        db.session.remove()
+        driver = TestClientDriver(app)
+
+    try:
+        # the lowest ids are the most active users of the seeded world
+        sessions = [Session(driver, 'user{}'.format(args.first_user_id + i), args.password)
+                    for i in range(args.sessions)]
+
+        plans = {}
+        for session in sessions:
+            for name, method, path_, body in endpoints(session):
+                plans.setdefault(name, (method, {}, {}))
+                plans[name][1][session] = path_
+                plans[name][2][session] = body
+
+        results = {
+            'meta': {
+                'commit': _git_commit(),
+                'timestamp': datetime.utcnow().isoformat(),
+                'python': platform.python_version(),
+                'driver': driver.name,
+                'world': world if world is not None else {'url': args.url},
+                'seed': args.seed,
+                'requests': args.requests,
+                'sessions': args.sessions,
+            },
+            'endpoints': {},
+        }
+        for name, (method, path_by_session, body_by_session) in plans.items():
+            # every session must have the ids the endpoint needs
+            endpoint_sessions = [session for session in sessions if session in path_by_session]
+            results['endpoints'][name] = run_endpoint(driver, endpoint_sessions, method, path_by_session,
+                                                      body_by_session, args.requests, args.warmup)
+    finally:
+        if path is not None:
+            os.remove(path)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    _print_results(results, baseline)
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import argparse
+import random
+import timeit
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from flask_restful import marshal
+
+from webapp.api import fields
+from webapp.api.serializer import compile_fields
+
+
+def random_accountings(n_accountings, n_users, generator):
+    users = [SimpleNamespace(id=i, username='user{}'.format(i)) for i in range(n_users)]
+    start = datetime(2020, 1, 1)
+
+    accountings = []
+    for i in range(n_accountings):
+        items = [SimpleNamespace(id=j, name='item{}'.format(j), quantity=generator.randint(1, 3),
+                                 price=generator.randint(1, 5000) / 100.0,
+                                 participants=generator.sample(users, generator.randint(1, min(4, n_users))))
+                 for j in range(generator.randint(1, 5))]
+        ticket = SimpleNamespace(id=i, timestamp=start + timedelta(minutes=i), items=items)
+        user_from, user_to = generator.sample(users, 2)
+        accountings.append(SimpleNamespace(id=i, totalPrice=generator.randint(1, 5000) / 100.0, paidPrice=0.0,
+                                           ticket=ticket, userFrom=user_from, userTo=user_to))
+    return accountings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares marshal_with and the compiled serializer on /debts-like '
+                                                 'payloads.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generator = random.Random(args.seed)
+    serialize = compile_fields(fields.accounting_fields)
+
+    print('{:>12} {:>14} {:>16} {:>10}'.format('accountings', 'marshal (ms)', 'compiled (ms)', 'speedup'))
+    for n_accountings in args.sizes:
+        accountings = random_accountings(n_accountings, args.users, generator)
+        assert serialize(accountings) == marshal(accountings, fields.accounting_fields)
+
+        marshalled = min(timeit.repeat(lambda: marshal(accountings, fields.accounting_fields), number=1,
+                                       repeat=args.repeat))
+        compiled = min(timeit.repeat(lambda: serialize(accountings), number=1, repeat=args.repeat))
+        print('{:>12} {:>14.3f} {:>16.3f} {:>9.1f}x'.format(n_accountings, marshalled * 1000, compiled * 1000,
+                                                            marshalled / compiled))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+import argparse
+import random
+import timeit
+
+from webapp.api.settlement import plan_settlement, EXACT_PLAN_MAX_MEMBERS
+
+
+def random_positions(n_users, generator):
+    positions = {user: generator.randint(-100000, 100000) for user in range(n_users - 1)}
+    positions[n_users - 1] = -sum(positions.values())
+    return positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the settlement planning time for growing groups.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[5, 10, EXACT_PLAN_MAX_MEMBERS, 100, 1000, 5000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generator = random.Random(args.seed)
+
+    print('{:>8} {:>8} {:>10} {:>12}'.format('members', 'exact', 'transfers', 'best (ms)'))
+    for n_users in args.sizes:
+        positions = random_positions(n_users, generator)
+        transfers = plan_settlement(positions)
+        best = min(timeit.repeat(lambda: plan_settlement(positions), number=1, repeat=args.repeat))
+        print('{:>8} {:>8} {:>10} {:>12.3f}'.format(n_users, str(n_users <= EXACT_PLAN_MAX_MEMBERS),
+                                                    len(transfers), best * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import argparse
+import random
+import timeit
+
+from webapp.api.split import split_receipt
+
+
+def random_receipt(n_items, n_users, generator):
+    users = list(range(n_users))
+    return [(generator.randint(1, 5000) / 100.0, generator.randint(1, 3),
+             generator.sample(users, generator.randint(1, min(6, n_users))))
+            for _ in range(n_items)]
+
+
+def float_split(items):
+    totals = {}
+    for price, quantity, participants in items:
+        price_pro_capite = price * quantity / len(participants)
+        for participant in participants:
+            totals[participant] = totals.get(participant, 0.0) + price_pro_capite
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the receipt split time for growing receipts.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generator = random.Random(args.seed)
+
+    print('{:>8} {:>14} {:>16} {:>22}'.format('items', 'cents (ms)', 'float sum (ms)', 'float total drift'))
+    for n_items in args.sizes:
+        items = random_receipt(n_items, args.users, generator)
+
+        cents = min(timeit.repeat(lambda: split_receipt(items), number=1, repeat=args.repeat))
+        floats = min(timeit.repeat(lambda: float_split(items), number=1, repeat=args.repeat))
+
+        receipt_total = sum(round(price * quantity * 100) for price, quantity, _ in items) / 100.0
+        drift = abs(sum(float_split(items).values()) - receipt_total)
+        print('{:>8} {:>14.3f} {:>16.3f} {:>22.2e}'.format(n_items, cents * 1000, floats * 1000, drift))
+
+
+if __name__ == '__main__':
+    main()
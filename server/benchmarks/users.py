@@ -0,0 +1,72 @@
+import argparse
+import os
+import random
+import string
+import tempfile
+import timeit
+
+from config import TestConfig
+from webapp import create_app, db
+from webapp.api.models import User
+from webapp.api.readers import read_users_page
+
+
+def random_usernames(n_users, generator):
+    # unique names with a shared first letter distribution, like a real directory
+    return ['{}{}'.format(''.join(generator.choices(string.ascii_letters, k=6)), i) for i in range(n_users)]
+
+
+def add_users(n_users, generator):
+    db.session.execute(User.__table__.insert(), [{'username': username, 'password': None}
+                                                 for username in random_usernames(n_users, generator)])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures a /users page, a prefix search and a page deep in the '
+                                                 'directory against the whole directory size.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generator = random.Random(args.seed)
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+
+    class BenchmarkConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+
+    app = create_app(BenchmarkConfig)
+    try:
+        with app.app_context():
+            db.create_all()
+
+            print('{:>8} {:>12} {:>12} {:>12} {:>12}'.format('users', 'page (ms)', 'prefix (ms)', 'deep (ms)',
+                                                             'all (ms)'))
+            n_added = 0
+            for n_users in args.sizes:
+                add_users(n_users - n_added, generator)
+                n_added = n_users
+
+                # the cursor of a page in the middle of the directory
+                cursor = None
+                for _ in range(10):
+                    cursor = read_users_page(cursor=cursor, limit=n_users // 20).next_cursor
+
+                timings = [
+                    lambda: read_users_page(),
+                    lambda: read_users_page('ab'),
+                    lambda: read_users_page(cursor=cursor),
+                    lambda: User.query.all(),
+                ]
+                bests = [min(timeit.repeat(timing, number=1, repeat=args.repeat)) for timing in timings]
+                print('{:>8} {:>12.3f} {:>12.3f} {:>12.3f} {:>12.3f}'.format(n_users, *(best * 1000
+                                                                                       for best in bests)))
+                db.session.expunge_all()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
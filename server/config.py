@@ -11,6 +11,9 @@ class DevConfig(Config):
     SQLALCHEMY_DATABASE_URI = 'sqlite:///database.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = 'secret-key'
+    RESPONSE_CACHE_BACKEND = 'memory'
+    SLOW_QUERY_THRESHOLD_MS = 100
+    INTERNAL_NETWORKS = ['127.0.0.0/8', '::1/128']
 
 
 class TestConfig(Config):
@@ -18,3 +21,4 @@ class TestConfig(Config):
     SQLALCHEMY_DATABASE_URI = 'sqlite:///test.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = 'test-secret-key'
+    PASSWORD_HASH_WORKERS = 0
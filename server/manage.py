@@ -1,8 +1,12 @@
 import os
 
+import click
+from flask_migrate import upgrade
 
 from webapp import create_app, db, migrate
+from webapp.api.balances import rebuild_balances
 from webapp.api.models import User, Ticket, Item
+from webapp.api.seed import seed_world, DEFAULT_PASSWORD
 
 env = os.environ.get('WEBAPP_ENV', 'dev')
 app = create_app('config.%sConfig' % env.capitalize())
@@ -12,4 +16,25 @@ def make_shell_context():
     return dict(app=app, db=db, User=User, Ticket=Ticket, Item=Item, migrate=migrate)
 
 
+@app.cli.command('rebuild-balances')
+@click.option('--check', is_flag=True, help='Only report the drifted balances, without rewriting them.')
+def rebuild_balances_command(check):
+    drifted = rebuild_balances(dry_run=check)
+    for (user_from, user_to), stored, expected in drifted:
+        click.echo('{} -> {}: stored {}, expected {}'.format(user_from, user_to, stored, expected))
+    click.echo('{} drifted balances.'.format(len(drifted)))
 
+
+@app.cli.command('seed')
+@click.option('--users', default=1000, show_default=True, help='The number of users to add.')
+@click.option('--tickets', default=10000, show_default=True, help='The number of tickets to add.')
+@click.option('--seed', default=0, show_default=True, help='The seed of the generator, the same seed adds the same data.')
+@click.option('--paid', default=0.3, show_default=True, help='The fraction of the accountings paid in full.')
+@click.option('--partially-paid', default=0.2, show_default=True, help='The fraction of the accountings paid in part.')
+@click.option('--days', default=365, show_default=True, help='The tickets are spread over the last days.')
+@click.option('--password', default=DEFAULT_PASSWORD, show_default=True, help='The password of every user.')
+def seed_command(users, tickets, seed, paid, partially_paid, days, password):
+    upgrade()
+    counts = seed_world(users, tickets, seed=seed, paid_ratio=paid, partially_paid_ratio=partially_paid, days=days,
+                        password=password)
+    click.echo(', '.join('{} {}'.format(count, name) for name, count in counts.items()) + ' added.')
@@ -0,0 +1,71 @@
+"""initial schema
+
+Revision ID: 3f1c2a9b7d10
+Revises:
+Create Date: 2026-10-18 11:39:20.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9b7d10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=255), nullable=True),
+    sa.Column('password', sa.String(length=255), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('username')
+    )
+    op.create_table('tickets',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.Column('buyer_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['buyer_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('accountings',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('paidPrice', sa.Float(), nullable=True),
+    sa.Column('totalPrice', sa.Float(), nullable=True),
+    sa.Column('ticket_id', sa.Integer(), nullable=False),
+    sa.Column('user_from', sa.Integer(), nullable=False),
+    sa.Column('user_to', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['ticket_id'], ['tickets.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_from'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['user_to'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('items',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=True),
+    sa.Column('price', sa.Float(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=True),
+    sa.Column('ticket_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['ticket_id'], ['tickets.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('users_items',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('items_id', sa.Integer(), nullable=True),
+    sa.Column('users_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['items_id'], ['items.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['users_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('items_id', 'users_id', name='UC_items_id_users_id')
+    )
+
+
+def downgrade():
+    op.drop_table('users_items')
+    op.drop_table('items')
+    op.drop_table('accountings')
+    op.drop_table('tickets')
+    op.drop_table('users')
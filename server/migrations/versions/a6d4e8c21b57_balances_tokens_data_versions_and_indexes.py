@@ -0,0 +1,87 @@
+"""balances, revoked tokens, data versions and the indexes of the pages
+
+Revision ID: a6d4e8c21b57
+Revises: 3f1c2a9b7d10
+Create Date: 2026-10-18 13:02:41.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d4e8c21b57'
+down_revision = '3f1c2a9b7d10'
+branch_labels = None
+depends_on = None
+
+tickets = sa.table('tickets', sa.column('id', sa.Integer()), sa.column('timestamp', sa.DateTime()))
+accountings = sa.table('accountings', sa.column('ticket_id', sa.Integer()), sa.column('timestamp', sa.DateTime()),
+                       sa.column('user_from', sa.Integer()), sa.column('user_to', sa.Integer()),
+                       sa.column('paidPrice', sa.Float()), sa.column('totalPrice', sa.Float()))
+balances = sa.table('balances', sa.column('user_from', sa.Integer()), sa.column('user_to', sa.Integer()),
+                    sa.column('amount', sa.Float()))
+
+
+def upgrade():
+    # every user starts from the version 0
+    op.add_column('users', sa.Column('data_version', sa.Integer(), server_default='0', nullable=False))
+    op.create_index('ix_users_username_lower_id', 'users', [sa.text('lower(username)'), 'id'], unique=False)
+
+    op.create_index('ix_tickets_buyer_id_timestamp_id', 'tickets', ['buyer_id', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_tickets_timestamp_id', 'tickets', ['timestamp', 'id'], unique=False)
+
+    # the accountings take the timestamp of their ticket
+    op.add_column('accountings', sa.Column('timestamp', sa.DateTime(), nullable=True))
+    op.execute(accountings.update().values(
+        timestamp=sa.select([tickets.c.timestamp]).where(tickets.c.id == accountings.c.ticket_id).as_scalar()))
+    op.create_index('ix_accountings_user_to_ticket_id', 'accountings', ['user_to', 'ticket_id'], unique=False)
+    op.create_index('ix_accountings_user_from_ticket_id', 'accountings', ['user_from', 'ticket_id'], unique=False)
+    op.create_index('ix_accountings_user_to_timestamp_id', 'accountings', ['user_to', 'timestamp', 'id'],
+                    unique=False)
+    op.create_index('ix_accountings_user_from_timestamp_id', 'accountings', ['user_from', 'timestamp', 'id'],
+                    unique=False)
+
+    op.create_table('revoked_tokens',
+    sa.Column('jti', sa.String(length=36), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('jti')
+    )
+    op.create_index(op.f('ix_revoked_tokens_expires_at'), 'revoked_tokens', ['expires_at'], unique=False)
+
+    op.create_table('balances',
+    sa.Column('user_from', sa.Integer(), nullable=False),
+    sa.Column('user_to', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['user_from'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_to'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_from', 'user_to')
+    )
+    # the open amounts of the existing accountings, as rebuild_balances computes them
+    op.execute(balances.insert().from_select(
+        ['user_from', 'user_to', 'amount'],
+        sa.select([accountings.c.user_from, accountings.c.user_to,
+                   sa.func.sum(accountings.c.totalPrice - accountings.c.paidPrice)])
+            .where(accountings.c.user_from != accountings.c.user_to)
+            .where(accountings.c.paidPrice < accountings.c.totalPrice)
+            .group_by(accountings.c.user_from, accountings.c.user_to)))
+
+
+def downgrade():
+    op.drop_table('balances')
+    op.drop_index(op.f('ix_revoked_tokens_expires_at'), table_name='revoked_tokens')
+    op.drop_table('revoked_tokens')
+
+    op.drop_index('ix_accountings_user_from_timestamp_id', table_name='accountings')
+    op.drop_index('ix_accountings_user_to_timestamp_id', table_name='accountings')
+    op.drop_index('ix_accountings_user_from_ticket_id', table_name='accountings')
+    op.drop_index('ix_accountings_user_to_ticket_id', table_name='accountings')
+    with op.batch_alter_table('accountings') as batch_op:
+        batch_op.drop_column('timestamp')
+
+    op.drop_index('ix_tickets_timestamp_id', table_name='tickets')
+    op.drop_index('ix_tickets_buyer_id_timestamp_id', table_name='tickets')
+
+    op.drop_index('ix_users_username_lower_id', table_name='users')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('data_version')
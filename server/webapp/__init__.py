@@ -3,6 +3,7 @@ from flask_bcrypt import Bcrypt
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 db = SQLAlchemy()
 migrate = Migrate()
@@ -11,7 +12,11 @@ bcrypt = Bcrypt()
 def create_app(object_name):
     app = Flask(__name__)
     app.config.from_object(object_name)
-    cors = CORS(app)
+    # the number of reverse proxies in front of the app, whose X-Forwarded-For gives the address of the client
+    if app.config.get('PROXY_FIX_X_FOR'):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+    cors = CORS(app, expose_headers=['X-Next-Cursor', 'ETag', 'X-SQL-Query-Count', 'X-SQL-Time-Ms',
+                                     'X-Response-Time-Ms', 'X-Profile-Id', 'X-Trace-Id'])
 
     cors.init_app(app)
     bcrypt.init_app(app)
@@ -20,7 +25,17 @@ def create_app(object_name):
 
 
     from .api import create_module as api_create_module
+    from .api.metrics import request_metrics
+    from .api.profiling import request_profiler
+    from .api.slow_queries import slow_query_log
+    from .api.tracing import tracer
+
+    # the statements are counted and timed per request, on the engine of this app
+    request_metrics.init_app(app, db.get_engine(app))
+    slow_query_log.init_app(app, db.get_engine(app))
+    tracer.init_app(app, db.get_engine(app))
 
     api_create_module(app)
+    request_profiler.init_app(app)
 
     return app
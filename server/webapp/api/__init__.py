@@ -2,7 +2,11 @@ from flask_jwt_extended import JWTManager
 from flask_restful import Api
 from flask import Blueprint
 from .controllers import AuthenticationAPI, UsersAPI, UserAPI, MyTicketAPI, TicketsAPI, TicketAPI, DebtsAPI, DebtAPI, \
-    DebtPaidAPI, CreditsAPI, CreditAPI, PayDebtAPI, CreditPaidAPI, PayAllDebtsAPI
+    DebtPaidAPI, CreditsAPI, CreditAPI, PayDebtAPI, CreditPaidAPI, PayAllDebtsAPI, BalancesAPI, \
+    SettleAccountingsAPI, SettlementPlanAPI, CacheStatsAPI, PasswordStatsAPI, RefreshAPI
+from .cache import response_cache
+from .passwords import password_hasher
+from .tokens import token_denylist
 from flask_injector import FlaskInjector
 
 blueprint_api = Blueprint(
@@ -19,12 +23,20 @@ jwt = JWTManager()
 
 def create_module(app):
     app.config['PROPAGATE_EXCEPTIONS'] = True
+    # only the refresh tokens can be revoked, the access tokens are short lived
+    app.config.setdefault('JWT_BLACKLIST_ENABLED', True)
+    app.config.setdefault('JWT_BLACKLIST_TOKEN_CHECKS', ['refresh'])
 
     app.register_blueprint(blueprint_api)
     rest_api.init_app(app)
     jwt.init_app(app)
+    response_cache.init_app(app)
+    password_hasher.init_app(app)
+    token_denylist.init_app(app)
+    jwt.token_in_blacklist_loader(token_denylist.is_revoked)
 
     rest_api.add_resource(AuthenticationAPI, AuthenticationAPI.resource_path)
+    rest_api.add_resource(RefreshAPI, RefreshAPI.resource_path)
     rest_api.add_resource(UsersAPI, UsersAPI.resource_path)
     rest_api.add_resource(UserAPI, UserAPI.resource_path, endpoint='userapi')
     rest_api.add_resource(MyTicketAPI, MyTicketAPI.resource_path)
@@ -36,7 +48,13 @@ def create_module(app):
     rest_api.add_resource(PayDebtAPI, PayDebtAPI.resource_path)
     rest_api.add_resource(PayAllDebtsAPI, PayAllDebtsAPI.resource_path)
     rest_api.add_resource(CreditPaidAPI, CreditPaidAPI.resource_path)
+    rest_api.add_resource(SettleAccountingsAPI, SettleAccountingsAPI.resource_path)
+    rest_api.add_resource(SettlementPlanAPI, SettlementPlanAPI.resource_path)
+    rest_api.add_resource(CacheStatsAPI, CacheStatsAPI.resource_path)
+    rest_api.add_resource(PasswordStatsAPI, PasswordStatsAPI.resource_path)
+    rest_api.add_resource(CreditsAPI, CreditsAPI.resource_path)
     rest_api.add_resource(CreditAPI, CreditAPI.resource_path)
+    rest_api.add_resource(BalancesAPI, BalancesAPI.resource_path)
 
     FlaskInjector(app, modules=[configure])
 
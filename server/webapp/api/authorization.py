@@ -0,0 +1,64 @@
+from functools import wraps
+
+from injector import inject
+from sqlalchemy import exists, or_
+from werkzeug import exceptions as exc
+
+from .models import Ticket, Accounting
+from .services import UserServiceBase
+from .tracing import traced
+from .. import db
+
+READ = 'read'
+MODIFY = 'modify'
+
+
+@traced
+class AuthorizationService:
+    # request scoped: every decision is taken with a single query and remembered until the end of the request
+
+    @inject
+    def __init__(self, user_service: UserServiceBase):
+        self.user_service = user_service
+        self._decisions = {}
+
+    @staticmethod
+    def _ticket_permission(ticket_id, user_id, action):
+        if action == MODIFY:
+            # only the buyer can change or delete a ticket
+            allowed = Ticket.buyer_id == user_id
+        else:
+            # the buyer and the participants can read it
+            allowed = or_(Ticket.buyer_id == user_id,
+                          exists().where(Accounting.ticket_id == Ticket.id)
+                          .where(or_(Accounting.user_to == user_id, Accounting.user_from == user_id)))
+
+        # None when the ticket does not exist
+        return db.session.query(allowed).filter(Ticket.id == ticket_id).scalar()
+
+    def can_access_ticket(self, ticket_id, action=READ):
+        key = (Ticket.__tablename__, ticket_id, action)
+        if key not in self._decisions:
+            self._decisions[key] = self._ticket_permission(ticket_id, self.user_service.get_logged_user_id(), action)
+        return self._decisions[key]
+
+    def check_ticket(self, ticket_id, action=READ):
+        allowed = self.can_access_ticket(ticket_id, action)
+        if allowed is None:
+            raise exc.NotFound
+        if not allowed:
+            raise exc.Unauthorized
+
+
+def ticket_access(action):
+    # to be put right after jwt_required: the access to the ticket is checked before anything else, so that a
+    # conditional GET never answers 304 on a missing or forbidden ticket
+    def decorator(method):
+        @wraps(method)
+        def checked_method(resource, id, *args, **kwargs):
+            resource.authorization_service.check_ticket(id, action)
+            return method(resource, id, *args, **kwargs)
+
+        return checked_method
+
+    return decorator
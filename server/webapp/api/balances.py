@@ -0,0 +1,93 @@
+from sqlalchemy import event, func, text
+
+from .models import Accounting, Balance
+from .. import db
+
+# amounts are floats, anything below this is considered settled
+BALANCE_EPSILON = 1e-9
+
+
+def _open_amount(total_price, paid_price):
+    if total_price is None:
+        return 0.0
+    return max(total_price - (paid_price or 0.0), 0.0)
+
+
+def _committed_value(state, key):
+    history = state.attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return getattr(state.obj(), key)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _update_balances(session, flush_context):
+    deltas = {}
+
+    def add_delta(user_from, user_to, delta):
+        if user_from != user_to and delta != 0.0:
+            deltas[(user_from, user_to)] = deltas.get((user_from, user_to), 0.0) + delta
+
+    # the flush context contains the orphans deleted by the flush, which are not listed in session.deleted
+    for state, (is_delete, list_only) in flush_context.states.items():
+        if list_only or state.class_ is not Accounting:
+            continue
+
+        accounting = state.obj()
+        if accounting not in session.new:
+            add_delta(_committed_value(state, 'user_from'), _committed_value(state, 'user_to'),
+                      -_open_amount(_committed_value(state, 'totalPrice'), _committed_value(state, 'paidPrice')))
+        if not is_delete:
+            add_delta(accounting.user_from, accounting.user_to,
+                      _open_amount(accounting.totalPrice, accounting.paidPrice))
+
+    if deltas:
+        apply_balance_deltas(session.connection(), deltas)
+
+
+# a single statement adds the delta to the pair or inserts it: concurrent first writes of the same pair cannot both
+# insert it (PostgreSQL 9.5+, SQLite 3.24+)
+_UPSERT_BALANCE = text(
+    'INSERT INTO balances (user_from, user_to, amount) VALUES (:user_from, :user_to, :amount) '
+    'ON CONFLICT (user_from, user_to) DO UPDATE SET amount = balances.amount + excluded.amount'
+)
+
+
+def apply_balance_deltas(connection, deltas):
+    if not deltas:
+        return
+    # the pairs are always written in the same order, so concurrent writers do not deadlock on them
+    connection.execute(_UPSERT_BALANCE, [{'user_from': user_from, 'user_to': user_to, 'amount': delta}
+                                         for (user_from, user_to), delta in sorted(deltas.items())])
+
+
+def compute_balances():
+    open_amount = func.sum(Accounting.totalPrice - Accounting.paidPrice)
+    rows = db.session.query(Accounting.user_from, Accounting.user_to, open_amount) \
+        .filter(Accounting.user_from != Accounting.user_to,
+                Accounting.paidPrice < Accounting.totalPrice) \
+        .group_by(Accounting.user_from, Accounting.user_to) \
+        .all()
+    return {(user_from, user_to): amount for user_from, user_to, amount in rows}
+
+
+def rebuild_balances(dry_run=False):
+    expected = compute_balances()
+    stored = {(balance.user_from, balance.user_to): balance.amount for balance in Balance.query}
+
+    drifted = []
+    for pair in sorted(set(expected.keys()) | set(stored.keys())):
+        if abs(expected.get(pair, 0.0) - stored.get(pair, 0.0)) > BALANCE_EPSILON:
+            drifted.append((pair, stored.get(pair, 0.0), expected.get(pair, 0.0)))
+
+    if not dry_run:
+        Balance.query.delete()
+        db.session.bulk_insert_mappings(Balance, [
+            {'user_from': user_from, 'user_to': user_to, 'amount': amount}
+            for (user_from, user_to), amount in expected.items()
+        ])
+        db.session.commit()
+
+    return drifted
@@ -0,0 +1,199 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, request
+from flask_jwt_extended import get_jwt_identity
+from flask_restful.utils import unpack
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL = 300
+
+
+class MemoryCacheBackend:
+    name = 'memory'
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        user_keys = self._keys_by_user.get(key[0])
+        if user_keys is not None:
+            user_keys.discard(key)
+            if not user_keys:
+                del self._keys_by_user[key[0]]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            self._keys_by_user.setdefault(key[0], set()).add(key)
+
+            # evict the least recently used entries
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                for key in self._keys_by_user.pop(user_id, ()):
+                    self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteCacheBackend:
+    name = 'sqlite'
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+
+        connection = self._connection()
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS response_cache ('
+                               'key TEXT PRIMARY KEY, user_id TEXT, value TEXT, expires_at REAL, accessed_at REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_response_cache_user_id ON response_cache (user_id)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_response_cache_accessed_at '
+                               'ON response_cache (accessed_at)')
+
+    def _connection(self):
+        # sqlite connections cannot be shared between threads, every thread of every worker opens its own
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        connection = self._connection()
+        encoded_key = json.dumps(key)
+        now = time.time()
+
+        row = connection.execute('SELECT value, expires_at FROM response_cache WHERE key = ?',
+                                 (encoded_key,)).fetchone()
+        if row is None:
+            return None
+
+        value, expires_at = row
+        with connection:
+            if expires_at < now:
+                connection.execute('DELETE FROM response_cache WHERE key = ?', (encoded_key,))
+                return None
+            connection.execute('UPDATE response_cache SET accessed_at = ? WHERE key = ?', (now, encoded_key))
+        return json.loads(value)
+
+    def set(self, key, value):
+        connection = self._connection()
+        now = time.time()
+
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?)',
+                               (json.dumps(key), json.dumps(key[0]), json.dumps(value), now + self.ttl, now))
+            # evict the least recently used entries
+            connection.execute('DELETE FROM response_cache WHERE key IN ('
+                               'SELECT key FROM response_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                               (self.max_entries,))
+
+    def invalidate(self, user_ids):
+        connection = self._connection()
+        with connection:
+            connection.executemany('DELETE FROM response_cache WHERE user_id = ?',
+                                   [(json.dumps(user_id),) for user_id in user_ids])
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM response_cache').fetchone()[0]
+
+
+class ResponseCache:
+    backends = {
+        MemoryCacheBackend.name: MemoryCacheBackend,
+        SqliteCacheBackend.name: SqliteCacheBackend,
+    }
+
+    def __init__(self):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        backend = app.config.get('RESPONSE_CACHE_BACKEND')
+        max_entries = app.config.get('RESPONSE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+        ttl = app.config.get('RESPONSE_CACHE_TTL', DEFAULT_TTL)
+
+        if backend is None:
+            self.backend = None
+        elif backend == SqliteCacheBackend.name:
+            self.backend = SqliteCacheBackend(app.config['RESPONSE_CACHE_PATH'], max_entries, ttl)
+        else:
+            self.backend = self.backends[backend](max_entries, ttl)
+
+        self.hits = 0
+        self.misses = 0
+
+    def cached(self, get):
+        # to be put between conditional and serialize_with, it caches the marshalled response
+        @wraps(get)
+        def cached_get(*args, **kwargs):
+            # the version of the user's data conditional read before the data: an entry is never served once a
+            # write made it stale, even if another process misses its invalidation
+            data_version = g.get('data_version')
+            if self.backend is None or data_version is None:
+                return get(*args, **kwargs)
+
+            key = (get_jwt_identity(), data_version, request.endpoint, tuple(sorted(kwargs.items())),
+                   tuple(sorted(request.args.items(multi=True))))
+
+            response = self.backend.get(key)
+            if response is not None:
+                self.hits += 1
+                return response['data'], response['code'], response['headers']
+
+            self.misses += 1
+            data, code, headers = unpack(get(*args, **kwargs))
+            self.backend.set(key, {'data': data, 'code': code, 'headers': dict(headers or {})})
+
+            return data, code, headers
+
+        return cached_get
+
+    def invalidate(self, *user_ids):
+        if self.backend is not None and user_ids:
+            self.backend.invalidate(set(user_ids))
+
+    def stats(self):
+        return {
+            'backend': self.backend.name if self.backend is not None else None,
+            'entries': len(self.backend) if self.backend is not None else 0,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+response_cache = ResponseCache()
@@ -1,14 +1,24 @@
-from flask import jsonify, request
-from flask_jwt_extended import create_access_token, jwt_required
-from flask_restful import Resource, marshal_with, reqparse
+from flask import current_app, jsonify, request
+from flask_jwt_extended import create_access_token, create_refresh_token, get_raw_jwt, jwt_required, \
+    jwt_refresh_token_required
+from flask_restful import Resource, reqparse, inputs
 from injector import inject
 from sqlalchemy.exc import SQLAlchemyError
 from werkzeug import exceptions as exc
 
 from . import fields as fields
 from . import status
+from .authorization import AuthorizationService, READ, MODIFY, ticket_access
+from .cache import response_cache
+from .pagination import NEXT_CURSOR_HEADER, parse_date
+from .passwords import password_hasher
+from .metrics import internal_only
 from .models import User, Ticket
 from .services import TicketService, AccountingService, UserServiceBase
+from .tokens import token_denylist
+from .serializer import serialize_with, serialize_fieldset_with
+from .tracing import traced
+from .versions import conditional
 from .. import db
 
 
@@ -16,25 +26,58 @@ def noAuth():
     raise exc.BadRequest('Missing authentication header.')
 
 
+def parse_page_args():
+    parser = reqparse.RequestParser()
+    parser.add_argument('cursor', type=str, location='args')
+    parser.add_argument('limit', type=inputs.positive, location='args', help='The page size must be a positive integer.')
+    parser.add_argument('from', type=parse_date, location='args', dest='date_from',
+                        help="'from' must be an ISO 8601 date.")
+    parser.add_argument('to', type=parse_date, location='args', dest='date_to',
+                        help="'to' must be an ISO 8601 date.")
+    return parser.parse_args()
+
+
+def parse_users_page_args():
+    parser = reqparse.RequestParser()
+    parser.add_argument('q', type=str, location='args', dest='prefix')
+    parser.add_argument('cursor', type=str, location='args')
+    parser.add_argument('limit', type=inputs.positive, location='args', help='The page size must be a positive integer.')
+    return parser.parse_args()
+
+
+def page_headers(page):
+    if page.next_cursor is None:
+        return {}
+    return {NEXT_CURSOR_HEADER: page.next_cursor}
+
+
+def create_identity_token(user):
+    # the identity is the user id, the username travels in the claims
+    return create_access_token(identity=user.id, user_claims={'username': user.username})
+
+
 class ServicesAPI:
 
     @inject
     def __init__(self, user_service: UserServiceBase, ticket_service: TicketService,
-                 accounting_service: AccountingService):
+                 accounting_service: AccountingService, authorization_service: AuthorizationService):
         self.user_service = user_service
         self.ticket_service = ticket_service
         self.accounting_service = accounting_service
+        self.authorization_service = authorization_service
 
 
+@traced
 class UsersAPI(Resource, ServicesAPI):
     resource_path = '/users'
 
     @jwt_required
-    @marshal_with(fields.user_fields)
+    @serialize_with(fields.user_fields)
     def get(self):
-        return User.query.all(), status.HTTP_200_OK
+        users = self.user_service.search_users(**parse_users_page_args())
+        return users, status.HTTP_200_OK, page_headers(users)
 
-    @marshal_with(fields.user_fields)
+    @serialize_with(fields.user_fields)
     def post(self):
         parser = reqparse.RequestParser()
         parser.add_argument(User.username.key, type=str, required=True, help='You have to include the username!')
@@ -54,16 +97,17 @@ class UsersAPI(Resource, ServicesAPI):
                 raise exc.BadRequest('Username {} already existent.'.format(username))
 
             error = str(error.orig) + " for parameters" + str(error.params)
-            print("An error occurred with the DB.", error)
+            current_app.logger.error('An error occurred with the DB. %s', error)
             raise exc.InternalServerError(str(error))
 
         return new_user, status.HTTP_201_CREATED
 
     @jwt_required
-    @marshal_with(fields.user_fields)
+    @serialize_with(fields.user_fields)
     def delete(self):
         return self.user_service.delete(), status.HTTP_200_OK
 
+@traced
 class AuthenticationAPI(Resource, ServicesAPI):
     resource_path = '/auth'
 
@@ -84,14 +128,36 @@ class AuthenticationAPI(Resource, ServicesAPI):
 
         user = self.user_service.authenticate(username, password)
         if user:
-            access_token = create_access_token(identity=user.id)
-            response = jsonify({"token": access_token, "user": user.id, "username": user.username})
+            access_token = create_identity_token(user)
+            refresh_token = create_refresh_token(identity=user.id)
+            response = jsonify({"token": access_token, "refreshToken": refresh_token, "user": user.id,
+                                "username": user.username})
             response.status_code = status.HTTP_200_OK
             return response
         else:
             raise exc.BadRequest('Wrong email or password.')
 
 
+@traced
+class RefreshAPI(Resource, ServicesAPI):
+    resource_path = '/refresh'
+
+    # a new access token only costs the signature check of the refresh token, instead of a bcrypt one
+    @jwt_refresh_token_required
+    def post(self):
+        user = self.user_service.get_logged_user()
+        if user is None:
+            raise exc.Unauthorized('User not existent.')
+
+        return {'token': create_identity_token(user)}, status.HTTP_200_OK
+
+    @jwt_refresh_token_required
+    def delete(self):
+        token_denylist.revoke(get_raw_jwt())
+        return '', status.HTTP_204_NO_CONTENT
+
+
+@traced
 class UserAPI(Resource):
     resource_path = '/user/<int:id>'
 
@@ -100,11 +166,12 @@ class UserAPI(Resource):
         pass
 
 
+@traced
 class TicketsAPI(Resource, ServicesAPI):
     resource_path = '/tickets'
 
     @jwt_required
-    @marshal_with(fields.ticket_fields)
+    @serialize_with(fields.ticket_fields)
     def post(self):
         parser = reqparse.RequestParser()
         parser.add_argument('items', type=dict, action='append', required=True,
@@ -120,125 +187,225 @@ class TicketsAPI(Resource, ServicesAPI):
 
 
     @jwt_required
-    @marshal_with(fields.ticket_fields)
-    def get(self):
-        tickets = self.ticket_service.get_logged_user_tickets()
-        return tickets
+    @conditional
+    @response_cache.cached
+    @serialize_fieldset_with(fields.ticket_views)
+    def get(self, fieldset):
+        tickets = self.ticket_service.get_logged_user_tickets(with_accountings=fieldset.includes('accountings'),
+                                                              with_items=fieldset.includes('items'),
+                                                              **parse_page_args())
+        return tickets, status.HTTP_200_OK, page_headers(tickets)
 
 
+@traced
 class DebtsAPI(Resource, ServicesAPI):
     resource_path = '/debts'
 
     @jwt_required
-    @marshal_with(fields.accounting_fields)
-    def get(self):
-        accountings = self.accounting_service.get_all_debts_accountings()
-        return accountings
+    @conditional
+    @response_cache.cached
+    @serialize_fieldset_with(fields.accounting_views)
+    def get(self, fieldset):
+        accountings = self.accounting_service.get_all_debts_accountings(with_items=fieldset.includes('ticket', 'items'),
+                                                                        **parse_page_args())
+        return accountings, status.HTTP_200_OK, page_headers(accountings)
 
 
+@traced
 class CreditsAPI(Resource, ServicesAPI):
     resource_path = '/credits'
 
     @jwt_required
-    @marshal_with(fields.accounting_fields)
+    @conditional
+    @response_cache.cached
+    @serialize_fieldset_with(fields.accounting_views)
+    def get(self, fieldset):
+        accountings = self.accounting_service.get_all_credits_accountings(
+            with_items=fieldset.includes('ticket', 'items'), **parse_page_args())
+        return accountings, status.HTTP_200_OK, page_headers(accountings)
+
+
+@traced
+class BalancesAPI(Resource, ServicesAPI):
+    resource_path = '/balances'
+
+    @jwt_required
+    @conditional
+    @response_cache.cached
+    @serialize_with(fields.balance_fields)
     def get(self):
-        accountings = self.accounting_service.get_all_credits_accountings()
-        return accountings
+        balances = self.accounting_service.get_balances()
+        return balances
+
 
+@traced
+class CacheStatsAPI(Resource):
+    resource_path = '/cache-stats'
 
+    @jwt_required
+    @internal_only
+    def get(self):
+        return response_cache.stats(), status.HTTP_200_OK
+
+
+@traced
+class PasswordStatsAPI(Resource):
+    resource_path = '/password-stats'
+
+    @jwt_required
+    @internal_only
+    def get(self):
+        return password_hasher.stats(), status.HTTP_200_OK
+
+
+@traced
 class DebtPaidAPI(Resource, ServicesAPI):
     resource_path = "/debt-paid"
 
     @jwt_required
-    @marshal_with(fields.accounting_fields)
-    def get(self):
-        accountings = self.accounting_service.get_paid_debt_accountings()
-        return accountings
+    @conditional
+    @response_cache.cached
+    @serialize_fieldset_with(fields.accounting_views)
+    def get(self, fieldset):
+        accountings = self.accounting_service.get_paid_debt_accountings(with_items=fieldset.includes('ticket', 'items'),
+                                                                        **parse_page_args())
+        return accountings, status.HTTP_200_OK, page_headers(accountings)
 
 
+@traced
 class DebtAPI(Resource, ServicesAPI):
     resource_path = "/debt/<int:id>"
 
     @jwt_required
-    @marshal_with(fields.accounting_fields)
-    def get(self, id):
-        accountings = self.accounting_service.get_debt_accountings_of(id)
+    @conditional
+    @serialize_fieldset_with(fields.accounting_views)
+    def get(self, id, fieldset):
+        accountings = self.accounting_service.get_debt_accountings_of(
+            id, with_items=fieldset.includes('ticket', 'items'))
         return accountings
 
 
+@traced
 class CreditAPI(Resource, ServicesAPI):
     resource_path = "/credit/<int:id>"
 
     @jwt_required
-    @marshal_with(fields.accounting_fields)
-    def get(self, id):
-        accountings = self.accounting_service.get_credit_accountings_of(id)
+    @conditional
+    @serialize_fieldset_with(fields.accounting_views)
+    def get(self, id, fieldset):
+        accountings = self.accounting_service.get_credit_accountings_of(
+            id, with_items=fieldset.includes('ticket', 'items'))
         return accountings
 
 
+@traced
 class PayDebtAPI(Resource, ServicesAPI):
     resource_path = "/pay-debt/<int:id>"
 
     @jwt_required
-    @marshal_with(fields.accounting_fields)
+    @serialize_with(fields.settlement_fields)
     def get(self, id):
-        accounting = self.accounting_service.pay_debt_accounting(id)
-        return accounting
+        settlement = self.accounting_service.pay_debt_accounting(id)
+        return settlement
 
 
+@traced
 class PayAllDebtsAPI(Resource, ServicesAPI):
     resource_path = "/pay-debts/<int:id>"
 
     @jwt_required
-    @marshal_with(fields.accounting_fields)
+    @serialize_with(fields.settlement_fields)
     def get(self, id):
-        accounting = self.accounting_service.pay_all_debts_accounting_to(id)
-        return accounting
+        settlement = self.accounting_service.pay_all_debts_accounting_to(id)
+        return settlement
 
 
+@traced
 class CreditPaidAPI(Resource, ServicesAPI):
     resource_path = "/credit-paid/<int:id>"
 
     @jwt_required
-    @marshal_with(fields.accounting_fields)
+    @serialize_with(fields.settlement_fields)
     def get(self, id):
-        accounting = self.accounting_service.mark_credit_accounting_paid(id)
-        return accounting
+        settlement = self.accounting_service.mark_credit_accounting_paid(id)
+        return settlement
+
+
+@traced
+class SettleAccountingsAPI(Resource, ServicesAPI):
+    resource_path = "/settle-accountings"
+
+    @jwt_required
+    @serialize_with(fields.settlement_fields)
+    def post(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('ids', type=int, action='append', required=True,
+                            help='You have to include the ids of the accountings to settle!')
 
+        args = parser.parse_args()
+
+        settlement = self.accounting_service.settle_accountings(args['ids'])
+        return settlement, status.HTTP_200_OK
+
+
+@traced
+class SettlementPlanAPI(Resource, ServicesAPI):
+    resource_path = "/settlement-plan"
+
+    @jwt_required
+    @serialize_with(fields.settlement_plan_fields)
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('users', type=int, action='append', location='args')
 
+        args = parser.parse_args()
+
+        plan = self.accounting_service.get_settlement_plan(args['users'])
+        return plan
+
+    @jwt_required
+    @serialize_with(fields.applied_settlement_plan_fields)
+    def post(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('users', type=int, action='append')
+
+        args = parser.parse_args()
+
+        settlement = self.accounting_service.apply_settlement_plan(args['users'])
+        return settlement, status.HTTP_200_OK
+
+
+@traced
 class MyTicketAPI(Resource, ServicesAPI):
     resource_path = "/my-ticket"
 
     @jwt_required
-    @marshal_with(fields.accounting_fields)
-    def get(self):
-        accountings = self.accounting_service.get_logged_user_yourself_accountings()
+    @conditional
+    @response_cache.cached
+    @serialize_fieldset_with(fields.accounting_views)
+    def get(self, fieldset):
+        accountings = self.accounting_service.get_logged_user_yourself_accountings(
+            with_items=fieldset.includes('ticket', 'items'))
         return accountings
 
 
+@traced
 class TicketAPI(Resource, ServicesAPI):
     resource_path = '/ticket/<int:id>'
 
-    @marshal_with(fields.ticket_fields)
     @jwt_required
+    @ticket_access(READ)
+    @conditional
+    @serialize_with(fields.ticket_fields)
     def get(self, id):
-        ticket = Ticket.query.get(id)
+        ticket = self.ticket_service.get_ticket(id)
+        return ticket, status.HTTP_200_OK
 
-        if not ticket:
-            raise exc.NotFound
-
-        for accounting in ticket.accountings:
-            user_id = self.user_service.get_logged_user().id
-            if user_id == accounting.user_from or user_id == accounting.user_to:
-                return ticket, status.HTTP_200_OK
-        raise exc.Unauthorized
-
-    @marshal_with(fields.ticket_fields)
+    @serialize_with(fields.ticket_fields)
     @jwt_required
+    @ticket_access(MODIFY)
     def patch(self, id):
-        ticket = Ticket.query.get(id)
-        if not ticket:
-            raise exc.NotFound
+        ticket = self.ticket_service.get_ticket(id)
 
         parser = reqparse.RequestParser()
         parser.add_argument('items', type=dict, action='append', required=True, help="Can't insert empty receipt!")
@@ -251,15 +418,7 @@ class TicketAPI(Resource, ServicesAPI):
         return updated_ticket, status.HTTP_201_CREATED
 
     @jwt_required
+    @ticket_access(MODIFY)
     def delete(self, id):
-        ticket = Ticket.query.get(id)
-
-        if not ticket:
-            raise exc.NotFound
-
-        for accounting in ticket.accountings:
-            user_id = self.user_service.get_logged_user().id
-            if user_id == accounting.user_from:
-                self.ticket_service.delete_ticket(ticket)
-                return status.HTTP_200_OK
-        raise exc.Unauthorized
+        self.ticket_service.delete_ticket(Ticket.query.get(id))
+        return status.HTTP_200_OK
@@ -1,12 +1,13 @@
+from flask import current_app
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from .exceptions import ApplicationDBError
 from .. import db
 
 
 def transactional(commands):
-    def annotation(*args):
+    def annotation(*args, **kwargs):
         try:
-            return_value = commands(*args)
+            return_value = commands(*args, **kwargs)
             if return_value is not None:
                 return return_value
         except SQLAlchemyError as exc:
@@ -18,7 +19,7 @@ def transactional(commands):
             except:
                 pass
 
-            print("An error occurred with the DB.", error)
+            current_app.logger.error('An error occurred with the DB. %s', error)
 
             raise ApplicationDBError
         except IntegrityError:
@@ -1,4 +1,5 @@
 from .services import *
+from .authorization import AuthorizationService
 
 from flask_injector import request
 from injector import Binder
@@ -8,3 +9,4 @@ def configure(binder: Binder):
     binder.bind(interface=UserServiceBase, to=UserServiceREST, scope=request)
     binder.bind(interface=TicketService, to=TicketService, scope=request)
     binder.bind(interface=AccountingService, to=AccountingService, scope=request)
+    binder.bind(interface=AuthorizationService, to=AuthorizationService, scope=request)
@@ -17,3 +17,46 @@ class ApplicationDBError(exc.HTTPException):
 
         self.code = status.HTTP_500_INTERNAL_SERVER_ERROR
         self.description = "Some error occurred with the DB."
+
+
+class PaginationInputError(exc.HTTPException):
+    def __init__(self, description):
+        super(PaginationInputError, self).__init__()
+
+        self.code = status.HTTP_400_BAD_REQUEST
+        self.description = description
+
+
+class FieldsetInputError(exc.HTTPException):
+    def __init__(self, description):
+        super(FieldsetInputError, self).__init__()
+
+        self.code = status.HTTP_400_BAD_REQUEST
+        self.description = description
+
+
+class AccountingNotFoundError(exc.HTTPException):
+    def __init__(self, description):
+        super(AccountingNotFoundError, self).__init__()
+
+        self.code = status.HTTP_404_NOT_FOUND
+        self.description = description
+
+
+class SettlementInputError(exc.HTTPException):
+    def __init__(self, description):
+        super(SettlementInputError, self).__init__()
+
+        self.code = status.HTTP_400_BAD_REQUEST
+        self.description = description
+
+
+class PasswordHashingBusyError(exc.HTTPException):
+    def __init__(self):
+        super(PasswordHashingBusyError, self).__init__()
+
+        self.code = status.HTTP_429_TOO_MANY_REQUESTS
+        self.description = "Too many logins at the moment, retry in a while."
+
+    def get_headers(self, environ=None):
+        return super(PasswordHashingBusyError, self).get_headers(environ) + [('Retry-After', '1')]
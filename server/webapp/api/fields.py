@@ -9,6 +9,7 @@ user_fields = {
 }
 
 item_fields = {
+    Item.id.key: fields.Integer(),
     Item.name.key: fields.String(),
     Item.quantity.key: fields.Integer(),
     Item.price.key: fields.Float(),
@@ -51,4 +52,58 @@ ticket_fields = {
     'items': fields.List(fields.Nested(item_fields)),
 }
 
+# the summary views leave out the items, so they are not even loaded
+summary_ticket_fields = {
+    Ticket.id.key: fields.Integer(),
+    Ticket.timestamp.key: fields.DateTime(),
+}
+
+accounting_summary_fields = {
+    Accounting.id.key: fields.Integer(),
+    Accounting.totalPrice.key: fields.Float(),
+    Accounting.paidPrice.key: fields.Float(),
+    'ticket': fields.Nested(summary_ticket_fields),
+    'userFrom': fields.Nested(user_fields),
+    'userTo': fields.Nested(user_fields),
+}
+
+ticket_summary_fields = {
+    Ticket.id.key: fields.Integer(),
+    Ticket.timestamp.key: fields.DateTime(),
+    'accountings': fields.List(fields.Nested(small_accounting_fields)),
+}
+
+accounting_views = {
+    'summary': accounting_summary_fields,
+    'full': accounting_fields,
+}
+
+ticket_views = {
+    'summary': ticket_summary_fields,
+    'full': ticket_fields,
+}
+
+
+balance_fields = {
+    'user': fields.Nested(user_fields),
+    'debt': fields.Float(),
+    'credit': fields.Float(),
+    'total': fields.Float(),
+}
+
+settlement_fields = {
+    'settledAccountings': fields.Integer(),
+    'settledAmount': fields.Float(),
+}
+
+transfer_fields = {
+    'payer': fields.Nested(user_fields),
+    'payee': fields.Nested(user_fields),
+    'amount': fields.Float(),
+}
+
+settlement_plan_fields = {
+    'transfers': fields.List(fields.Nested(transfer_fields)),
+}
 
+applied_settlement_plan_fields = dict(settlement_fields, **settlement_plan_fields)
@@ -0,0 +1,224 @@
+import glob
+import hmac
+import ipaddress
+import json
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from werkzeug import exceptions as exc
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+DEFAULT_FLUSH_INTERVAL = 1.0
+# the operational endpoints answer to the requests with METRICS_TOKEN in this header
+DEFAULT_TOKEN_HEADER = 'X-Metrics-Token'
+
+QUERY_COUNT_HEADER = 'X-SQL-Query-Count'
+QUERY_TIME_HEADER = 'X-SQL-Time-Ms'
+RESPONSE_TIME_HEADER = 'X-Response-Time-Ms'
+
+_HISTOGRAMS = (
+    ('http_request_duration_seconds', 'Time spent serving the requests.', DURATION_BUCKETS),
+    ('http_request_sql_queries', 'SQL statements run by the requests.', QUERY_COUNT_BUCKETS),
+    ('http_request_sql_duration_seconds', 'Time spent by the requests waiting for the database.', DURATION_BUCKETS),
+)
+
+
+def _new_series(buckets):
+    return {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+
+
+def _observe(series, buckets, value):
+    # the buckets are stored as plain counts, they are made cumulative when exported
+    for i, upper_bound in enumerate(buckets):
+        if value <= upper_bound:
+            series['buckets'][i] += 1
+            break
+    series['sum'] += value
+    series['count'] += 1
+
+
+def _merge(into, series):
+    into['buckets'] = [a + b for a, b in zip(into['buckets'], series['buckets'])]
+    into['sum'] += series['sum']
+    into['count'] += series['count']
+
+
+def _format_bound(upper_bound):
+    return repr(float(upper_bound))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def is_internal_request():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token is not None:
+        value = request.headers.get(current_app.config.get('METRICS_TOKEN_HEADER', DEFAULT_TOKEN_HEADER))
+        if value is not None and hmac.compare_digest(value.encode(), token.encode()):
+            return True
+
+    # behind a reverse proxy every request comes from the proxy, unless PROXY_FIX_X_FOR restores the address of
+    # the client: no address is trusted unless configured
+    networks = current_app.config.get('INTERNAL_NETWORKS', ())
+    try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network) for network in networks)
+
+
+def internal_only(view):
+    # the latencies, the statement counts and the queue depths are not for the clients of the API
+    @wraps(view)
+    def internal_view(*args, **kwargs):
+        if not is_internal_request():
+            raise exc.Forbidden
+        return view(*args, **kwargs)
+
+    return internal_view
+
+
+class RequestMetrics:
+    # every process counts its own requests; with METRICS_DIR set, each one dumps its figures in a file of that
+    # directory (like the multiprocess mode of the Prometheus client) and /metrics adds them all up
+
+    def __init__(self):
+        self.directory = None
+        self.flush_interval = DEFAULT_FLUSH_INTERVAL
+        self.debug_headers = False
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._series = {name: {} for name, _, _ in _HISTOGRAMS}
+        self._flushed_at = 0.0
+
+    def init_app(self, app, engine):
+        self.directory = app.config.get('METRICS_DIR')
+        self.flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+        self.debug_headers = app.config.get('SQL_METRICS_HEADERS', app.debug)
+        self._reset()
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+        if not event.contains(engine, 'before_cursor_execute', self._before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', internal_only(self.export))
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.metrics_started_at = time.perf_counter()
+
+    @staticmethod
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # the statements outside of a request (e.g. the CLI commands) are not accounted
+        if context is None or not has_request_context() or 'sql_queries' not in g:
+            return
+        g.sql_queries += 1
+        g.sql_time += time.perf_counter() - context.metrics_started_at
+
+    @staticmethod
+    def _before_request():
+        g.request_started_at = time.perf_counter()
+        g.sql_queries = 0
+        g.sql_time = 0.0
+
+    def _after_request(self, response):
+        if 'request_started_at' not in g:
+            return response
+
+        duration = time.perf_counter() - g.request_started_at
+        labels = (request.endpoint or 'unknown', request.method)
+        self.observe(labels, duration, g.sql_queries, g.sql_time)
+
+        if self.debug_headers:
+            response.headers[QUERY_COUNT_HEADER] = str(g.sql_queries)
+            response.headers[QUERY_TIME_HEADER] = '{:.3f}'.format(g.sql_time * 1000)
+            response.headers[RESPONSE_TIME_HEADER] = '{:.3f}'.format(duration * 1000)
+        return response
+
+    def observe(self, labels, duration, sql_queries, sql_time):
+        key = '\t'.join(labels)
+        with self._lock:
+            for (name, _, buckets), value in zip(_HISTOGRAMS, (duration, sql_queries, sql_time)):
+                series = self._series[name].get(key)
+                if series is None:
+                    series = self._series[name][key] = _new_series(buckets)
+                _observe(series, buckets, value)
+
+        if self.directory is not None and time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def _path(self, pid):
+        return os.path.join(self.directory, 'metrics-{}.json'.format(pid))
+
+    def flush(self):
+        with self._lock:
+            data = json.dumps(self._series)
+            self._flushed_at = time.monotonic()
+
+        # the file is replaced atomically, the readers never see half of it
+        path = self._path(os.getpid())
+        with open(path + '.tmp', 'w') as file:
+            file.write(data)
+        os.replace(path + '.tmp', path)
+
+    def collect(self):
+        if self.directory is None:
+            with self._lock:
+                return json.loads(json.dumps(self._series))
+
+        self.flush()
+        collected = {name: {} for name, _, _ in _HISTOGRAMS}
+        # the files of the exited processes are kept, their requests still count
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                with open(path) as file:
+                    process_series = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for name, series_by_key in process_series.items():
+                for key, series in series_by_key.items():
+                    if key in collected.setdefault(name, {}):
+                        _merge(collected[name][key], series)
+                    else:
+                        collected[name][key] = series
+        return collected
+
+    def render(self):
+        collected = self.collect()
+        lines = []
+        for name, description, buckets in _HISTOGRAMS:
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} histogram'.format(name))
+            for key, series in sorted(collected.get(name, {}).items()):
+                endpoint, method = key.split('\t')
+                labels = 'endpoint="{}",method="{}"'.format(_escape(endpoint), _escape(method))
+
+                cumulative = 0
+                for upper_bound, bucket_count in zip(buckets, series['buckets']):
+                    cumulative += bucket_count
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, _format_bound(upper_bound),
+                                                                     cumulative))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, series['count']))
+                lines.append('{}_sum{{{}}} {}'.format(name, labels, repr(float(series['sum']))))
+                lines.append('{}_count{{{}}} {}'.format(name, labels, series['count']))
+        return '\n'.join(lines) + '\n'
+
+    def export(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+request_metrics = RequestMetrics()
@@ -1,6 +1,9 @@
 from datetime import datetime
 
-from .. import db, bcrypt
+from sqlalchemy import event, inspect, select
+
+from .passwords import password_hasher
+from .. import db
 
 
 class User(db.Model):
@@ -8,30 +11,37 @@ class User(db.Model):
     id = db.Column(db.Integer(), primary_key=True)
     username = db.Column(db.String(255), unique=True)
     password = db.Column(db.String(255))
+    # bumped by every write touching the user's data, it is the ETag of his resources
+    data_version = db.Column(db.Integer(), nullable=False, default=0, server_default='0')
 
     def __repr__(self):
         return "<User '{}'>".format(self.username)
 
     def set_password(self, password):
-        self.password = bcrypt.generate_password_hash(password)
+        self.password = password_hasher.hash(password)
 
     def check_password(self, password):
-        try:
-            return bcrypt.check_password_hash(self.password, password)
-        except:
-            return False
+        return password_hasher.check(password, self.password)
+
+
+# the directory is searched and sorted on the lowercase username, ties are broken by the id
+db.Index('ix_users_username_lower_id', db.func.lower(User.username), User.id)
 
 
 class Ticket(db.Model):
     __tablename__ = 'tickets'
+    __table_args__ = (
+        db.Index('ix_tickets_buyer_id_timestamp_id', 'buyer_id', 'timestamp', 'id'),
+        db.Index('ix_tickets_timestamp_id', 'timestamp', 'id'),
+    )
     id = db.Column(db.Integer(), primary_key=True)
     timestamp = db.Column(db.DateTime(), default=datetime.now)
 
     buyer_id = db.Column(db.Integer(), db.ForeignKey('users.id'), nullable=False)
 
     buyer = db.relationship('User', backref='tickets', foreign_keys=buyer_id)
-    items = db.relationship('Item', backref='ticket', lazy='dynamic', cascade='all, delete-orphan',
-                            passive_deletes=True)
+    items = db.relationship('Item', backref='ticket', lazy='select', order_by='Item.id',
+                            cascade='all, delete-orphan', passive_deletes=True)
     accountings = db.relationship('Accounting', backref='ticket', lazy='select', cascade='all, '
                                                                                          'delete-orphan',
                                   passive_deletes=True)
@@ -42,10 +52,19 @@ class Ticket(db.Model):
 
 class Accounting(db.Model):
     __tablename__ = 'accountings'
+    __table_args__ = (
+        db.Index('ix_accountings_user_to_ticket_id', 'user_to', 'ticket_id'),
+        db.Index('ix_accountings_user_from_ticket_id', 'user_from', 'ticket_id'),
+        db.Index('ix_accountings_user_to_timestamp_id', 'user_to', 'timestamp', 'id'),
+        db.Index('ix_accountings_user_from_timestamp_id', 'user_from', 'timestamp', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     paidPrice = db.Column(db.Float, default=0.0)
     totalPrice = db.Column(db.Float)
     ticket_id = db.Column(db.Integer, db.ForeignKey('tickets.id', ondelete='CASCADE'), nullable=False)
+    # a copy of the timestamp of the ticket: the pages of the debts and of the credits are sorted on it, and an
+    # index on the accountings alone serves their order
+    timestamp = db.Column(db.DateTime())
 
     user_from = db.Column(db.Integer(), db.ForeignKey('users.id'), nullable=False)
     user_to = db.Column(db.Integer(), db.ForeignKey('users.id'), nullable=False)
@@ -70,6 +89,48 @@ class Accounting(db.Model):
         return self.__hash__() == other.__hash__()
 
 
+@event.listens_for(Accounting, 'before_insert')
+def _copy_ticket_timestamp(mapper, connection, accounting):
+    if accounting.timestamp is not None:
+        return
+    # the ticket is inserted before its accountings, with its default timestamp
+    if accounting.ticket is not None:
+        accounting.timestamp = accounting.ticket.timestamp
+    else:
+        tickets = Ticket.__table__
+        accounting.timestamp = connection.execute(
+            select([tickets.c.timestamp]).where(tickets.c.id == accounting.ticket_id)).scalar()
+
+
+@event.listens_for(Ticket, 'after_update')
+def _update_accountings_timestamp(mapper, connection, ticket):
+    if inspect(ticket).attrs.timestamp.history.has_changes():
+        accountings = Accounting.__table__
+        connection.execute(accountings.update().where(accountings.c.ticket_id == ticket.id)
+                           .values(timestamp=ticket.timestamp))
+
+
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_tokens'
+    jti = db.Column(db.String(36), primary_key=True)
+    # the expired tokens are rejected anyway, so their rows can be purged
+    expires_at = db.Column(db.DateTime(), nullable=False, index=True)
+
+    def __repr__(self):
+        return "<RevokedToken '{}'>".format(self.jti)
+
+
+class Balance(db.Model):
+    __tablename__ = 'balances'
+    user_from = db.Column(db.Integer(), db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    user_to = db.Column(db.Integer(), db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    amount = db.Column(db.Float, default=0.0, nullable=False)
+
+    def __repr__(self):
+        return "<Balance amount: '{}', user_from: '{}', user_to: '{}'>".format(self.amount, self.user_from,
+                                                                              self.user_to)
+
+
 class Item(db.Model):
     __tablename__ = 'items'
     id = db.Column(db.Integer(), primary_key=True)
@@ -105,6 +166,9 @@ class Item(db.Model):
     def to_dict(self):
         item_dict = {'name': self.name}
 
+        if self.id is not None:
+            item_dict['id'] = self.id
+
         try:
             item_dict['quantity'] = self.quantity
         except:
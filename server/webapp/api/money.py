@@ -0,0 +1,9 @@
+# the amounts are floats in the database and in the API, the computations on them are done in integer cents
+
+
+def to_cents(amount):
+    return int(round(amount * 100))
+
+
+def from_cents(cents):
+    return cents / 100.0
@@ -0,0 +1,121 @@
+import base64
+import binascii
+import sys
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+from .exceptions import PaginationInputError
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+class Page(list):
+    def __init__(self, items, next_cursor=None):
+        super(Page, self).__init__(items)
+        self.next_cursor = next_cursor
+
+
+def encode_cursor(timestamp, id):
+    raw = '{}|{}'.format(timestamp.isoformat(), id)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(id)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise PaginationInputError("Invalid cursor '{}'.".format(cursor))
+
+
+def encode_name_cursor(name, id):
+    raw = '{}|{}'.format(id, name)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_name_cursor(cursor):
+    try:
+        id, name = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+        return name, int(id)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise PaginationInputError("Invalid cursor '{}'.".format(cursor))
+
+
+def parse_date(value):
+    return datetime.fromisoformat(value)
+
+
+def _page_criteria(timestamp_column, id_column, cursor, date_from, date_to):
+    criteria = []
+
+    # 'from' is inclusive, 'to' is exclusive
+    if date_from is not None:
+        criteria.append(timestamp_column >= date_from)
+    if date_to is not None:
+        criteria.append(timestamp_column < date_to)
+
+    # keyset pagination, newest first: continue right before the (timestamp, id) of the last row of the previous
+    # page; the redundant bound on the timestamp alone lets the index seek to it
+    if cursor is not None:
+        timestamp, id = decode_cursor(cursor)
+        criteria.append(timestamp_column <= timestamp)
+        criteria.append(or_(timestamp_column < timestamp,
+                            and_(timestamp_column == timestamp, id_column < id)))
+
+    return criteria
+
+
+def _cut_page(rows, limit, last_key, encode=encode_cursor):
+    # one row more than the page size is fetched, to know whether there is a next page
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    return rows, encode(*last_key(rows[-1]))
+
+
+def paginate_select(session, select, timestamp_column, id_column, cursor=None, limit=None, date_from=None,
+                    date_to=None):
+    # keyset pagination of a Core select, which must contain both the timestamp and the id columns
+    limit = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+
+    for criterion in _page_criteria(timestamp_column, id_column, cursor, date_from, date_to):
+        select = select.where(criterion)
+
+    rows = session.execute(select.order_by(timestamp_column.desc(), id_column.desc()).limit(limit + 1)).fetchall()
+
+    rows, next_cursor = _cut_page(rows, limit, lambda row: (row[timestamp_column], row[id_column]))
+    return Page(rows, next_cursor)
+
+
+def _prefix_criteria(name_column, prefix):
+    # a range instead of LIKE, so that every backend walks the index on the column; the upper bound is the
+    # prefix with its last character incremented
+    if not prefix:
+        return []
+    criteria = [name_column >= prefix]
+    if ord(prefix[-1]) < sys.maxunicode:
+        criteria.append(name_column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+    return criteria
+
+
+def paginate_names(session, select, name_column, id_column, prefix=None, cursor=None, limit=None):
+    # keyset pagination in (name, id) order over the rows whose name starts with the prefix
+    limit = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+
+    criteria = _prefix_criteria(name_column, prefix)
+    if cursor is not None:
+        name, id = decode_name_cursor(cursor)
+        criteria.append(or_(name_column > name, and_(name_column == name, id_column > id)))
+
+    for criterion in criteria:
+        select = select.where(criterion)
+
+    rows = session.execute(select.order_by(name_column, id_column).limit(limit + 1)).fetchall()
+
+    rows, next_cursor = _cut_page(rows, limit, lambda row: (row[name_column], row[id_column]), encode_name_cursor)
+    return Page(rows, next_cursor)
@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+from .exceptions import PasswordHashingBusyError
+
+DEFAULT_LOG_ROUNDS = 12
+# per web worker process: N processes serving the app run N times as many bcrypt workers
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_DEPTH = 16
+
+
+def _to_bytes(value):
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+
+# the functions run in the worker processes, they return the time the work started and how long it took
+def _hash_password(password, rounds):
+    started_at = time.time()
+    password_hash = bcrypt.hashpw(_to_bytes(password), bcrypt.gensalt(rounds)).decode('utf-8')
+    return password_hash, started_at, time.time() - started_at
+
+
+def _check_password(password, password_hash):
+    started_at = time.time()
+    try:
+        matches = bcrypt.checkpw(_to_bytes(password), _to_bytes(password_hash))
+    except (TypeError, ValueError):
+        matches = False
+    return matches, started_at, time.time() - started_at
+
+
+def get_log_rounds(password_hash):
+    # a bcrypt hash is $<version>$<rounds>$<salt and hash>
+    try:
+        return int(_to_bytes(password_hash).split(b'$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class _Timing:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'average': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+        }
+
+
+class PasswordHasher:
+    # bcrypt runs in a pool of processes, so that a burst of logins does not hold the request threads; at most
+    # workers + queue depth requests wait for it, the others are rejected with a 429. The pool is started by the
+    # first hash of the process, so the CLI commands and an app preloaded before forking do not start it
+
+    def __init__(self):
+        self.log_rounds = DEFAULT_LOG_ROUNDS
+        self.workers = 0
+        self._executor = None
+        self._slots = None
+        self._slots_count = 0
+        self._lock = threading.Lock()
+        self._reset_metrics()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # the pool and the locks of the parent are not usable in the child, which starts its own pool
+        self._executor = None
+        self._lock = threading.Lock()
+        if self._slots is not None:
+            self._slots = threading.BoundedSemaphore(self._slots_count)
+
+    def _reset_metrics(self):
+        self.rejected = 0
+        self.queue_wait = _Timing()
+        self.hash_time = _Timing()
+
+    def init_app(self, app):
+        self.shutdown()
+
+        self.log_rounds = app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', DEFAULT_WORKERS)
+        queue_depth = app.config.get('PASSWORD_HASH_QUEUE_DEPTH', DEFAULT_QUEUE_DEPTH)
+
+        # without workers bcrypt runs on the request thread
+        if self.workers:
+            self._slots_count = self.workers + queue_depth
+            self._slots = threading.BoundedSemaphore(self._slots_count)
+
+        self._reset_metrics()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def shutdown(self):
+        # the pending hashes are completed and the workers joined: an executor left behind without its management
+        # thread joined hangs the interpreter at exit
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self._executor = None
+        self._slots = None
+        self.workers = 0
+
+    def _run(self, function, *args):
+        submitted_at = time.time()
+
+        if self._slots is None:
+            result, started_at, seconds = function(*args)
+        else:
+            if not self._slots.acquire(blocking=False):
+                with self._lock:
+                    self.rejected += 1
+                raise PasswordHashingBusyError()
+            try:
+                result, started_at, seconds = self._get_executor().submit(function, *args).result()
+            finally:
+                self._slots.release()
+
+        with self._lock:
+            self.queue_wait.add(max(started_at - submitted_at, 0.0))
+            self.hash_time.add(seconds)
+        return result
+
+    def hash(self, password):
+        return self._run(_hash_password, password, self.log_rounds)
+
+    def check(self, password, password_hash):
+        if not password_hash:
+            return False
+        return self._run(_check_password, password, password_hash)
+
+    def needs_rehash(self, password_hash):
+        return get_log_rounds(password_hash) != self.log_rounds
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'rejected': self.rejected,
+                'queueWait': self.queue_wait.to_dict(),
+                'hashTime': self.hash_time.to_dict(),
+            }
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,209 @@
+import cProfile
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import request
+
+DEFAULT_DIR = 'profiles'
+DEFAULT_HEADER = 'X-Profile'
+DEFAULT_SAMPLING_INTERVAL = 0.001
+DEFAULT_OVERHEAD_BUDGET = 0.01
+DEFAULT_BUDGET_WINDOW = 60.0
+DEFAULT_MAX_FILES = 200
+
+PROFILE_ID_HEADER = 'X-Profile-Id'
+ENDPOINT_ENVIRON_KEY = 'webapp.endpoint'
+
+_UNSAFE_CHARACTERS = re.compile(r'[^A-Za-z0-9_.-]+')
+# the names of the files written by the profiler: <time>-<endpoint>-<method>-<status>-<pid>-<latency>ms.<extension>
+_PROFILE_FILE = re.compile(r'^\d{8}T\d{12}-[A-Za-z0-9_.-]+-\d+ms\.(prof|folded)$')
+
+
+class CProfileSession:
+    # deterministic, every call is counted: the pstats file opens in snakeviz, gprof2dot or pstats itself
+    extension = 'prof'
+
+    def __init__(self, interval):
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+
+    def dump(self, path):
+        self._profile.dump_stats(path)
+
+
+class SamplingSession:
+    # a thread reads the stack of the request thread at every interval, the cost does not grow with the number of
+    # calls; the samples are written as collapsed stacks, the input of flamegraph.pl and speedscope
+
+    extension = 'folded'
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = Counter()
+        self._thread_id = None
+        self._stopped = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                                                 code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self._sampler.join()
+
+    def dump(self, path):
+        with open(path, 'w') as file:
+            for stack, count in self.samples.most_common():
+                file.write('{} {}\n'.format(stack, count))
+
+
+class RequestProfiler:
+    # a WSGI middleware profiling a fraction of the requests (PROFILE_SAMPLE_RATE), and the ones carrying
+    # PROFILE_HEADER with the PROFILE_TOKEN; at most one request per process is profiled at a time, and the
+    # profiled requests take at most PROFILE_OVERHEAD_BUDGET of every PROFILE_BUDGET_WINDOW seconds
+
+    sessions = {
+        'cprofile': CProfileSession,
+        'sampling': SamplingSession,
+    }
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._reset_budget()
+
+    def _reset_budget(self):
+        self.profiled = 0
+        self.skipped = 0
+        self._profiling = False
+        self._window_started_at = time.monotonic()
+        self._window_used = 0.0
+
+    def init_app(self, app):
+        self.sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0.0)
+        self.header = app.config.get('PROFILE_HEADER', DEFAULT_HEADER)
+        self.token = app.config.get('PROFILE_TOKEN')
+        self.directory = app.config.get('PROFILE_DIR', DEFAULT_DIR)
+        self.session_class = self.sessions[app.config.get('PROFILER', 'sampling')]
+        self.interval = app.config.get('PROFILE_SAMPLING_INTERVAL', DEFAULT_SAMPLING_INTERVAL)
+        self.overhead_budget = app.config.get('PROFILE_OVERHEAD_BUDGET', DEFAULT_OVERHEAD_BUDGET)
+        self.budget_window = app.config.get('PROFILE_BUDGET_WINDOW', DEFAULT_BUDGET_WINDOW)
+        self.max_files = app.config.get('PROFILE_MAX_FILES', DEFAULT_MAX_FILES)
+        self._reset_budget()
+
+        self.enabled = bool(self.sample_rate or self.token)
+        if not self.enabled:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        @app.before_request
+        def remember_endpoint():
+            # the middleware runs outside of the request context, the endpoint is passed through the environ
+            request.environ[ENDPOINT_ENVIRON_KEY] = request.endpoint
+
+        app.wsgi_app = self.wrap(app.wsgi_app)
+
+    def _requested(self, environ):
+        if self.token is None:
+            return False
+        value = environ.get('HTTP_' + self.header.upper().replace('-', '_'))
+        return value is not None and hmac.compare_digest(value.encode(), self.token.encode())
+
+    def _acquire(self, environ):
+        if not (self._requested(environ) or random.random() < self.sample_rate):
+            return False
+
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_started_at >= self.budget_window:
+                self._window_started_at = now
+                self._window_used = 0.0
+
+            if self._profiling or self._window_used >= self.overhead_budget * self.budget_window:
+                self.skipped += 1
+                return False
+            self._profiling = True
+            return True
+
+    def _release(self, seconds):
+        with self._lock:
+            self._profiling = False
+            self._window_used += seconds
+            self.profiled += 1
+
+    def wrap(self, wsgi_app):
+        def profiled_wsgi_app(environ, start_response):
+            if not self._acquire(environ):
+                return wsgi_app(environ, start_response)
+
+            name = None
+            started_at = time.perf_counter()
+
+            def start_profiled_response(status, headers, exc_info=None):
+                # the id is returned to the client, the file is named after it once the latency is known
+                nonlocal name
+                name = self._file_name(environ, status)
+                return start_response(status, headers + [(PROFILE_ID_HEADER, name)], exc_info)
+
+            session = self.session_class(self.interval)
+            session.start()
+            try:
+                return wsgi_app(environ, start_profiled_response)
+            finally:
+                session.stop()
+                seconds = time.perf_counter() - started_at
+                self._release(seconds)
+                if name is not None:
+                    self._dump(session, name, seconds)
+
+        return profiled_wsgi_app
+
+    @staticmethod
+    def _file_name(environ, status):
+        endpoint = environ.get(ENDPOINT_ENVIRON_KEY) or 'unknown'
+        return '{}-{}-{}-{}-{}'.format(datetime.utcnow().strftime('%Y%m%dT%H%M%S%f'),
+                                       _UNSAFE_CHARACTERS.sub('_', endpoint), environ.get('REQUEST_METHOD'),
+                                       status.split(' ', 1)[0], os.getpid())
+
+    def _dump(self, session, name, seconds):
+        # the latency is the last tag, it is known only once the response is done
+        session.dump(os.path.join(self.directory, '{}-{}ms.{}'.format(name, int(seconds * 1000),
+                                                                      session.extension)))
+
+        # only the profiles are rotated, PROFILE_DIR may hold other files; their names start with the time
+        file_names = sorted(file_name for file_name in os.listdir(self.directory) if _PROFILE_FILE.match(file_name))
+        for file_name in file_names[:-self.max_files]:
+            try:
+                os.remove(os.path.join(self.directory, file_name))
+            except OSError:
+                pass
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,190 @@
+from sqlalchemy import select, func
+
+from .models import User, Item, Ticket, Accounting, items_users
+from .pagination import Page, paginate_select, paginate_names
+from .. import db
+
+# read-only paths building the responses from Core rows, in the same shape of fields.py, without hydrating
+# any ORM instance
+
+accountings = Accounting.__table__
+tickets = Ticket.__table__
+items = Item.__table__
+users = User.__table__
+users_from = users.alias('users_from')
+users_to = users.alias('users_to')
+# the expression of ix_users_username_lower_id
+username_key = func.lower(users.c.username).label('username_key')
+
+
+class _Users(dict):
+    # the users repeat on almost every row, every one of them is a single dict in the response
+    def get_user(self, id, username):
+        user = self.get(id)
+        if user is None:
+            user = self[id] = {'id': id, 'username': username}
+        return user
+
+
+def _accountings_select():
+    return select([
+        accountings.c.id,
+        accountings.c.totalPrice,
+        accountings.c.paidPrice,
+        accountings.c.ticket_id,
+        accountings.c.timestamp,
+        users_from.c.id.label('user_from_id'),
+        users_from.c.username.label('user_from_username'),
+        users_to.c.id.label('user_to_id'),
+        users_to.c.username.label('user_to_username'),
+    ]).select_from(
+        accountings.join(users_from, accountings.c.user_from == users_from.c.id)
+        .join(users_to, accountings.c.user_to == users_to.c.id)
+    )
+
+
+def _make_accounting(row, known_users):
+    return {
+        'id': row[accountings.c.id],
+        'totalPrice': row[accountings.c.totalPrice],
+        'paidPrice': row[accountings.c.paidPrice],
+        'userFrom': known_users.get_user(row['user_from_id'], row['user_from_username']),
+        'userTo': known_users.get_user(row['user_to_id'], row['user_to_username']),
+    }
+
+
+def _make_ticket(id, timestamp):
+    return {'id': id, 'timestamp': timestamp, 'items': []}
+
+
+def _add_items(tickets_by_id, known_users, *criteria):
+    # the items of the tickets with their participants, a row per participant
+    if not tickets_by_id:
+        return
+
+    query = select([
+        items.c.id,
+        items.c.ticket_id,
+        items.c.name,
+        items.c.quantity,
+        items.c.price,
+        users.c.id.label('participant_id'),
+        users.c.username.label('participant_username'),
+    ]).select_from(
+        items.outerjoin(items_users, items_users.c.items_id == items.c.id)
+        .outerjoin(users, items_users.c.users_id == users.c.id)
+    ).where(items.c.ticket_id.in_(list(tickets_by_id)))
+
+    for criterion in criteria:
+        query = query.where(criterion)
+
+    item = None
+    for row in db.session.execute(query.order_by(items.c.id, users.c.id)):
+        if item is None or item['id'] != row[items.c.id]:
+            item = {
+                'id': row[items.c.id],
+                'name': row[items.c.name],
+                'quantity': row[items.c.quantity],
+                'price': row[items.c.price],
+                'participants': [],
+            }
+            tickets_by_id[row[items.c.ticket_id]]['items'].append(item)
+
+        if row['participant_id'] is not None:
+            item['participants'].append(known_users.get_user(row['participant_id'], row['participant_username']))
+
+
+def _make_accountings(rows, known_users, tickets_by_id):
+    result = []
+    for row in rows:
+        ticket = tickets_by_id.get(row[accountings.c.ticket_id])
+        if ticket is None:
+            ticket = tickets_by_id[row[accountings.c.ticket_id]] = _make_ticket(row[accountings.c.ticket_id],
+                                                                                row[accountings.c.timestamp])
+        accounting = _make_accounting(row, known_users)
+        accounting['ticket'] = ticket
+        result.append(accounting)
+    return result
+
+
+def read_accountings_page(*criteria, with_items=True, cursor=None, limit=None, date_from=None, date_to=None):
+    # accountings are paginated on the timestamp of their ticket, copied on them
+    query = _accountings_select()
+    for criterion in criteria:
+        query = query.where(criterion)
+
+    rows = paginate_select(db.session, query, accountings.c.timestamp, accountings.c.id,
+                           cursor, limit, date_from, date_to)
+
+    known_users = _Users()
+    tickets_by_id = {}
+    page = Page(_make_accountings(rows, known_users, tickets_by_id), rows.next_cursor)
+
+    if with_items:
+        _add_items(tickets_by_id, known_users)
+    return page
+
+
+def read_accountings(*criteria, with_items=True):
+    query = _accountings_select()
+    for criterion in criteria:
+        query = query.where(criterion)
+
+    known_users = _Users()
+    tickets_by_id = {}
+    result = _make_accountings(db.session.execute(query.order_by(accountings.c.id)), known_users, tickets_by_id)
+
+    if with_items:
+        _add_items(tickets_by_id, known_users)
+    return result
+
+
+def read_open_accountings_with_items_of(participant_id, *criteria, with_items=True):
+    query = _accountings_select().where(accountings.c.paidPrice < accountings.c.totalPrice)
+    for criterion in criteria:
+        query = query.where(criterion)
+
+    known_users = _Users()
+    tickets_by_id = {}
+    result = _make_accountings(db.session.execute(query.order_by(accountings.c.id)), known_users, tickets_by_id)
+
+    if with_items:
+        # the tickets list only the items the participant took part in
+        owned_item_ids = select([items_users.c.items_id]).where(items_users.c.users_id == participant_id)
+        _add_items(tickets_by_id, known_users, items.c.id.in_(owned_item_ids))
+    return result
+
+
+def read_tickets_page(buyer_id, with_accountings=True, with_items=True, cursor=None, limit=None, date_from=None,
+                      date_to=None):
+    query = select([tickets.c.id, tickets.c.timestamp]).where(tickets.c.buyer_id == buyer_id)
+    rows = paginate_select(db.session, query, tickets.c.timestamp, tickets.c.id, cursor, limit, date_from, date_to)
+
+    page = Page([], rows.next_cursor)
+    tickets_by_id = {}
+    for row in rows:
+        ticket = tickets_by_id[row[tickets.c.id]] = _make_ticket(row[tickets.c.id], row[tickets.c.timestamp])
+        ticket['accountings'] = []
+        page.append(ticket)
+
+    if not tickets_by_id:
+        return page
+
+    known_users = _Users()
+    if with_accountings:
+        query = _accountings_select().where(accountings.c.ticket_id.in_(list(tickets_by_id))) \
+            .order_by(accountings.c.id)
+        for row in db.session.execute(query):
+            tickets_by_id[row[accountings.c.ticket_id]]['accountings'].append(_make_accounting(row, known_users))
+
+    if with_items:
+        _add_items(tickets_by_id, known_users)
+    return page
+
+
+def read_users_page(prefix=None, cursor=None, limit=None):
+    # the users whose username starts with the prefix, regardless of the case
+    query = select([users.c.id, users.c.username, username_key])
+    rows = paginate_names(db.session, query, username_key, users.c.id, prefix.lower() if prefix else None,
+                          cursor, limit)
+    return Page([{'id': row[users.c.id], 'username': row[users.c.username]} for row in rows], rows.next_cursor)
@@ -0,0 +1,145 @@
+import random
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from sqlalchemy import func, select
+
+from .balances import rebuild_balances
+from .models import User, Item, Ticket, Accounting, items_users
+from .money import from_cents
+from .passwords import password_hasher
+from .split import split_receipt
+from .. import db
+
+DEFAULT_PASSWORD = 'password'
+CHUNK_SIZE = 10000
+
+# the shape of the synthetic world: most tickets have a few items shared by a few friends, some are much bigger
+MAX_GROUP_SIZE = 20
+MAX_ITEMS = 50
+MAX_QUANTITY = 10
+
+
+def _long_tail(generator, alpha, cap):
+    # a pareto distribution starting at 1: small values are the most frequent, the large ones are rare
+    return min(cap, int(generator.paretovariate(alpha)))
+
+
+def _next_id(table):
+    return (db.session.execute(select([func.max(table.c.id)])).scalar() or 0) + 1
+
+
+def _reset_sequences(*tables):
+    # the rows are inserted with their ids, which do not move the sequences behind the primary keys of PostgreSQL:
+    # the next insert of the API would take an id already in use
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for table in tables:
+        db.session.execute("SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+                           "(SELECT COALESCE(MAX(id), 0) + 1 FROM {}), false)".format(table.name),
+                           {'table': table.name})
+
+
+def _insert(table, rows):
+    for start in range(0, len(rows), CHUNK_SIZE):
+        db.session.execute(table.insert(), rows[start:start + CHUNK_SIZE])
+
+
+class _World:
+    def __init__(self, generator, user_ids, popularity_exponent):
+        self.generator = generator
+        self.user_ids = user_ids
+        # a few users buy and take part in most of the tickets
+        self.cumulative_weights = list(accumulate(1.0 / (rank + 1) ** popularity_exponent
+                                                  for rank in range(len(user_ids))))
+
+    def popular_users(self, k):
+        return self.generator.choices(self.user_ids, cum_weights=self.cumulative_weights, k=k)
+
+    def group(self, buyer_id):
+        group = {buyer_id}
+        size = min(_long_tail(self.generator, 1.5, MAX_GROUP_SIZE), len(self.user_ids) - 1)
+        while len(group) < size + 1:
+            group.update(self.popular_users(size + 1 - len(group)))
+        return sorted(group)
+
+    def paid_price(self, total_price, paid_ratio, partially_paid_ratio):
+        draw = self.generator.random()
+        if draw < paid_ratio:
+            return total_price
+        if draw < paid_ratio + partially_paid_ratio:
+            # a cent at least is still open
+            return max(min(round(total_price * self.generator.random(), 2), round(total_price - 0.01, 2)), 0.0)
+        return 0.0
+
+
+def seed_world(n_users, n_tickets, seed=0, paid_ratio=0.3, partially_paid_ratio=0.2, days=365,
+               popularity_exponent=1.0, password=DEFAULT_PASSWORD):
+    # adds n_users users (user<id>, all with the same password) and n_tickets tickets among them, with their items
+    # and accountings; the balances are rebuilt at the end
+    generator = random.Random(seed)
+
+    users = User.__table__
+    first_user_id = _next_id(users)
+    user_ids = list(range(first_user_id, first_user_id + n_users))
+    # bcrypt is slow on purpose, every user shares the same hash
+    password_hash = password_hasher.hash(password)
+    _insert(users, [{'id': id, 'username': 'user{}'.format(id), 'password': password_hash} for id in user_ids])
+
+    world = _World(generator, user_ids, popularity_exponent)
+    start = datetime.utcnow() - timedelta(days=days)
+
+    ticket_rows, item_rows, participant_rows, accounting_rows = [], [], [], []
+    next_ticket_id = _next_id(Ticket.__table__)
+    next_item_id = _next_id(Item.__table__)
+    next_participant_id = _next_id(items_users)
+    next_accounting_id = _next_id(Accounting.__table__)
+
+    for buyer_id in world.popular_users(n_tickets) if n_users > 1 else ():
+        ticket_id = next_ticket_id
+        next_ticket_id += 1
+        timestamp = start + timedelta(seconds=generator.uniform(0, days * 86400))
+        ticket_rows.append({'id': ticket_id, 'buyer_id': buyer_id, 'timestamp': timestamp})
+
+        group = world.group(buyer_id)
+        items = []
+        for _ in range(_long_tail(generator, 1.2, MAX_ITEMS)):
+            participants = generator.sample(group, _long_tail(generator, 1.3, len(group)))
+            price = max(round(generator.lognormvariate(1.0, 1.0), 2), 0.01)
+            quantity = _long_tail(generator, 2.5, MAX_QUANTITY)
+            items.append((price, quantity, participants))
+
+            item_rows.append({'id': next_item_id, 'ticket_id': ticket_id, 'name': 'item{}'.format(next_item_id),
+                              'price': price, 'quantity': quantity})
+            for participant_id in participants:
+                participant_rows.append({'id': next_participant_id, 'items_id': next_item_id,
+                                         'users_id': participant_id})
+                next_participant_id += 1
+            next_item_id += 1
+
+        # the same split of TicketService: the buyer is owed the share of every other participant
+        for participant_id, cents in sorted(split_receipt(items).items()):
+            if participant_id == buyer_id:
+                continue
+            total_price = from_cents(cents)
+            accounting_rows.append({'id': next_accounting_id, 'ticket_id': ticket_id, 'timestamp': timestamp,
+                                    'user_from': buyer_id, 'user_to': participant_id, 'totalPrice': total_price,
+                                    'paidPrice': world.paid_price(total_price, paid_ratio, partially_paid_ratio)})
+            next_accounting_id += 1
+
+    _insert(Ticket.__table__, ticket_rows)
+    _insert(Item.__table__, item_rows)
+    _insert(items_users, participant_rows)
+    _insert(Accounting.__table__, accounting_rows)
+    _reset_sequences(users, Ticket.__table__, Item.__table__, items_users, Accounting.__table__)
+    db.session.commit()
+
+    rebuild_balances()
+
+    return {
+        'users': len(user_ids),
+        'tickets': len(ticket_rows),
+        'items': len(item_rows),
+        'participants': len(participant_rows),
+        'accountings': len(accounting_rows),
+    }
@@ -0,0 +1,233 @@
+from functools import wraps
+from itertools import count
+
+from flask import request
+from flask_restful import fields
+from flask_restful.utils import unpack
+
+from .exceptions import FieldsetInputError
+
+# the formatting of the plain fields, the others fall back to their own output()
+_FORMATTERS = {
+    fields.Integer: int,
+    fields.Float: float,
+    fields.String: str,
+}
+
+_nested_ids = count()
+
+
+def _make_getter(key):
+    # the same lookup of flask_restful's get_value, specialized for the single keys used in fields.py
+    def get(obj):
+        if type(obj) is dict:
+            return obj.get(key)
+        if hasattr(obj, '__iter__') and not hasattr(obj, 'strip'):
+            try:
+                return obj[key]
+            except (IndexError, TypeError, KeyError):
+                pass
+        return getattr(obj, key, None)
+
+    return get
+
+
+def _compile_value(key, field):
+    if isinstance(field, type):
+        field = field()
+
+    if field.attribute is not None or '.' in key:
+        return lambda obj, memo: field.output(key, obj)
+
+    get = _make_getter(key)
+
+    if isinstance(field, fields.Nested):
+        return _compile_nested(get, field)
+
+    if isinstance(field, fields.List) and isinstance(field.container, fields.Nested):
+        return _compile_list(get, field)
+
+    format_value = _FORMATTERS.get(type(field))
+    if format_value is None and type(field) is fields.DateTime:
+        format_value = field.format
+    if format_value is None:
+        return lambda obj, memo: field.output(key, obj)
+
+    default = field.default
+
+    def serialize_value(obj, memo):
+        value = get(obj)
+        if value is None:
+            return default
+        return format_value(value)
+
+    return serialize_value
+
+
+def _compile_nested(get, field):
+    serialize_nested = _compile_object(field.nested)
+    allow_null = field.allow_null
+    default = field.default
+
+    def serialize_value(obj, memo):
+        value = get(obj)
+        if value is None:
+            if allow_null:
+                return None
+            elif default is not None:
+                return default
+        return serialize_nested(value, memo)
+
+    return serialize_value
+
+
+def _compile_list(get, field):
+    container = field.container
+    serialize_nested = _compile_object(container.nested)
+    allow_null = container.allow_null
+    default = field.default
+    container_default = container.default
+
+    def serialize_element(value, memo):
+        if value is None:
+            if allow_null:
+                return None
+            elif container_default is not None:
+                return container_default
+        return serialize_nested(value, memo)
+
+    def serialize_value(obj, memo):
+        value = get(obj)
+        if value is None:
+            return default
+        if isinstance(value, dict) or not hasattr(value, '__iter__') or hasattr(value, 'strip'):
+            return [serialize_nested(value, memo)]
+        return [serialize_element(element, memo) for element in value]
+
+    return serialize_value
+
+
+def _compile_object(spec):
+    # every object is serialized once per response, the repeated ones (e.g. the users) reuse the same dict
+    nested_id = next(_nested_ids)
+    serializers = tuple((key, _compile_object(field) if isinstance(field, dict) else _compile_value(key, field))
+                        for key, field in spec.items())
+
+    def serialize_object(obj, memo):
+        if obj is not None:
+            memo_key = (nested_id, id(obj))
+            cached = memo.get(memo_key)
+            # the object is kept in the memo, so its id cannot be reused by another one
+            if cached is not None and cached[0] is obj:
+                return cached[1]
+
+        result = {key: serialize(obj, memo) for key, serialize in serializers}
+
+        if obj is not None:
+            memo[memo_key] = (obj, result)
+        return result
+
+    return serialize_object
+
+
+def compile_fields(spec):
+    serialize_object = _compile_object(spec)
+
+    def serialize(data):
+        memo = {}
+        if isinstance(data, (list, tuple)):
+            return [serialize_object(element, memo) for element in data]
+        return serialize_object(data, memo)
+
+    return serialize
+
+
+class serialize_with:
+    # a drop-in replacement of marshal_with, the fields are compiled once when the resource is defined
+
+    def __init__(self, spec):
+        self.serialize = compile_fields(spec)
+
+    def __call__(self, f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            resp = f(*args, **kwargs)
+            if isinstance(resp, tuple):
+                data, code, headers = unpack(resp)
+                return self.serialize(data), code, headers
+            return self.serialize(resp)
+
+        return wrapper
+
+
+def _nested_spec(field):
+    if isinstance(field, fields.List):
+        field = field.container
+    if isinstance(field, fields.Nested):
+        return field.nested
+    return None
+
+
+class Fieldset:
+    def __init__(self, spec):
+        self.spec = spec
+        self.serialize = compile_fields(spec)
+
+    def includes(self, *path):
+        # whether the nested field at the given path is rendered, e.g. includes('ticket', 'items')
+        spec = self.spec
+        for key in path:
+            if spec is None or key not in spec:
+                return False
+            spec = _nested_spec(spec[key])
+        return True
+
+
+class Fieldsets:
+    # the views of a resource, narrowed to the requested top level fields; every combination is compiled once
+
+    def __init__(self, views, default_view='full'):
+        self.views = views
+        self.default_view = default_view
+        self._fieldsets = {}
+
+    def select(self, view=None, field_names=None):
+        view = view or self.default_view
+        if view not in self.views:
+            raise FieldsetInputError("Unknown view '{}'.".format(view))
+
+        spec = self.views[view]
+        if field_names:
+            field_names = frozenset(name.strip() for name in field_names.split(','))
+            unknown_names = field_names - set(spec)
+            if unknown_names:
+                raise FieldsetInputError('Unknown fields: {}.'.format(', '.join(sorted(unknown_names))))
+        else:
+            field_names = frozenset(spec)
+
+        key = (view, field_names)
+        fieldset = self._fieldsets.get(key)
+        if fieldset is None:
+            fieldset = self._fieldsets[key] = Fieldset({name: field for name, field in spec.items()
+                                                        if name in field_names})
+        return fieldset
+
+
+class serialize_fieldset_with:
+    # like serialize_with, for the resources accepting the 'view' and 'fields' query parameters: the requested
+    # Fieldset is passed to the resource, so that it loads only what is rendered
+
+    def __init__(self, views):
+        self.fieldsets = Fieldsets(views)
+
+    def __call__(self, f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            fieldset = self.fieldsets.select(request.args.get('view'), request.args.get('fields'))
+            resp = f(*args, fieldset=fieldset, **kwargs)
+            if isinstance(resp, tuple):
+                data, code, headers = unpack(resp)
+                return fieldset.serialize(data), code, headers
+            return fieldset.serialize(resp)
+
+        return wrapper
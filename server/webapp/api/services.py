@@ -1,20 +1,46 @@
 from flask_jwt_extended import get_jwt_identity
 from injector import inject
-from sqlalchemy import and_
-
-from .exceptions import TicketInputError
-from .models import User, Item, Ticket, Accounting
+from sqlalchemy import and_, or_, case, func
+from sqlalchemy.orm import selectinload
+
+from .exceptions import TicketInputError, AccountingNotFoundError, SettlementInputError
+from .balances import BALANCE_EPSILON, apply_balance_deltas
+from .models import User, Item, Ticket, Accounting, Balance
+from .money import from_cents
+from .passwords import password_hasher
+from .settlement import plan_settlement, net_positions_in_cents
+from .split import split_receipt
+from .tracing import traced
+from .versions import touch_users
 from .. import db
 
 from .db_utils import transactional
+from .readers import read_accountings, read_accountings_page, read_open_accountings_with_items_of, \
+    read_tickets_page, read_users_page
 from abc import abstractmethod
 
+# the ids of the settled accountings are updated in chunks, under the bound parameters limit of SQLite
+SETTLE_CHUNK_SIZE = 500
+
+
+# loading strategy fetching the whole graph rendered by fields.py in a fixed number of queries
+def _ticket_graph():
+    return (
+        selectinload(Ticket.items).selectinload(Item.participants),
+        selectinload(Ticket.accountings).joinedload(Accounting.userFrom),
+        selectinload(Ticket.accountings).joinedload(Accounting.userTo),
+    )
+
 
+@traced
 class UserServiceBase:
     @abstractmethod
     def get_logged_user(self):
         raise NotImplementedError
 
+    def get_logged_user_id(self):
+        return self.get_logged_user().id
+
     def authenticate(self, username, password):
         user = User.query.filter_by(username=username).first()
         if not user:
@@ -22,18 +48,31 @@ class UserServiceBase:
         # Do the passwords match
         if not user.check_password(password):
             return None
+
+        # the hashes made with a different cost are upgraded as soon as the password is known
+        if password_hasher.needs_rehash(user.password):
+            user.set_password(password)
+            db.session.commit()
         return user
 
     @transactional
     def delete(self):
         logged_user = self.get_logged_user()
 
+        counterparties = db.session.query(Accounting.user_from).filter(Accounting.user_to == logged_user.id) \
+            .union(db.session.query(Accounting.user_to).filter(Accounting.user_from == logged_user.id))
+        affected_user_ids = {user_id for user_id, in counterparties} | {logged_user.id}
+
         # delete all the tickets he has
         Ticket.query.filter_by(buyer_id=logged_user.id).delete()
 
         # delete all the accounting where he is "userTo"
         Accounting.query.filter_by(user_to=logged_user.id).delete()
 
+        # the bulk deletes above bypass the session, so drop his balances explicitly
+        Balance.query.filter(or_(Balance.user_from == logged_user.id, Balance.user_to == logged_user.id)) \
+            .delete(synchronize_session=False)
+
         # delete himself from being participant
         items = Item.query.filter(Item.participants.any(User.id == logged_user.id)).all()
 
@@ -42,6 +81,7 @@ class UserServiceBase:
 
         db.session.delete(logged_user)
 
+        touch_users(*affected_user_ids)
         db.session.commit()
         return True
 
@@ -54,12 +94,27 @@ class UserServiceBase:
 
         return new_user
 
+    def search_users(self, prefix=None, cursor=None, limit=None):
+        return read_users_page(prefix, cursor, limit)
+
 
+@traced
 class UserServiceREST(UserServiceBase):
+    def __init__(self):
+        self._logged_user = None
+
     def get_logged_user(self):
-        return User.query.get(get_jwt_identity())
+        # the service is request scoped, so the user is loaded at most once per request
+        if self._logged_user is None:
+            self._logged_user = User.query.get(get_jwt_identity())
+        return self._logged_user
+
+    def get_logged_user_id(self):
+        # the id is the identity of the token, no need to load the user
+        return get_jwt_identity()
 
 
+@traced
 class TicketService:
     @inject
     def __init__(self, user_service: UserServiceBase):
@@ -80,144 +135,184 @@ class TicketService:
         for accounting in accountings_list:
             ticket.accountings.append(accounting)
 
-        ticket.buyer_id = self.user_service.get_logged_user().id
+        ticket.buyer_id = self.user_service.get_logged_user_id()
+        affected_user_ids = {ticket.buyer_id} | {accounting.userTo.id for accounting in accountings_list}
 
+        touch_users(*affected_user_ids)
         db.session.add(ticket)
         db.session.commit()
 
-        return ticket
+        return self.get_ticket(ticket.id)
+
+    def get_ticket(self, id):
+        return Ticket.query.options(*_ticket_graph()).filter_by(id=id).first()
 
     @transactional
     def update_ticket(self, ticket, items):
         if ticket is not None:
-            items, new_accountings = self._generate_items_and_accountings(
-                items
-            )
-            # remove all previous items and add the new ones
-            for item in ticket.items:
-                item.participants = []
-            ticket.items = []
+            logged_user = self.user_service.get_logged_user()
 
-            # set new items to the in-update ticket
-            for item in items:
-                item.ticket = ticket
+            participants = self._resolve_participants(items)
+            new_items = [self._generate_item(item, participants) for item in items]
 
-            # transform new_accountings from list to Map, from accounting.user_to to accounting
-            new_accountings_dict = {}
-            for accounting in new_accountings:
-                new_accountings_dict[accounting.userTo] = accounting
+            # diff the incoming items against the stored ones, matching them by item id
+            stored_items = {}
+            for stored_item in Item.query.filter_by(ticket_id=ticket.id).options(selectinload(Item.participants)):
+                stored_items[stored_item.id] = stored_item
 
-            # transform old_accountings (ticket.accountings) to Map
+            for item, new_item in zip(items, new_items):
+                stored_item = stored_items.pop(self._get_item_id(item), None)
+                if stored_item is None:
+                    ticket.items.append(new_item)
+                else:
+                    self._update_item(stored_item, new_item)
+
+            # the stored items which are not in the request anymore have been deleted
+            for stored_item in stored_items.values():
+                stored_item.participants = []
+                ticket.items.remove(stored_item)
+
+            # adjust only the accountings whose total changed, preserving the paidPrice
             old_accountings_dict = {}
             for accounting in ticket.accountings:
-                old_accountings_dict[accounting.userTo] = accounting
-
-            # set the old paidPrice to the new_accountings
-            for user in new_accountings_dict.keys():
-                if user in old_accountings_dict.keys():
-                    new_accountings_dict[user].paidPrice = old_accountings_dict[
-                        user
-                    ].paidPrice
-
-            # check if any old accountings no more exists
-            # eventually, it creates a new accounting with totalPrice equal to 0 while conserving paidPrice
-            for user in old_accountings_dict.keys():
-                if (
-                        user not in new_accountings_dict.keys()
-                        and old_accountings_dict[user].paidPrice > 0.0
-                ):
-                    # transfer the old accounting to the new map
-                    accounting = old_accountings_dict[user]
-                    accounting.totalPrice = 0.0
+                old_accountings_dict[accounting.user_to] = accounting
 
-                    new_accountings_dict[user] = accounting
+            totals = self._split_totals(new_items)
 
-            # eventually create some "Refund ticket"
-            user_lists = list(new_accountings_dict.keys())
-            for user in user_lists:
-                accounting = new_accountings_dict[user]
+            affected_user_ids = {ticket.buyer_id, logged_user.id} | set(old_accountings_dict.keys()) | \
+                                {user.id for user in totals.keys()}
+            for user in totals.keys():
+                if user == logged_user:
+                    continue
 
-                # if an user paid more than if he had to
+                accounting = old_accountings_dict.pop(user.id, None)
+                if accounting is None:
+                    ticket.accountings.append(
+                        Accounting(userFrom=logged_user, userTo=user, totalPrice=totals[user])
+                    )
+                    continue
+
+                if accounting.totalPrice != totals[user]:
+                    accounting.totalPrice = totals[user]
+
+                # if an user paid more than if he had to, create a "Refund ticket"
                 if accounting.totalPrice < accounting.paidPrice:
-                    refund_ticket = Ticket()
+                    self._add_refund_ticket(accounting, user, logged_user)
+                    ticket.accountings.remove(accounting)
 
-                    refund_ticket.buyer = user
+            # the users which are not participants anymore get back what they already paid
+            for accounting in old_accountings_dict.values():
+                if accounting.paidPrice > 0.0:
+                    accounting.totalPrice = 0.0
+                    self._add_refund_ticket(accounting, accounting.userTo, logged_user)
+                ticket.accountings.remove(accounting)
 
-                    refund = Item(
-                        name="Refund ticket update",
-                        price=accounting.paidPrice - accounting.totalPrice,
-                    )
-                    refund.participants.append(self.user_service.get_logged_user())
+            touch_users(*affected_user_ids)
+            db.session.add(ticket)
+            db.session.commit()
+            return self.get_ticket(ticket.id)
 
-                    refund_accounting = Accounting(
-                        totalPrice=refund.price,
-                        userFrom=user,
-                        userTo=self.user_service.get_logged_user(),
-                    )
+    @staticmethod
+    def _get_item_id(item):
+        try:
+            return int(item["id"])
+        except (KeyError, TypeError, ValueError):
+            return None
 
-                    refund_ticket.items.append(refund)
-                    refund_ticket.accountings.append(refund_accounting)
+    @staticmethod
+    def _update_item(stored_item, new_item):
+        if stored_item.name != new_item.name:
+            stored_item.name = new_item.name
+        if stored_item.price != new_item.price:
+            stored_item.price = new_item.price
+        if stored_item.quantity != new_item.quantity:
+            stored_item.quantity = new_item.quantity
+        if set(stored_item.participants) != set(new_item.participants):
+            stored_item.participants = list(new_item.participants)
+
+    @staticmethod
+    def _add_refund_ticket(accounting, user, logged_user):
+        refund_ticket = Ticket()
+
+        refund_ticket.buyer = user
+
+        refund = Item(
+            name="Refund ticket update",
+            price=accounting.paidPrice - accounting.totalPrice,
+        )
+        refund.participants.append(logged_user)
+
+        refund_accounting = Accounting(
+            totalPrice=refund.price,
+            userFrom=user,
+            userTo=logged_user,
+        )
+
+        refund_ticket.items.append(refund)
+        refund_ticket.accountings.append(refund_accounting)
+
+        db.session.add(refund_ticket)
+
+    @staticmethod
+    def _resolve_participants(item_dicts):
+        usernames = set()
+        for item in item_dicts:
+            for participant_name in item.get("participants") or []:
+                usernames.add(participant_name["username"])
+
+        # resolve every participant of the ticket with a single query
+        participants = {}
+        if usernames:
+            for user in User.query.filter(User.username.in_(usernames)).all():
+                participants[user.username] = user
+
+        missing_usernames = sorted(usernames - participants.keys())
+        if len(missing_usernames) == 1:
+            raise TicketInputError("User '{}' does not exist.".format(missing_usernames[0]))
+        elif missing_usernames:
+            raise TicketInputError(
+                "Users {} do not exist.".format(", ".join("'{}'".format(name) for name in missing_usernames))
+            )
 
-                    db.session.add(refund_ticket)
+        return participants
 
-                    # delete accountings from the updating ticket
-                    del new_accountings_dict[user]
+    @staticmethod
+    def _generate_item(item, participants):
+        new_item = Item()
+        try:
+            new_item.name = item["name"]
+        except:
+            raise TicketInputError("One item has no name.")
 
-            # remove all the old accountings and add the new ones
-            # Accounting.query.filter_by(ticket=ticket).delete()
-            for accounting in ticket.accountings:
-                ticket.accountings.remove(accounting)
+        try:
+            new_item.quantity = int(item["quantity"])
+        except:
+            new_item.quantity = 1
 
-            for user in new_accountings_dict.keys():
-                ticket.accountings.append(new_accountings_dict[user])
+        try:
+            new_item.price = float(item["price"])
+        except:
+            raise TicketInputError("Item {} has no price specified.".format(item))
 
-            db.session.add(ticket)
-            db.session.commit()
+        if len(item["participants"]) == 0:
+            raise TicketInputError("Item {} has no participants.".format(item))
+
+        # set participants
+        for participant_name in item["participants"]:
+            new_item.participants.append(participants[participant_name["username"]])
+
+        return new_item
 
-            return ticket
+    @staticmethod
+    def _split_totals(items):
+        totals = split_receipt([(item.price, item.quantity, item.participants) for item in items])
+        return {participant: from_cents(cents) for participant, cents in totals.items()}
 
     def _generate_items_and_accountings(self, item_dicts):
-        accountings = {}
-        new_item_list = []
-        for item in item_dicts:
-            new_item = Item()
-            try:
-                new_item.name = item["name"]
-            except:
-                raise TicketInputError("One item has no name.")
-
-            try:
-                new_item.quantity = int(item["quantity"])
-            except:
-                new_item.quantity = 1
-
-            try:
-                new_item.price = float(item["price"])
-            except:
-                raise TicketInputError("Item {} has no price specified.".format(item))
-
-            n_participants = len(item["participants"])
-            if n_participants == 0:
-                raise TicketInputError("Item {} has no participants.".format(item))
-            price_pro_capite = new_item.price * new_item.quantity / n_participants
-
-            # set participants
-            for participant_name in item["participants"]:
-                participant = User.query.filter_by(
-                    username=participant_name["username"]
-                ).first()
-                if participant is not None:
-                    new_item.participants.append(participant)
-                    if participant in accountings.keys():
-                        accountings[participant] += price_pro_capite
-                    else:
-                        accountings[participant] = price_pro_capite
-                else:
-                    raise TicketInputError(
-                        "User '{}' does not exist.".format(participant_name)
-                    )
+        participants = self._resolve_participants(item_dicts)
+        new_item_list = [self._generate_item(item, participants) for item in item_dicts]
 
-            new_item_list.append(new_item)
+        accountings = self._split_totals(new_item_list)
 
         new_accountings_list = []
         current_user = self.user_service.get_logged_user()
@@ -234,90 +329,212 @@ class TicketService:
         return new_item_list, new_accountings_list
 
     @transactional
-    def get_logged_user_tickets(self):
-        current_user = self.user_service.get_logged_user()
-        tickets = Ticket.query.filter_by(buyer=current_user).order_by(Ticket.timestamp).all()
-        return tickets
+    def get_logged_user_tickets(self, with_accountings=True, with_items=True, cursor=None, limit=None, date_from=None,
+                                date_to=None):
+        return read_tickets_page(self.user_service.get_logged_user_id(), with_accountings, with_items,
+                                 cursor=cursor, limit=limit, date_from=date_from, date_to=date_to)
 
     @transactional
     def delete_ticket(self, ticket):
+        # load the accountings, so that their deletion goes through the session and updates the balances
+        touch_users(ticket.buyer_id, *(accounting.user_to for accounting in ticket.accountings))
         db.session.delete(ticket)
         db.session.commit()
 
 
+@traced
 class AccountingService:
 
     @inject
     def __init__(self, user_service: UserServiceBase):
         self.user_service = user_service
 
-    def get_all_debts_accountings(self):
-        logged_user = self.user_service.get_logged_user()
-
-        return Accounting.query.filter_by(user_to=logged_user.id).all()
-
-    def get_all_credits_accountings(self):
-        logged_user = self.user_service.get_logged_user()
-        return Accounting.query.filter_by(user_from=logged_user.id).all()
-
-    def get_logged_user_yourself_accountings(self):
-        logged_user = self.user_service.get_logged_user()
-        return Accounting.query.filter_by(user_from=logged_user.id, user_to=logged_user.id).all()
-
-    def _filter_non_owned_items(self, user_id, ticket: Ticket):
-        user = User.query.get(user_id)
-        ticket.items = ticket.items.filter(Item.participants.any(User.id == user.id))
-
-    def get_debt_accountings_of(self, id):
-        logged_user = self.user_service.get_logged_user()
-        accountings = Accounting.query.filter_by(
-            user_from=id, user_to=logged_user.id
-        ).filter(Accounting.paidPrice < Accounting.totalPrice).all()
-        for accounting in accountings:
-            self._filter_non_owned_items(id, accounting.ticket)
+    def get_all_debts_accountings(self, with_items=True, cursor=None, limit=None, date_from=None, date_to=None):
+        logged_user_id = self.user_service.get_logged_user_id()
+
+        return read_accountings_page(Accounting.user_to == logged_user_id, with_items=with_items,
+                                     cursor=cursor, limit=limit, date_from=date_from, date_to=date_to)
+
+    def get_all_credits_accountings(self, with_items=True, cursor=None, limit=None, date_from=None, date_to=None):
+        logged_user_id = self.user_service.get_logged_user_id()
+        return read_accountings_page(Accounting.user_from == logged_user_id, with_items=with_items,
+                                     cursor=cursor, limit=limit, date_from=date_from, date_to=date_to)
+
+    def get_logged_user_yourself_accountings(self, with_items=True):
+        logged_user_id = self.user_service.get_logged_user_id()
+        return read_accountings(Accounting.user_from == logged_user_id, Accounting.user_to == logged_user_id,
+                                with_items=with_items)
+
+    def get_balances(self):
+        logged_user_id = self.user_service.get_logged_user_id()
+
+        counterparty_id = case([(Balance.user_from == logged_user_id, Balance.user_to)], else_=Balance.user_from)
+        debt = func.sum(case([(Balance.user_to == logged_user_id, Balance.amount)], else_=0.0))
+        credit = func.sum(case([(Balance.user_from == logged_user_id, Balance.amount)], else_=0.0))
+
+        # the balances table holds the open amount of every pair of users, so this only scans the user's friends
+        rows = db.session.query(User.id, User.username, debt, credit) \
+            .join(Balance, User.id == counterparty_id) \
+            .filter(or_(Balance.user_from == logged_user_id, Balance.user_to == logged_user_id),
+                    Balance.amount > BALANCE_EPSILON) \
+            .group_by(User.id, User.username) \
+            .order_by(User.username) \
+            .all()
+
+        balances = []
+        for user_id, username, user_debt, user_credit in rows:
+            balances.append({
+                'user': {'id': user_id, 'username': username},
+                'debt': user_debt,
+                'credit': user_credit,
+                'total': user_credit - user_debt,
+            })
+        return balances
+
+    def get_debt_accountings_of(self, id, with_items=True):
+        logged_user_id = self.user_service.get_logged_user_id()
+        return read_open_accountings_with_items_of(id, Accounting.user_from == id,
+                                                   Accounting.user_to == logged_user_id, with_items=with_items)
+
+    def get_paid_debt_accountings(self, with_items=True, cursor=None, limit=None, date_from=None, date_to=None):
+        logged_user_id = self.user_service.get_logged_user_id()
+        accountings = read_accountings_page(Accounting.user_to == logged_user_id, 0.0 < Accounting.paidPrice,
+                                            with_items=with_items, cursor=cursor, limit=limit, date_from=date_from,
+                                            date_to=date_to)
         return accountings
 
-    def get_paid_debt_accountings(self):
-        logged_user = self.user_service.get_logged_user()
-        accountings = Accounting.query.filter(
-            Accounting.user_to == logged_user.id, 0.0 < Accounting.paidPrice
-        ).all()
-        return accountings
+    def get_credit_accountings_of(self, id, with_items=True):
+        logged_user_id = self.user_service.get_logged_user_id()
+        return read_open_accountings_with_items_of(id, Accounting.user_from == logged_user_id,
+                                                   Accounting.user_to == id, with_items=with_items)
+
+    @staticmethod
+    def _settle(*criteria):
+        criteria = criteria + (Accounting.paidPrice < Accounting.totalPrice,)
+
+        # the rows are locked until the commit: a concurrent settlement of the same accountings waits for this one,
+        # then finds them paid, so their open amount is subtracted from the balances only once
+        open_accountings = db.session.query(Accounting.id, Accounting.user_from, Accounting.user_to,
+                                            Accounting.totalPrice - Accounting.paidPrice) \
+            .filter(*criteria) \
+            .with_for_update() \
+            .all()
+
+        open_amounts = {}
+        for _, user_from, user_to, amount in open_accountings:
+            open_amounts[(user_from, user_to)] = open_amounts.get((user_from, user_to), 0.0) + amount
+
+        # UPDATE ... SET paidPrice = totalPrice on the locked rows only, the ones added meanwhile are not settled
+        ids = [id for id, _, _, _ in open_accountings]
+        for start in range(0, len(ids), SETTLE_CHUNK_SIZE):
+            Accounting.query.filter(Accounting.id.in_(ids[start:start + SETTLE_CHUNK_SIZE])) \
+                .update({Accounting.paidPrice: Accounting.totalPrice}, synchronize_session=False)
+
+        # the bulk update bypasses the session, so the balances have to be updated explicitly
+        apply_balance_deltas(db.session.connection(), {pair: -amount for pair, amount in open_amounts.items()})
+
+        touch_users(*{user_id for pair in open_amounts for user_id in pair})
+        db.session.commit()
 
-    def get_credit_accountings_of(self, id):
-        logged_user = self.user_service.get_logged_user()
-        accountings = Accounting.query.filter_by(
-            user_from=logged_user.id, user_to=id
-        ).filter(Accounting.paidPrice < Accounting.totalPrice).all()
-        for accounting in accountings:
-            self._filter_non_owned_items(id, accounting.ticket)
-        return accountings
+        return {
+            'settledAccountings': len(ids),
+            'settledAmount': sum(open_amounts.values()),
+        }
+
+    @staticmethod
+    def _check_accounting_exists(**kwargs):
+        if Accounting.query.filter_by(**kwargs).count() == 0:
+            raise AccountingNotFoundError("Accounting {} not found.".format(kwargs['id']))
 
     @transactional
     def pay_debt_accounting(self, id):
-        logged_user = self.user_service.get_logged_user()
-        accounting_to_pay = Accounting.query.filter_by(
-            id=id, user_to=logged_user.id
-        ).first()
-        accounting_to_pay.paidPrice = accounting_to_pay.totalPrice
-        db.session.commit()
+        logged_user_id = self.user_service.get_logged_user_id()
+        settlement = self._settle(Accounting.id == id, Accounting.user_to == logged_user_id)
+        if settlement['settledAccountings'] == 0:
+            self._check_accounting_exists(id=id, user_to=logged_user_id)
+        return settlement
 
     @transactional
     def pay_all_debts_accounting_to(self, id):
-        logged_user = self.user_service.get_logged_user()
-        debts = Accounting.query.filter_by(user_from=id, user_to=logged_user.id).all()
-        credits = Accounting.query.filter_by(user_from=logged_user.id, user_to=id).all()
-        accountings = debts + credits
-        for accounting in accountings:
-            accounting.paidPrice = accounting.totalPrice
-
-        db.session.commit()
+        logged_user_id = self.user_service.get_logged_user_id()
+        return self._settle(or_(and_(Accounting.user_from == id, Accounting.user_to == logged_user_id),
+                                and_(Accounting.user_from == logged_user_id, Accounting.user_to == id)))
 
     @transactional
     def mark_credit_accounting_paid(self, id):
-        logged_user = self.user_service.get_logged_user()
-        accounting_to_pay = Accounting.query.filter_by(
-            id=id, user_from=logged_user.id
-        ).first()
-        accounting_to_pay.paidPrice = accounting_to_pay.totalPrice
-        db.session.commit()
+        logged_user_id = self.user_service.get_logged_user_id()
+        settlement = self._settle(Accounting.id == id, Accounting.user_from == logged_user_id)
+        if settlement['settledAccountings'] == 0:
+            self._check_accounting_exists(id=id, user_from=logged_user_id)
+        return settlement
+
+    @transactional
+    def settle_accountings(self, ids):
+        logged_user_id = self.user_service.get_logged_user_id()
+        return self._settle(Accounting.id.in_(ids),
+                            or_(Accounting.user_to == logged_user_id, Accounting.user_from == logged_user_id))
+
+    @staticmethod
+    def _settlement_group(logged_user_id, user_ids):
+        # the group is made of the logged user and everyone the logged user has an open balance with, or some of them
+        counterparty_id = case([(Balance.user_from == logged_user_id, Balance.user_to)], else_=Balance.user_from)
+        rows = db.session.query(counterparty_id) \
+            .filter(or_(Balance.user_from == logged_user_id, Balance.user_to == logged_user_id),
+                    Balance.amount > BALANCE_EPSILON) \
+            .distinct()
+        counterparties = {user_id for user_id, in rows}
+
+        if not user_ids:
+            return counterparties | {logged_user_id}
+
+        strangers = set(user_ids) - counterparties - {logged_user_id}
+        if strangers:
+            raise SettlementInputError("No open accounting with the users {}.".format(sorted(strangers)))
+        return set(user_ids) | {logged_user_id}
+
+    @staticmethod
+    def _plan_settlement_of(logged_user_id, group):
+        # only the balances of the logged user are settled, never the ones among the others
+        group_balances = (Balance.user_from.in_(group), Balance.user_to.in_(group), Balance.amount > BALANCE_EPSILON,
+                          or_(Balance.user_from == logged_user_id, Balance.user_to == logged_user_id))
+
+        # the net position of every member is aggregated by the database over the balances inside the group
+        positions = {}
+        credits = db.session.query(Balance.user_from, func.sum(Balance.amount)) \
+            .filter(*group_balances) \
+            .group_by(Balance.user_from)
+        for user_id, amount in credits:
+            positions[user_id] = positions.get(user_id, 0.0) + amount
+        debts = db.session.query(Balance.user_to, func.sum(Balance.amount)) \
+            .filter(*group_balances) \
+            .group_by(Balance.user_to)
+        for user_id, amount in debts:
+            positions[user_id] = positions.get(user_id, 0.0) - amount
+
+        transfers = plan_settlement(net_positions_in_cents(positions))
+
+        users = {}
+        if transfers:
+            for user in User.query.filter(User.id.in_(positions.keys())):
+                users[user.id] = {'id': user.id, 'username': user.username}
+
+        return [{'payer': users[debtor], 'payee': users[creditor], 'amount': from_cents(cents)}
+                for debtor, creditor, cents in transfers]
+
+    def get_settlement_plan(self, user_ids=None):
+        logged_user_id = self.user_service.get_logged_user_id()
+        group = self._settlement_group(logged_user_id, user_ids)
+        return {'transfers': self._plan_settlement_of(logged_user_id, group)}
+
+    @transactional
+    def apply_settlement_plan(self, user_ids=None):
+        logged_user_id = self.user_service.get_logged_user_id()
+        group = self._settlement_group(logged_user_id, user_ids)
+        transfers = self._plan_settlement_of(logged_user_id, group)
+
+        # once the transfers are done, every open accounting of the logged user inside the group is paid
+        settlement = self._settle(Accounting.user_from.in_(group), Accounting.user_to.in_(group),
+                                  Accounting.user_from != Accounting.user_to,
+                                  or_(Accounting.user_from == logged_user_id, Accounting.user_to == logged_user_id))
+        settlement['transfers'] = transfers
+        return settlement
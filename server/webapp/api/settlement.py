@@ -0,0 +1,95 @@
+import heapq
+
+from .money import to_cents
+
+# groups up to this size are planned exactly, the exact planner is exponential in the number of members
+EXACT_PLAN_MAX_MEMBERS = 12
+
+
+def net_positions_in_cents(positions):
+    cents = {user: to_cents(amount) for user, amount in positions.items()}
+    cents = {user: amount for user, amount in cents.items() if amount != 0}
+
+    # rounding can leave a residue of a few cents, it is charged to the largest position
+    residue = sum(cents.values())
+    if residue != 0:
+        largest = max(cents, key=lambda user: abs(cents[user]))
+        cents[largest] -= residue
+        if cents[largest] == 0:
+            del cents[largest]
+    return cents
+
+
+def _greedy_plan(positions):
+    creditors = [(-amount, user) for user, amount in positions.items() if amount > 0]
+    debtors = [(amount, user) for user, amount in positions.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    # the largest debtor pays the largest creditor, at least one of them is settled by every transfer
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((debtor, creditor, amount))
+
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+    return transfers
+
+
+def _zero_sum_groups(positions):
+    users = list(positions.keys())
+    n_users = len(users)
+    full_mask = (1 << n_users) - 1
+
+    # best[mask] is the largest number of zero-sum groups the users in mask can be split into
+    sums = [0] * (full_mask + 1)
+    best = [0] * (full_mask + 1)
+    removed_bit = [0] * (full_mask + 1)
+    for mask in range(1, full_mask + 1):
+        lowest_bit = mask & -mask
+        sums[mask] = sums[mask ^ lowest_bit] + positions[users[lowest_bit.bit_length() - 1]]
+
+        best[mask] = -1
+        for i in range(n_users):
+            bit = 1 << i
+            if mask & bit and best[mask ^ bit] > best[mask]:
+                best[mask] = best[mask ^ bit]
+                removed_bit[mask] = bit
+        if sums[mask] == 0:
+            best[mask] += 1
+
+    groups = []
+    group = []
+    mask = full_mask
+    while mask:
+        bit = removed_bit[mask]
+        group.append(users[bit.bit_length() - 1])
+        mask ^= bit
+        if sums[mask] == 0:
+            groups.append(group)
+            group = []
+    return groups
+
+
+# positions map every user to the cents he is owed (negative if he owes them), the plan is a list of
+# (debtor, creditor, cents) transfers.
+# A group of n users which cannot be split in zero-sum subgroups always needs n - 1 transfers, so small groups
+# are first split in as many zero-sum subgroups as possible, which gives the minimum number of transfers.
+# Larger groups are planned greedily, which takes at most n - 1 transfers.
+def plan_settlement(positions):
+    positions = {user: amount for user, amount in positions.items() if amount != 0}
+
+    if len(positions) <= EXACT_PLAN_MAX_MEMBERS:
+        groups = _zero_sum_groups(positions)
+    else:
+        groups = [list(positions.keys())]
+
+    transfers = []
+    for group in groups:
+        transfers += _greedy_plan({user: positions[user] for user in group})
+    return transfers
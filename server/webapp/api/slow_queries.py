@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import re
+import sys
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+DEFAULT_LOG_PATH = 'slow-queries.log'
+DEFAULT_LOG_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_LOG_BACKUPS = 5
+
+_WHITESPACE = re.compile(r'\s+')
+_PLACEHOLDER_LISTS = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_EXPLAINABLE = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+# the tables read without an index: 'SCAN accountings' in SQLite, 'Seq Scan on accountings' in PostgreSQL
+_FULL_SCANS = re.compile(r'^\W*SCAN (?:TABLE )?(\w+)(?!.*\bUSING\b.*\bINDEX\b)|\bSeq Scan on (\w+)')
+
+# the modules whose frames locate a statement: the resource serving the request, the service method and the
+# innermost function of the application
+_RESOURCES_MODULE = 'webapp.api.controllers'
+_SERVICES_MODULE = 'webapp.api.services'
+_APPLICATION_PACKAGE = 'webapp.'
+
+logger = logging.getLogger('webapp.slow_queries')
+logger.propagate = False
+
+
+def normalize_statement(statement):
+    # the same statement with different literals or IN lists of different lengths is the same slow query
+    statement = _WHITESPACE.sub(' ', statement).strip()
+    statement = _LITERALS.sub('?', statement)
+    return _PLACEHOLDER_LISTS.sub('(?, ...)', statement)
+
+
+def parameter_shapes(parameters, executemany=False):
+    # the types of the bound values, never the values themselves
+    if executemany:
+        return {'rows': len(parameters), 'row': parameter_shapes(parameters[0]) if parameters else None}
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    return [type(value).__name__ for value in parameters or ()]
+
+
+def _function_name(frame):
+    owner = frame.f_locals.get('self')
+    if owner is not None:
+        return '{}.{}'.format(type(owner).__name__, frame.f_code.co_name)
+    return '{}.{}'.format(frame.f_globals.get('__name__'), frame.f_code.co_name)
+
+
+def find_origin():
+    resource = service = caller = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith(_APPLICATION_PACKAGE) and module != __name__:
+            if caller is None:
+                caller = _function_name(frame)
+            if module == _SERVICES_MODULE and service is None:
+                service = _function_name(frame)
+            elif module == _RESOURCES_MODULE:
+                resource = _function_name(frame)
+        frame = frame.f_back
+    return {'resource': resource, 'service': service, 'caller': caller}
+
+
+def full_scans(plan):
+    tables = []
+    for line in plan:
+        match = _FULL_SCANS.search(line)
+        if match:
+            tables.append(match.group(1) or match.group(2))
+    return tables
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(dict(record.slow_query, timestamp=datetime.utcfromtimestamp(record.created).isoformat()),
+                          default=str)
+
+
+class SlowQueryLog:
+    # every statement slower than SLOW_QUERY_THRESHOLD_MS is written, with its plan and where it comes from, as a
+    # JSON line of a rotating file
+
+    def __init__(self):
+        self.threshold = None
+        self._handler = None
+
+    def init_app(self, app, engine):
+        self.shutdown()
+
+        threshold_ms = app.config.get('SLOW_QUERY_THRESHOLD_MS')
+        self.threshold = threshold_ms / 1000.0 if threshold_ms is not None else None
+        if self.threshold is None:
+            return
+
+        path = app.config.get('SLOW_QUERY_LOG_PATH', DEFAULT_LOG_PATH)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        max_bytes = app.config.get('SLOW_QUERY_LOG_MAX_BYTES', DEFAULT_LOG_MAX_BYTES)
+        backups = app.config.get('SLOW_QUERY_LOG_BACKUPS', DEFAULT_LOG_BACKUPS)
+        self._handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, delay=True)
+        self._handler.setFormatter(JSONFormatter())
+        logger.addHandler(self._handler)
+        logger.setLevel(logging.WARNING)
+
+        if not event.contains(engine, 'before_cursor_execute', self._before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def shutdown(self):
+        if self._handler is not None:
+            logger.removeHandler(self._handler)
+            self._handler.close()
+        self._handler = None
+        self.threshold = None
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.slow_query_started_at = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.threshold is None or context is None:
+            return
+
+        duration = time.perf_counter() - context.slow_query_started_at
+        if duration < self.threshold:
+            return
+
+        plan = self.explain(conn, statement, parameters[0] if executemany and parameters else parameters)
+        slow_query = {
+            'durationMs': round(duration * 1000, 3),
+            'thresholdMs': round(self.threshold * 1000, 3),
+            'statement': normalize_statement(statement),
+            'parameters': parameter_shapes(parameters, executemany),
+            'endpoint': request.endpoint if has_request_context() else None,
+            'method': request.method if has_request_context() else None,
+            'plan': plan,
+            'fullScans': full_scans(plan),
+        }
+        slow_query.update(find_origin())
+        logger.warning(slow_query['statement'], extra={'slow_query': slow_query})
+
+    @staticmethod
+    def explain(conn, statement, parameters):
+        # the plan is read at that moment, on the same connection, so it reflects the data and the transaction of
+        # the slow statement; a new cursor leaves the rows of the executed one untouched
+        if not _EXPLAINABLE.match(statement):
+            return []
+
+        prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(prefix + statement, parameters)
+            if conn.dialect.name == 'sqlite':
+                # the rows are (id, parent, notused, detail)
+                return [row[-1] for row in cursor.fetchall()]
+            return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+        except Exception as error:
+            return ['EXPLAIN failed: {}'.format(error)]
+        finally:
+            cursor.close()
+
+
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,40 @@
+from functools import reduce
+from math import gcd
+
+from .money import to_cents
+
+
+def _lcm(a, b):
+    return a * b // gcd(a, b)
+
+
+# items are (price, quantity, participants) tuples, participants being any hashable key. Returns the cents each
+# participant owes: every share is exact up to a cent, and the shares always add up to the receipt total.
+def split_receipt(items):
+    total_cents = 0
+    # for every participant, the cents of the items he shares, grouped by the number of participants
+    cents_by_share = {}
+    for price, quantity, participants in items:
+        cents = to_cents(price * quantity)
+        total_cents += cents
+
+        n_participants = len(participants)
+        for participant in participants:
+            shares = cents_by_share.setdefault(participant, {})
+            shares[n_participants] = shares.get(n_participants, 0) + cents
+
+    # exact integer arithmetic on a common denominator, instead of accumulating float fractions
+    denominator = reduce(_lcm, {n for shares in cents_by_share.values() for n in shares.keys()}, 1)
+
+    totals = {}
+    remainders = {}
+    for participant, shares in cents_by_share.items():
+        numerator = sum(cents * (denominator // n_participants) for n_participants, cents in shares.items())
+        totals[participant], remainders[participant] = divmod(numerator, denominator)
+
+    # largest remainder: the cents lost by rounding down go to the largest fractional parts
+    leftover = total_cents - sum(totals.values())
+    for participant in sorted(remainders.keys(), key=lambda participant: -remainders[participant])[:leftover]:
+        totals[participant] += 1
+
+    return totals
@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+
+from .cache import MemoryCacheBackend, SqliteCacheBackend
+
+
+class CacheBackendTests:
+
+    def make_backend(self, max_entries=10, ttl=60):
+        raise NotImplementedError
+
+    def test_get_returns_what_was_set(self):
+        backend = self.make_backend()
+        backend.set((1, 'debts'), {'data': [1, 2]})
+
+        self.assertEqual(backend.get((1, 'debts')), {'data': [1, 2]})
+        self.assertIsNone(backend.get((2, 'debts')))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        backend = self.make_backend(max_entries=2)
+        backend.set((1, 'debts'), 'a')
+        backend.set((1, 'credits'), 'b')
+        # reading refreshes the entry, so the credits are evicted first
+        backend.get((1, 'debts'))
+        backend.set((1, 'tickets'), 'c')
+
+        self.assertEqual(len(backend), 2)
+        self.assertEqual(backend.get((1, 'debts')), 'a')
+        self.assertIsNone(backend.get((1, 'credits')))
+
+    def test_expired_entries_are_not_returned(self):
+        backend = self.make_backend(ttl=-1)
+        backend.set((1, 'debts'), 'a')
+
+        self.assertIsNone(backend.get((1, 'debts')))
+
+    def test_invalidate_drops_only_the_entries_of_the_given_users(self):
+        backend = self.make_backend()
+        backend.set((1, 'debts'), 'a')
+        backend.set((1, 'credits'), 'b')
+        backend.set((2, 'debts'), 'c')
+
+        backend.invalidate({1})
+
+        self.assertIsNone(backend.get((1, 'debts')))
+        self.assertIsNone(backend.get((1, 'credits')))
+        self.assertEqual(backend.get((2, 'debts')), 'c')
+
+
+class TestMemoryCacheBackend(CacheBackendTests, unittest.TestCase):
+
+    def make_backend(self, max_entries=10, ttl=60):
+        return MemoryCacheBackend(max_entries, ttl)
+
+
+class TestSqliteCacheBackend(CacheBackendTests, unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache.db')
+
+    def make_backend(self, max_entries=10, ttl=60):
+        backend = SqliteCacheBackend(self.path, max_entries, ttl)
+        self.addCleanup(backend._connection().close)
+        return backend
@@ -1,7 +1,13 @@
 import json
+from unittest import mock
 
-from . import controllers as ctl, status
-from .models import User, Item
+from flask_jwt_extended import decode_token
+
+from . import controllers as ctl, status, pagination
+from .cache import response_cache
+from .passwords import password_hasher
+from .tokens import token_denylist
+from .models import User, Item, Ticket, Accounting
 from .test_services import FlaskAppTest
 from .. import db
 
@@ -86,6 +92,48 @@ class TestUsersAPI(APITest):
         retrieved_usernames = set([user['username'] for user in json_response])
         self.assertSetEqual(retrieved_usernames, set(usernames))
 
+    def test_UsersList_get_by_prefix(self):
+        for name in ['Alice', 'alberto', 'bob', 'Albert']:
+            super()._add_user(name=name)
+        token, _ = super()._get_token_and_add_user(username='test')
+
+        response = self.client.get('api' + ctl.UsersAPI.resource_path + '?q=AL',
+                                   headers=dict(self.content_type, **self.get_auth_dict(token)))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual([user['username'] for user in json.loads(response.data)],
+                             ['Albert', 'alberto', 'Alice'])
+
+    def test_UsersList_get_is_paginated(self):
+        for i in range(5):
+            super()._add_user(name='user{}'.format(i))
+        token, _ = super()._get_token_and_add_user(username='test')
+
+        headers = dict(self.content_type, **self.get_auth_dict(token))
+        response = self.client.get('api' + ctl.UsersAPI.resource_path + '?q=user&limit=3', headers=headers)
+        first_page = json.loads(response.data)
+        cursor = response.headers[pagination.NEXT_CURSOR_HEADER]
+
+        response = self.client.get('api' + ctl.UsersAPI.resource_path + '?q=user&limit=3&cursor=' + cursor,
+                                   headers=headers)
+        second_page = json.loads(response.data)
+
+        self.assertNotIn(pagination.NEXT_CURSOR_HEADER, response.headers)
+        self.assertListEqual([user['username'] for user in first_page + second_page],
+                             ['user{}'.format(i) for i in range(5)])
+
+    def test_UsersList_get_caps_the_page_size(self):
+        token, _ = super()._get_token_and_add_user(username='test')
+
+        with mock.patch.object(pagination, 'MAX_PAGE_SIZE', 2):
+            for i in range(3):
+                super()._add_user(name='user{}'.format(i))
+            response = self.client.get('api' + ctl.UsersAPI.resource_path + '?limit=1000',
+                                       headers=dict(self.content_type, **self.get_auth_dict(token)))
+
+        self.assertEqual(len(json.loads(response.data)), 2)
+        self.assertIn(pagination.NEXT_CURSOR_HEADER, response.headers)
+
 
 class TestTicketsAPI(APITest):
 
@@ -147,6 +195,8 @@ class TestTicketsAPI(APITest):
         db.session.add(ticket3)
 
         db.session.commit()
+        # the request closes the session, so the ids are read before it
+        expected_ticket_ids = {ticket1.id, ticket2.id}
 
         response = self.client.get('api' + ctl.TicketsAPI.resource_path,
                                    headers=dict(self.content_type, **self.get_auth_dict(self.token)))
@@ -155,7 +205,37 @@ class TestTicketsAPI(APITest):
         retrieved_ticket_ids = set([ticket['id'] for ticket in json_response])
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertSetEqual(retrieved_ticket_ids, {ticket1.id, ticket2.id})
+        self.assertSetEqual(retrieved_ticket_ids, expected_ticket_ids)
+
+    def test_get_logged_user_tickets_is_paginated(self):
+        tickets = []
+        for _ in range(3):
+            ticket, _, _ = super()._generate_test_ticket(participant=self.participant, buyer=self.buyer)
+            tickets.append(ticket)
+            db.session.add(ticket)
+        db.session.commit()
+        ticket_ids = [ticket.id for ticket in tickets]
+
+        headers = dict(self.content_type, **self.get_auth_dict(self.token))
+        response = self.client.get('api' + ctl.TicketsAPI.resource_path + '?limit=2', headers=headers)
+        first_page = json.loads(response.data)
+        cursor = response.headers[pagination.NEXT_CURSOR_HEADER]
+
+        response = self.client.get('api' + ctl.TicketsAPI.resource_path + '?limit=2&cursor=' + cursor,
+                                   headers=headers)
+        second_page = json.loads(response.data)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn(pagination.NEXT_CURSOR_HEADER, response.headers)
+        # the newest first
+        self.assertListEqual([ticket['id'] for ticket in first_page + second_page],
+                             ticket_ids[::-1])
+
+    def test_get_logged_user_tickets_with_invalid_cursor(self):
+        response = self.client.get('api' + ctl.TicketsAPI.resource_path + '?cursor=invalid',
+                                   headers=dict(self.content_type, **self.get_auth_dict(self.token)))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
     def test_get_ticket(self):
         ticket, _, _ = self._generate_test_ticket(self.buyer, self.participant)
@@ -252,3 +332,380 @@ class TestTicketsAPI(APITest):
 
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+
+class TestBalancesAPI(APITest):
+
+    def test_get_balances(self):
+        token, user = self._get_token_and_add_user('user')
+        friend = super()._add_user('friend')
+
+        ticket, _, _ = self._generate_test_ticket(buyer=friend, participant=user)
+        db.session.add(ticket)
+        db.session.commit()
+
+        response = self.client.get('api' + ctl.BalancesAPI.resource_path,
+                                   headers=dict(self.content_type, **self.get_auth_dict(token)))
+        json_response = json.loads(response.data)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json_response), 1)
+        self.assertEqual(json_response[0]['user']['username'], 'friend')
+        self.assertEqual(json_response[0]['debt'], 6.5)
+        self.assertEqual(json_response[0]['credit'], 0.0)
+        self.assertEqual(json_response[0]['total'], -6.5)
+
+
+class TestSettleAccountingsAPI(APITest):
+
+    def test_settle_accountings(self):
+        token, user = self._get_token_and_add_user('user')
+        friend = super()._add_user('friend')
+        other = super()._add_user('other')
+
+        debt_ticket, _, debt_accountings = self._generate_test_ticket(buyer=friend, participant=user)
+        credit_ticket, _, credit_accountings = self._generate_test_ticket(buyer=user, participant=friend)
+        # the logged user is not part of this accounting, so it must not be settled
+        other_ticket, _, other_accountings = self._generate_test_ticket(buyer=friend, participant=other)
+        db.session.add_all([debt_ticket, credit_ticket, other_ticket])
+        db.session.commit()
+
+        ids = [debt_accountings[0].id, credit_accountings[0].id, other_accountings[0].id]
+        response = self.client.post('api' + ctl.SettleAccountingsAPI.resource_path,
+                                    headers=dict(self.content_type, **self.get_auth_dict(token)),
+                                    data=self.encoder.encode({'ids': ids}))
+        json_response = json.loads(response.data)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertDictEqual(json_response, {'settledAccountings': 2, 'settledAmount': 13.0})
+        self.assertEqual(Accounting.query.get(ids[2]).paidPrice, 0.0)
+
+
+class TestSettlementPlanAPI(APITest):
+
+    def test_settling_the_accountings_of_others_is_rejected(self):
+        token, _ = self._get_token_and_add_user('user')
+        friend = super()._add_user('friend')
+        other = super()._add_user('other')
+
+        ticket, _, accountings = self._generate_test_ticket(buyer=other, participant=friend)
+        db.session.add(ticket)
+        db.session.commit()
+        accounting_id = accountings[0].id
+
+        response = self.client.post('api' + ctl.SettlementPlanAPI.resource_path,
+                                    headers=dict(self.content_type, **self.get_auth_dict(token)),
+                                    data=self.encoder.encode({'users': [friend.id, other.id]}))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Accounting.query.get(accounting_id).paidPrice, 0.0)
+
+
+class TestReadEndpointsQueryCount(APITest):
+
+    def setUp(self):
+        super().setUp()
+        self.token, self.user = self._get_token_and_add_user('user')
+        self.friend = super()._add_user('friend')
+
+    def _add_tickets(self, n):
+        for _ in range(n):
+            credit_ticket, _, credit_accountings = self._generate_test_ticket(buyer=self.user, participant=self.friend)
+            debt_ticket, _, debt_accountings = self._generate_test_ticket(buyer=self.friend, participant=self.user)
+            debt_accountings[0].paidPrice = 1.0
+
+            own_ticket, _, _ = self._generate_test_ticket(buyer=self.user, participant=self.friend)
+            own_ticket.accountings.append(Accounting(userFrom=self.user, userTo=self.user, totalPrice=12.0))
+
+            db.session.add_all([credit_ticket, debt_ticket, own_ticket])
+        db.session.commit()
+
+    def _count_queries_of(self, path):
+        headers = dict(self.content_type, **self.get_auth_dict(self.token))
+        db.session.expire_all()
+        with self.count_queries() as statements:
+            response = self.client.get('api' + path, headers=headers)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(statements)
+
+    def test_read_endpoints_run_a_fixed_number_of_queries(self):
+        self._add_tickets(1)
+        ticket_id = Ticket.query.filter_by(buyer_id=self.user.id).first().id
+        paths = [
+            ctl.TicketsAPI.resource_path,
+            ctl.DebtsAPI.resource_path,
+            ctl.CreditsAPI.resource_path,
+            ctl.DebtPaidAPI.resource_path,
+            ctl.MyTicketAPI.resource_path,
+            '/debt/{}'.format(self.friend.id),
+            '/credit/{}'.format(self.friend.id),
+            '/ticket/{}'.format(ticket_id),
+        ]
+        query_counts = {path: self._count_queries_of(path) for path in paths}
+
+        self._add_tickets(5)
+
+        for path in paths:
+            with self.subTest(path=path):
+                self.assertEqual(self._count_queries_of(path), query_counts[path])
+
+
+class TestResponseCache(APITest):
+
+    def setUp(self):
+        super().setUp()
+        app = self.client.application
+        app.config['RESPONSE_CACHE_BACKEND'] = 'memory'
+        response_cache.init_app(app)
+
+        self.token, self.user = self._get_token_and_add_user('user')
+        self.friend_token, self.friend = self._get_token_and_add_user('friend')
+
+    def tearDown(self):
+        response_cache.backend = None
+        super().tearDown()
+
+    def _get_debts(self):
+        response = self.client.get('api' + ctl.DebtsAPI.resource_path,
+                                   headers=dict(self.content_type, **self.get_auth_dict(self.token)))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.data)
+
+    def test_repeated_reads_are_served_from_the_cache(self):
+        self.assertEqual(self._get_debts(), [])
+        self.assertEqual(self._get_debts(), [])
+
+        self.assertEqual(response_cache.hits, 1)
+        self.assertEqual(response_cache.misses, 1)
+
+    def test_writes_invalidate_the_cache_of_the_involved_users(self):
+        self.assertEqual(self._get_debts(), [])
+
+        items = {'items': [{'name': 'item', 'quantity': 1, 'price': 4.0,
+                            'participants': [{'username': 'friend'}, {'username': 'user'}]}]}
+        response = self.client.post('api' + ctl.TicketsAPI.resource_path,
+                                    headers=dict(self.content_type, **self.get_auth_dict(self.friend_token)),
+                                    data=self.encoder.encode(items))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        debts = self._get_debts()
+        self.assertEqual(len(debts), 1)
+        self.assertEqual(debts[0]['totalPrice'], 2.0)
+        self.assertEqual(response_cache.hits, 0)
+
+    def test_entries_of_an_older_data_version_are_not_served(self):
+        self.assertEqual(self._get_debts(), [])
+
+        # the write is invalidated in another process, this one keeps its entry
+        items = {'items': [{'name': 'item', 'quantity': 1, 'price': 4.0,
+                            'participants': [{'username': 'friend'}, {'username': 'user'}]}]}
+        with mock.patch.object(response_cache, 'invalidate'):
+            response = self.client.post('api' + ctl.TicketsAPI.resource_path,
+                                        headers=dict(self.content_type, **self.get_auth_dict(self.friend_token)),
+                                        data=self.encoder.encode(items))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(len(self._get_debts()), 1)
+        self.assertEqual(response_cache.hits, 0)
+
+
+class TestConditionalGet(APITest):
+
+    def setUp(self):
+        super().setUp()
+        self.token, self.user = self._get_token_and_add_user('user')
+        self.friend_token, self.friend = self._get_token_and_add_user('friend')
+        self.headers = dict(self.content_type, **self.get_auth_dict(self.token))
+
+    def test_unchanged_data_is_not_modified(self):
+        response = self.client.get('api' + ctl.DebtsAPI.resource_path, headers=self.headers)
+        etag = response.headers['ETag']
+
+        with self.count_queries() as statements:
+            response = self.client.get('api' + ctl.DebtsAPI.resource_path,
+                                       headers=dict(self.headers, **{'If-None-Match': etag}))
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.headers['ETag'], etag)
+        # only the data version of the user is read
+        self.assertEqual(len(statements), 1)
+
+    def test_writes_change_the_etag_of_the_involved_users(self):
+        user_etag = self.client.get('api' + ctl.DebtsAPI.resource_path, headers=self.headers).headers['ETag']
+
+        items = {'items': [{'name': 'item', 'quantity': 1, 'price': 4.0,
+                            'participants': [{'username': 'friend'}, {'username': 'user'}]}]}
+        response = self.client.post('api' + ctl.TicketsAPI.resource_path,
+                                    headers=dict(self.content_type, **self.get_auth_dict(self.friend_token)),
+                                    data=self.encoder.encode(items))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.get('api' + ctl.DebtsAPI.resource_path,
+                                   headers=dict(self.headers, **{'If-None-Match': user_etag}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers['ETag'], user_etag)
+        self.assertEqual(len(json.loads(response.data)), 1)
+
+
+class TestFieldsets(APITest):
+
+    def setUp(self):
+        super().setUp()
+        self.token, self.user = self._get_token_and_add_user('user')
+        friend = super()._add_user('friend')
+
+        ticket, _, _ = self._generate_test_ticket(buyer=friend, participant=self.user)
+        db.session.add(ticket)
+        db.session.commit()
+
+    def _get_debts(self, query_string):
+        headers = dict(self.content_type, **self.get_auth_dict(self.token))
+        with self.count_queries() as statements:
+            response = self.client.get('api' + ctl.DebtsAPI.resource_path + query_string, headers=headers)
+        return response, statements
+
+    def test_summary_view_does_not_load_the_items(self):
+        response, statements = self._get_debts('?view=summary')
+        accountings = json.loads(response.data)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertSetEqual(set(accountings[0]), {'id', 'totalPrice', 'paidPrice', 'ticket', 'userFrom', 'userTo'})
+        self.assertSetEqual(set(accountings[0]['ticket']), {'id', 'timestamp'})
+        self.assertFalse([statement for statement in statements if 'items' in statement])
+
+    def test_sparse_fieldset(self):
+        response, statements = self._get_debts('?fields=id,totalPrice')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual(json.loads(response.data), [{'id': 1, 'totalPrice': 6.5}])
+        self.assertFalse([statement for statement in statements if 'items' in statement])
+
+    def test_unknown_fields_and_views_are_rejected(self):
+        for query_string in ['?fields=id,unknown', '?view=unknown']:
+            with self.subTest(query_string=query_string):
+                response, _ = self._get_debts(query_string)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestRefreshAPI(APITest):
+
+    def setUp(self):
+        super().setUp()
+        self._add_user('user', 'password')
+        response = self.client.post('api' + ctl.AuthenticationAPI.resource_path, headers=self.content_type,
+                                    data=self.encoder.encode({'username': 'user', 'password': 'password'}))
+        json_response = json.loads(response.data)
+        self.token = json_response['token']
+        self.refresh_token = json_response['refreshToken']
+
+    def _refresh(self, token):
+        return self.client.post('api' + ctl.RefreshAPI.resource_path,
+                                headers=dict(self.content_type, **self.get_auth_dict(token)))
+
+    def test_refresh_does_not_check_the_password(self):
+        with mock.patch.object(password_hasher, 'check') as check:
+            response = self._refresh(self.refresh_token)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        check.assert_not_called()
+
+        new_token = json.loads(response.data)['token']
+        response = self.client.get('api' + ctl.DebtsAPI.resource_path,
+                                   headers=dict(self.content_type, **self.get_auth_dict(new_token)))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_access_tokens_cannot_refresh(self):
+        response = self._refresh(self.token)
+
+        self.assertNotEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_revoked_tokens_cannot_refresh(self):
+        response = self.client.delete('api' + ctl.RefreshAPI.resource_path,
+                                      headers=dict(self.content_type, **self.get_auth_dict(self.refresh_token)))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        self.assertEqual(self._refresh(self.refresh_token).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        # the other workers find the revocation in the table
+        token_denylist.init_app(self.client.application)
+        self.assertEqual(self._refresh(self.refresh_token).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class TestLoggedUser(APITest):
+
+    def setUp(self):
+        super().setUp()
+        self.token, self.user = self._get_token_and_add_user('user')
+        self.headers = dict(self.content_type, **self.get_auth_dict(self.token))
+
+    def test_token_claims_carry_the_identity(self):
+        with self.client.application.app_context():
+            claims = decode_token(self.token)
+
+        self.assertEqual(claims['identity'], self.user.id)
+        self.assertEqual(claims['user_claims'], {'username': 'user'})
+
+    def test_endpoints_needing_only_the_id_do_not_load_the_user(self):
+        for path in [ctl.DebtsAPI.resource_path, ctl.BalancesAPI.resource_path, ctl.SettlementPlanAPI.resource_path]:
+            with self.subTest(path=path):
+                with self.count_queries() as statements:
+                    response = self.client.get('api' + path, headers=self.headers)
+
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                # only loading the whole user selects the password
+                self.assertFalse([statement for statement in statements if 'users.password' in statement])
+
+
+class TestTicketAuthorization(APITest):
+
+    def setUp(self):
+        super().setUp()
+        self.buyer_token, self.buyer = self._get_token_and_add_user('buyer')
+        self.participant_token, self.participant = self._get_token_and_add_user('participant')
+        self.stranger_token, _ = self._get_token_and_add_user('stranger')
+
+        ticket, _, _ = self._generate_test_ticket(buyer=self.buyer, participant=self.participant)
+        db.session.add(ticket)
+        db.session.commit()
+        self.path = 'api' + ctl.TicketAPI.resource_path.replace('<int:id>', str(ticket.id))
+
+    def _request(self, method, token, path=None, headers=None, **kwargs):
+        return self.client.open(path or self.path, method=method,
+                                headers=dict(self.content_type, **self.get_auth_dict(token), **(headers or {})),
+                                **kwargs)
+
+    def test_buyer_and_participants_can_read(self):
+        self.assertEqual(self._request('GET', self.buyer_token).status_code, status.HTTP_200_OK)
+        self.assertEqual(self._request('GET', self.participant_token).status_code, status.HTTP_200_OK)
+        self.assertEqual(self._request('GET', self.stranger_token).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_only_the_buyer_can_modify(self):
+        items = self.encoder.encode({'items': [{'name': 'item', 'quantity': 1, 'price': 4.0,
+                                                'participants': [{'username': 'participant'}]}]})
+
+        for method, kwargs in [('PATCH', {'data': items}), ('DELETE', {})]:
+            with self.subTest(method=method):
+                response = self._request(method, self.participant_token, **kwargs)
+                self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.assertEqual(self._request('PATCH', self.buyer_token, data=items).status_code,
+                         status.HTTP_201_CREATED)
+        self.assertEqual(self._request('DELETE', self.buyer_token).status_code, status.HTTP_200_OK)
+
+    def test_missing_tickets_are_not_found(self):
+        path = 'api' + ctl.TicketAPI.resource_path.replace('<int:id>', '999')
+
+        for method in ['GET', 'PATCH', 'DELETE']:
+            with self.subTest(method=method):
+                response = self._request(method, self.buyer_token, path=path, data=self.encoder.encode({}))
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_conditional_reads_are_authorized_first(self):
+        etag = self._request('GET', self.stranger_token, path='api' + ctl.DebtsAPI.resource_path).headers['ETag']
+        missing_path = 'api' + ctl.TicketAPI.resource_path.replace('<int:id>', '999')
+
+        response = self._request('GET', self.stranger_token, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self._request('GET', self.stranger_token, path=missing_path, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
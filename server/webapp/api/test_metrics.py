@@ -0,0 +1,131 @@
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine
+
+from config import TestConfig
+from .. import create_app
+from . import controllers as ctl, status
+from .metrics import RequestMetrics, request_metrics, QUERY_COUNT_HEADER, QUERY_TIME_HEADER
+from .test_services import FlaskAppTest
+
+
+class TestRequestMetrics(FlaskAppTest):
+    encoder = json.encoder.JSONEncoder()
+
+    def test_debug_headers_report_the_statements_of_the_request(self):
+        token, _ = self._get_token_and_add_user()
+
+        with self.count_queries() as statements:
+            response = self.client.get('api' + ctl.UsersAPI.resource_path,
+                                       headers=dict(self.content_type, Authorization='Bearer {}'.format(token)))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(int(response.headers[QUERY_COUNT_HEADER]), len(statements))
+        self.assertGreater(float(response.headers[QUERY_TIME_HEADER]), 0.0)
+
+    def test_metrics_are_exported_per_endpoint(self):
+        token, _ = self._get_token_and_add_user()
+        for _ in range(2):
+            self.client.get('api' + ctl.UsersAPI.resource_path,
+                            headers=dict(self.content_type, Authorization='Bearer {}'.format(token)))
+
+        self.client.application.config['METRICS_TOKEN'] = 'secret'
+        response = self.client.get('/metrics', headers={'X-Metrics-Token': 'secret'})
+        lines = response.data.decode().splitlines()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('# TYPE http_request_sql_queries histogram', lines)
+        self.assertIn('http_request_duration_seconds_count{endpoint="api.usersapi",method="GET"} 2', lines)
+        self.assertIn('http_request_sql_queries_bucket{endpoint="api.usersapi",method="GET",le="+Inf"} 2', lines)
+
+    def test_requests_without_statements_are_counted_too(self):
+        self.client.get('/metrics')
+
+        self.assertIn('http_request_sql_queries_bucket{endpoint="metrics",method="GET",le="1.0"} 1',
+                      request_metrics.render().splitlines())
+
+
+    def test_operational_endpoints_answer_only_to_internal_addresses(self):
+        token, _ = self._get_token_and_add_user()
+        headers = dict(self.content_type, Authorization='Bearer {}'.format(token))
+        paths = ['/metrics', 'api' + ctl.CacheStatsAPI.resource_path, 'api' + ctl.PasswordStatsAPI.resource_path]
+        config = self.client.application.config
+
+        # no address is trusted by default, not even the one of a reverse proxy on the host
+        for path in paths:
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path, headers=headers).status_code, status.HTTP_403_FORBIDDEN)
+
+        config['INTERNAL_NETWORKS'] = ['203.0.113.0/24']
+        for path in paths:
+            with self.subTest(path=path):
+                response = self.client.get(path, headers=headers, environ_base={'REMOTE_ADDR': '203.0.113.7'})
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                response = self.client.get(path, headers=headers, environ_base={'REMOTE_ADDR': '198.51.100.7'})
+                self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_operational_endpoints_answer_to_the_metrics_token(self):
+        token, _ = self._get_token_and_add_user()
+        headers = dict(self.content_type, Authorization='Bearer {}'.format(token))
+        self.client.application.config['METRICS_TOKEN'] = 'secret'
+
+        for path in ['/metrics', 'api' + ctl.CacheStatsAPI.resource_path]:
+            with self.subTest(path=path):
+                response = self.client.get(path, headers=dict(headers, **{'X-Metrics-Token': 'secret'}))
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                response = self.client.get(path, headers=dict(headers, **{'X-Metrics-Token': 'guess'}))
+                self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_the_address_of_the_client_is_read_behind_the_proxies(self):
+        class ProxiedConfig(TestConfig):
+            PROXY_FIX_X_FOR = 1
+            INTERNAL_NETWORKS = ['10.0.0.0/8']
+
+        client = create_app(ProxiedConfig).test_client()
+
+        # the proxy on the host forwards the address of the client
+        response = client.get('/metrics', headers={'X-Forwarded-For': '10.1.2.3'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.7'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TestRequestMetricsAcrossProcesses(unittest.TestCase):
+
+    def make_metrics(self, directory):
+        metrics = RequestMetrics()
+        app = mock.MagicMock(config={'METRICS_DIR': directory, 'METRICS_FLUSH_INTERVAL': 0}, debug=False)
+        metrics.init_app(app, create_engine('sqlite://'))
+        return metrics
+
+    def test_the_processes_are_added_up(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        directory = directory.name
+        first, second = self.make_metrics(directory), self.make_metrics(directory)
+
+        with mock.patch('os.getpid', return_value=1):
+            first.observe(('api.usersapi', 'GET'), 0.02, 3, 0.01)
+        with mock.patch('os.getpid', return_value=2):
+            second.observe(('api.usersapi', 'GET'), 0.2, 30, 0.1)
+            collected = second.collect()
+
+        series = collected['http_request_sql_queries']['api.usersapi\tGET']
+        self.assertEqual(series['count'], 2)
+        self.assertEqual(series['sum'], 33)
+        # 3 falls in the bucket up to 5, 30 in the one up to 50
+        self.assertEqual(series['buckets'][2], 1)
+        self.assertEqual(series['buckets'][5], 1)
+
+    def test_without_a_directory_only_the_process_is_exported(self):
+        metrics = RequestMetrics()
+        metrics.init_app(mock.MagicMock(config={}, debug=False), create_engine('sqlite://'))
+
+        metrics.observe(('api.usersapi', 'GET'), 0.02, 3, 0.01)
+
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="api.usersapi",method="GET",le="0.025"} 1',
+                      metrics.render().splitlines())
+
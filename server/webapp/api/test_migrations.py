@@ -0,0 +1,59 @@
+import os
+from datetime import datetime
+
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from flask_migrate import upgrade, downgrade
+
+from .. import db
+from .models import User, Accounting, Balance
+from .test_services import FlaskAppTest
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'migrations')
+
+
+class TestMigrations(FlaskAppTest):
+
+    def setUp(self):
+        super(TestMigrations, self).setUp()
+        db.drop_all()
+        db.engine.execute('DROP TABLE IF EXISTS alembic_version')
+
+    def tearDown(self):
+        super(TestMigrations, self).tearDown()
+        db.engine.execute('DROP TABLE IF EXISTS alembic_version')
+
+    def test_the_migrations_build_the_schema_of_the_models(self):
+        with db.app.app_context():
+            upgrade(directory=MIGRATIONS)
+
+        with db.engine.connect() as connection:
+            diff = compare_metadata(MigrationContext.configure(connection), db.metadata)
+        # the index on lower(username) is not reflected
+        self.assertListEqual([change[1].name for change in diff], ['ix_users_username_lower_id'])
+        self.assertIn('ix_users_username_lower_id', [row[0] for row in db.engine.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'users'")])
+
+    def test_the_existing_rows_are_migrated(self):
+        with db.app.app_context():
+            # a database of the first schema
+            upgrade(directory=MIGRATIONS, revision='3f1c2a9b7d10')
+            db.engine.execute("INSERT INTO users (id, username, password) VALUES (1, 'user', ''), "
+                              "(2, 'friend', '')")
+            db.engine.execute('INSERT INTO tickets (id, timestamp, buyer_id) VALUES (1, ?, 2)', datetime(2020, 5, 1))
+            db.engine.execute('INSERT INTO accountings (id, "paidPrice", "totalPrice", ticket_id, user_from, user_to) '
+                              'VALUES (1, 1.5, 4.0, 1, 2, 1), (2, 3.0, 3.0, 1, 2, 1)')
+
+            upgrade(directory=MIGRATIONS)
+
+        self.assertEqual(User.query.get(1).data_version, 0)
+        self.assertEqual(Accounting.query.get(1).timestamp, datetime(2020, 5, 1))
+        self.assertListEqual([(balance.user_from, balance.user_to, balance.amount) for balance in Balance.query],
+                             [(2, 1, 2.5)])
+
+    def test_the_migrations_are_reversible(self):
+        with db.app.app_context():
+            upgrade(directory=MIGRATIONS)
+            downgrade(directory=MIGRATIONS, revision='base')
+
+        self.assertListEqual(db.engine.table_names(), ['alembic_version'])
@@ -0,0 +1,89 @@
+import unittest
+from types import SimpleNamespace
+
+from .exceptions import PasswordHashingBusyError
+from .models import User
+from .passwords import PasswordHasher, password_hasher, get_log_rounds
+from .services import UserServiceBase
+from .test_services import FlaskAppTest
+
+
+class TestPasswordHasher(unittest.TestCase):
+
+    def make_hasher(self, **config):
+        hasher = PasswordHasher()
+        hasher.init_app(SimpleNamespace(config=dict({'BCRYPT_LOG_ROUNDS': 4}, **config)))
+        self.addCleanup(hasher.shutdown)
+        return hasher
+
+    def test_hash_and_check_in_the_worker_pool(self):
+        hasher = self.make_hasher(PASSWORD_HASH_WORKERS=1)
+
+        password_hash = hasher.hash('password')
+
+        self.assertEqual(get_log_rounds(password_hash), 4)
+        self.assertTrue(hasher.check('password', password_hash))
+        self.assertFalse(hasher.check('wrong', password_hash))
+        self.assertEqual(hasher.stats()['hashTime']['count'], 3)
+
+    def test_the_pool_is_started_by_the_first_hash(self):
+        hasher = self.make_hasher(PASSWORD_HASH_WORKERS=1)
+        self.assertIsNone(hasher._executor)
+
+        hasher.hash('password')
+
+        self.assertIsNotNone(hasher._executor)
+
+    def test_a_forked_process_starts_its_own_pool(self):
+        hasher = self.make_hasher(PASSWORD_HASH_WORKERS=1)
+        hasher.hash('password')
+        parent_executor = hasher._executor
+        self.addCleanup(parent_executor.shutdown)
+
+        # what the child process runs after the fork
+        hasher._after_fork()
+
+        self.assertIsNone(hasher._executor)
+        self.assertTrue(hasher.check('password', hasher.hash('password')))
+        self.assertIsNot(hasher._executor, parent_executor)
+
+    def test_shutdown_joins_the_workers(self):
+        hasher = self.make_hasher(PASSWORD_HASH_WORKERS=2)
+        hasher.hash('password')
+        processes = list(hasher._executor._processes.values())
+
+        hasher.shutdown()
+
+        self.assertTrue(processes)
+        self.assertFalse(any(process.is_alive() for process in processes))
+        self.assertIsNone(hasher._executor)
+
+    def test_requests_over_the_queue_depth_are_rejected(self):
+        hasher = self.make_hasher(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE_DEPTH=0)
+        # the only slot is taken by a request in progress
+        hasher._slots.acquire()
+
+        with self.assertRaises(PasswordHashingBusyError):
+            hasher.hash('password')
+        self.assertEqual(hasher.stats()['rejected'], 1)
+
+    def test_invalid_hashes_do_not_match(self):
+        hasher = self.make_hasher(PASSWORD_HASH_WORKERS=0)
+
+        self.assertFalse(hasher.check('password', None))
+        self.assertFalse(hasher.check('password', 'not a bcrypt hash'))
+
+
+class TestRehashOnLogin(FlaskAppTest):
+
+    def test_hashes_with_a_different_cost_are_upgraded(self):
+        password_hasher.log_rounds = 4
+        user = self._add_user('user', 'password')
+        self.assertEqual(get_log_rounds(user.password), 4)
+
+        password_hasher.log_rounds = 5
+        authenticated_user = UserServiceBase().authenticate('user', 'password')
+
+        self.assertEqual(authenticated_user.id, user.id)
+        self.assertEqual(get_log_rounds(User.query.get(user.id).password), 5)
+        self.assertTrue(User.query.get(user.id).check_password('password'))
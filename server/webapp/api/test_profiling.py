@@ -0,0 +1,97 @@
+import glob
+import json
+import os
+import pstats
+import tempfile
+
+from config import TestConfig
+from . import controllers as ctl, status
+from .profiling import request_profiler, PROFILE_ID_HEADER
+from .test_services import FlaskAppTest
+from .. import create_app, db
+
+
+class TestRequestProfiler(FlaskAppTest):
+    encoder = json.encoder.JSONEncoder()
+
+    def start_app(self, **config):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+        profiling_config = type('ProfilingConfig', (TestConfig,),
+                                dict({'PROFILE_DIR': self.directory, 'PROFILE_TOKEN': 'secret'}, **config))
+        app = create_app(profiling_config)
+        self.client = app.test_client()
+        db.app = app
+
+        self.token, _ = self._get_token_and_add_user()
+
+    def get_users(self, **headers):
+        return self.client.get('api' + ctl.UsersAPI.resource_path,
+                               headers=dict(self.content_type, Authorization='Bearer {}'.format(self.token),
+                                            **headers))
+
+    def test_requests_with_the_header_are_profiled(self):
+        self.start_app(PROFILER='cprofile')
+
+        response = self.get_users(**{'X-Profile': 'secret'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        path, = glob.glob(os.path.join(self.directory, response.headers[PROFILE_ID_HEADER] + '-*ms.prof'))
+        self.assertIn('-api.usersapi-GET-200-', os.path.basename(path))
+        functions = {function for _, _, function in pstats.Stats(path).stats}
+        self.assertIn('search_users', functions)
+
+    def test_the_sampling_profiler_writes_collapsed_stacks(self):
+        self.start_app(PROFILER='sampling')
+
+        response = self.get_users(**{'X-Profile': 'secret'})
+
+        path, = glob.glob(os.path.join(self.directory, response.headers[PROFILE_ID_HEADER] + '-*ms.folded'))
+        with open(path) as file:
+            for line in file:
+                stack, count = line.rsplit(' ', 1)
+                self.assertGreater(int(count), 0)
+
+    def test_requests_with_a_wrong_token_are_not_profiled(self):
+        self.start_app()
+
+        response = self.get_users(**{'X-Profile': 'guess'})
+
+        self.assertNotIn(PROFILE_ID_HEADER, response.headers)
+        self.assertListEqual(os.listdir(self.directory), [])
+
+    def test_a_fraction_of_the_requests_is_sampled(self):
+        self.start_app(PROFILE_SAMPLE_RATE=1.0)
+        # the login is sampled too
+        profiled = request_profiler.profiled
+
+        response = self.get_users()
+
+        self.assertIn(PROFILE_ID_HEADER, response.headers)
+        self.assertEqual(request_profiler.profiled, profiled + 1)
+        self.assertEqual(len(os.listdir(self.directory)), profiled + 1)
+
+    def test_the_overhead_budget_is_never_exceeded(self):
+        self.start_app(PROFILE_OVERHEAD_BUDGET=0.001, PROFILE_BUDGET_WINDOW=60)
+        # a profiled request already took the 60 ms of the window
+        request_profiler._window_used = 0.06
+
+        response = self.get_users(**{'X-Profile': 'secret'})
+
+        self.assertNotIn(PROFILE_ID_HEADER, response.headers)
+        self.assertEqual(request_profiler.skipped, 1)
+
+    def test_only_the_oldest_profiles_are_removed(self):
+        self.start_app(PROFILE_MAX_FILES=1)
+        unrelated_path = os.path.join(self.directory, 'notes.txt')
+        with open(unrelated_path, 'w') as file:
+            file.write('not a profile')
+
+        first = self.get_users(**{'X-Profile': 'secret'}).headers[PROFILE_ID_HEADER]
+        second = self.get_users(**{'X-Profile': 'secret'}).headers[PROFILE_ID_HEADER]
+
+        self.assertTrue(os.path.exists(unrelated_path))
+        self.assertListEqual(glob.glob(os.path.join(self.directory, first + '-*')), [])
+        self.assertEqual(len(glob.glob(os.path.join(self.directory, second + '-*'))), 1)
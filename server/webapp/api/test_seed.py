@@ -0,0 +1,70 @@
+from unittest import mock
+
+from sqlalchemy import func
+
+from .balances import rebuild_balances
+from .models import User, Ticket, Item, Accounting
+from .seed import seed_world, _reset_sequences
+from .test_services import FlaskAppTest
+from .. import db
+
+
+class TestSeedWorld(FlaskAppTest):
+
+    def test_seed_world(self):
+        counts = seed_world(20, 50, seed=1)
+
+        self.assertEqual(counts['users'], User.query.count())
+        self.assertEqual(counts['tickets'], Ticket.query.count())
+        self.assertEqual(counts['items'], Item.query.count())
+        self.assertEqual(counts['accountings'], Accounting.query.count())
+        self.assertTrue(User.query.first().check_password('password'))
+        # the balances match the accountings
+        self.assertListEqual(rebuild_balances(dry_run=True), [])
+
+    def test_accountings_are_the_shares_of_the_other_participants(self):
+        seed_world(20, 50, seed=1)
+
+        for ticket in Ticket.query:
+            total = sum(item.price * item.quantity for item in ticket.items)
+            buyer_share = sum(item.price * item.quantity / len(item.participants) for item in ticket.items
+                              if ticket.buyer in item.participants)
+            owed = sum(accounting.totalPrice for accounting in ticket.accountings)
+
+            self.assertTrue(all(accounting.user_from == ticket.buyer_id for accounting in ticket.accountings))
+            self.assertAlmostEqual(owed, total - buyer_share, delta=0.01 * len(ticket.accountings) + 0.01)
+
+    def test_the_same_seed_adds_the_same_world(self):
+        def snapshot():
+            return db.session.query(Accounting.user_from, Accounting.user_to, Accounting.totalPrice,
+                                    Accounting.paidPrice).order_by(Accounting.id).all()
+
+        seed_world(20, 50, seed=1)
+        first = snapshot()
+        db.drop_all()
+        db.create_all()
+        seed_world(20, 50, seed=1)
+
+        self.assertListEqual(snapshot(), first)
+
+    def test_some_accountings_are_paid_in_part(self):
+        seed_world(20, 200, seed=1, paid_ratio=0.0, partially_paid_ratio=1.0)
+
+        paid = db.session.query(func.count(Accounting.id)).filter(Accounting.paidPrice >= Accounting.totalPrice) \
+            .scalar()
+        paid_in_part = db.session.query(func.count(Accounting.id)).filter(Accounting.paidPrice > 0).scalar()
+        self.assertEqual(paid, 0)
+        self.assertGreater(paid_in_part, 0)
+
+    def test_the_sequences_are_moved_past_the_seeded_ids_on_postgresql(self):
+        with mock.patch.object(db.engine.dialect, 'name', 'postgresql'), \
+                mock.patch.object(db.session, 'execute') as execute:
+            _reset_sequences(User.__table__, Ticket.__table__)
+
+        statements = [(str(call[0][0]), call[0][1]) for call in execute.call_args_list]
+        self.assertListEqual(statements, [
+            ("SELECT setval(pg_get_serial_sequence(:table, 'id'), (SELECT COALESCE(MAX(id), 0) + 1 FROM users), false)",
+             {'table': 'users'}),
+            ("SELECT setval(pg_get_serial_sequence(:table, 'id'), (SELECT COALESCE(MAX(id), 0) + 1 FROM tickets), "
+             "false)", {'table': 'tickets'}),
+        ])
@@ -0,0 +1,38 @@
+from flask_restful import marshal, fields as restful_fields
+
+from . import fields
+from .models import Ticket, Accounting
+from .serializer import compile_fields
+from .test_services import FlaskAppTest
+from .. import db
+
+
+class TestSerializer(FlaskAppTest):
+
+    def setUp(self):
+        super().setUp()
+        buyer = self._add_user('buyer')
+        participant = self._add_user('participant')
+
+        for _ in range(2):
+            ticket, _, _ = self._generate_test_ticket(buyer=buyer, participant=participant)
+            db.session.add(ticket)
+        db.session.commit()
+
+    def assertSameOutput(self, data, spec):
+        self.assertEqual(compile_fields(spec)(data), marshal(data, spec))
+
+    def test_output_is_the_same_of_marshal(self):
+        self.assertSameOutput(Ticket.query.all(), fields.ticket_fields)
+        self.assertSameOutput(Accounting.query.all(), fields.accounting_fields)
+        self.assertSameOutput(Accounting.query.first(), fields.small_accounting_fields)
+
+    def test_missing_values_are_the_same_of_marshal(self):
+        self.assertSameOutput([{}, None, {'ticket': {'items': None}}], fields.accounting_fields)
+        self.assertSameOutput({'a': None}, {'a': restful_fields.Integer(default=3),
+                                            'b': restful_fields.Nested({'c': restful_fields.String}, allow_null=True)})
+
+    def test_repeated_objects_are_serialized_once(self):
+        accountings = compile_fields(fields.accounting_fields)(Accounting.query.all())
+
+        self.assertIs(accountings[0]['userFrom'], accountings[1]['userFrom'])
@@ -1,13 +1,23 @@
 import unittest
+from contextlib import contextmanager
 from unittest import mock
 
 from injector import inject
+from flask_restful import marshal
+from sqlalchemy import event
+from sqlalchemy.orm import Query
 
 from .. import create_app, db, bcrypt
-from ..api.models import User, Ticket, Item, Accounting
-from ..api.services import UserServiceBase, TicketService
-from . import controllers as ctl
+from ..api.authorization import AuthorizationService, READ, MODIFY
+from ..api.balances import apply_balance_deltas, rebuild_balances
+from ..api.exceptions import TicketInputError, AccountingNotFoundError, SettlementInputError
+from ..api.models import User, Ticket, Item, Accounting, Balance
+from ..api.pagination import encode_cursor
+from ..api.readers import read_accountings_page, read_tickets_page
+from ..api.services import UserServiceBase, TicketService, AccountingService
+from . import controllers as ctl, fields
 import json
+from datetime import datetime
 
 class FlaskAppTest(unittest.TestCase):
     content_type = {'Content-Type': 'application/json'}
@@ -32,6 +42,19 @@ class FlaskAppTest(unittest.TestCase):
     def tearDown(self):
         db.session.remove()
 
+    @contextmanager
+    def count_queries(self):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+
     @staticmethod
     def _add_user(name='user', password='pw'):
         user = User(username=name)
@@ -90,6 +113,35 @@ class TestTicketService(FlaskAppTest):
         self.assertEqual(generated_accounting_list[0].userTo, accounting_list[0].userTo)
         self.assertEqual(generated_accounting_list[0].userFrom, accounting_list[0].userFrom)
 
+    def test_generate_tickets_and_accountings_query_count_does_not_depend_on_items(self):
+        users = [self._add_user(name='user{}'.format(i)) for i in range(4)]
+        participants = [{'username': user.username} for user in users]
+
+        def count_queries(n_items):
+            item_dicts = [{'name': 'item{}'.format(i), 'price': 1.0, 'quantity': 1, 'participants': participants}
+                          for i in range(n_items)]
+            with self.count_queries() as statements:
+                with mock.patch.object(self.ticket_service.user_service, 'get_logged_user', return_value=users[0]):
+                    self.ticket_service._generate_items_and_accountings(item_dicts)
+            return len(statements)
+
+        self.assertEqual(count_queries(1), 1)
+        self.assertEqual(count_queries(60), 1)
+
+    def test_generate_tickets_and_accountings_reports_all_unknown_users(self):
+        user_buyer = self._add_user(name='buyer')
+
+        item_dicts = [
+            {'name': 'item1', 'price': 1.0, 'participants': [{'username': 'buyer'}, {'username': 'ghost1'}]},
+            {'name': 'item2', 'price': 1.0, 'participants': [{'username': 'ghost2'}]},
+        ]
+
+        with mock.patch.object(self.ticket_service.user_service, 'get_logged_user', return_value=user_buyer):
+            with self.assertRaises(TicketInputError) as context:
+                self.ticket_service._generate_items_and_accountings(item_dicts)
+
+        self.assertEqual(context.exception.description, "Users 'ghost1', 'ghost2' do not exist.")
+
     def test_add_ticket(self):
         user_buyer = self._add_user(name='buyer')
         user_participant = self._add_user(name='participant')
@@ -100,7 +152,7 @@ class TestTicketService(FlaskAppTest):
 
         # retrieve ticket from db
         retrieved_ticket = Ticket.query.get(added_ticket_id)
-        self.assertListEqual(ticket.items.all(), retrieved_ticket.items.all())
+        self.assertListEqual(ticket.items, retrieved_ticket.items)
         self.assertListEqual(ticket.accountings, retrieved_ticket.accountings)
 
     def test_delete_ticket(self):
@@ -141,7 +193,7 @@ class TestTicketService(FlaskAppTest):
         with mock.patch.object(self.ticket_service.user_service, 'get_logged_user', return_value=user_buyer):
             updated_ticket = self.ticket_service.update_ticket(ticket, [new_item1.to_dict(), new_item2.to_dict()])
 
-        self.assertListEqual(updated_ticket.items.all(), [new_item1, new_item2])
+        self.assertListEqual(updated_ticket.items, [new_item1, new_item2])
 
         self.assertEqual(updated_ticket.accountings.__len__(), 1)
         self.assertEqual(updated_ticket.accountings[0].paidPrice, 0.0)
@@ -183,6 +235,42 @@ class TestTicketService(FlaskAppTest):
         self.assertEqual(refund_accounting.totalPrice, 3.0)
         self.assertEqual(refund_accounting.user_to, user_buyer.id)
 
+    def test_update_ticket_only_changes_the_edited_items(self):
+        user_buyer = self._add_user(name='buyer')
+        user_participant = self._add_user(name='participant')
+
+        ticket, item_list, accounting_list = self._generate_test_ticket(buyer=user_buyer,
+                                                                        participant=user_participant)
+        accounting_list[0].paidPrice = 1.0
+
+        db.session.add(ticket)
+        db.session.commit()
+
+        item1, item2, item3 = item_list
+        item1_id, item2_id, item3_id = item1.id, item2.id, item3.id
+        accounting_id = accounting_list[0].id
+
+        # item1 gets a new price, item2 is untouched, item3 is dropped and new_item is added
+        item1_dict = item1.to_dict()
+        item1_dict['price'] = 7.0
+        new_item = Item(name='new_item', quantity=1, price=1.0)
+        new_item.add_participants(user_participant)
+
+        with mock.patch.object(self.ticket_service.user_service, 'get_logged_user', return_value=user_buyer):
+            updated_ticket = self.ticket_service.update_ticket(ticket, [item1_dict, item2.to_dict(),
+                                                                        new_item.to_dict()])
+
+        updated_items = updated_ticket.items
+        self.assertListEqual([item.id for item in updated_items[:2]], [item1_id, item2_id])
+        self.assertEqual(updated_items[0].price, 7.0)
+        self.assertEqual(updated_items[2].name, 'new_item')
+        self.assertIsNone(Item.query.get(item3_id))
+
+        self.assertEqual(updated_ticket.accountings.__len__(), 1)
+        self.assertEqual(updated_ticket.accountings[0].id, accounting_id)
+        self.assertEqual(updated_ticket.accountings[0].paidPrice, 1.0)
+        self.assertEqual(updated_ticket.accountings[0].totalPrice, 7.0 * 1 / 2 + 2.0 * 2 + 1.0)
+
     def test_get_tickets_of_logged_user(self):
         user_1 = self._add_user(name='buyer')
         user_2 = self._add_user(name='participant')
@@ -199,7 +287,299 @@ class TestTicketService(FlaskAppTest):
         with mock.patch.object(self.ticket_service.user_service, 'get_logged_user', return_value=user_1):
             logged_user_tickets = self.ticket_service.get_logged_user_tickets()
 
-        self.assertListEqual(logged_user_tickets, [ticket])
+        self.assertListEqual([ticket['id'] for ticket in logged_user_tickets], [ticket.id])
+
+class TestAccountingService(FlaskAppTest):
+    accounting_service = AccountingService(user_service=UserServiceBase())
+
+    def test_get_balances(self):
+        user = self._add_user(name='user')
+        friend_1 = self._add_user(name='friend_1')
+        friend_2 = self._add_user(name='friend_2')
+        friend_3 = self._add_user(name='friend_3')
+
+        # user owes 6.5 to friend_1
+        ticket_1, _, _ = self._generate_test_ticket(buyer=friend_1, participant=user)
+        # friend_1 owes 6.5 to user, of which 2.0 already paid
+        ticket_2, _, accountings_2 = self._generate_test_ticket(buyer=user, participant=friend_1)
+        accountings_2[0].paidPrice = 2.0
+        # friend_2 owes 6.5 to user
+        ticket_3, _, _ = self._generate_test_ticket(buyer=user, participant=friend_2)
+        # friend_3 debt is completely paid, so it must not appear
+        ticket_4, _, accountings_4 = self._generate_test_ticket(buyer=user, participant=friend_3)
+        accountings_4[0].paidPrice = accountings_4[0].totalPrice
+        # accountings between other users must be ignored
+        ticket_5, _, _ = self._generate_test_ticket(buyer=friend_2, participant=friend_3)
+
+        for ticket in [ticket_1, ticket_2, ticket_3, ticket_4, ticket_5]:
+            db.session.add(ticket)
+        db.session.commit()
+
+        with mock.patch.object(self.accounting_service.user_service, 'get_logged_user', return_value=user):
+            balances = self.accounting_service.get_balances()
+
+        self.assertListEqual(balances, [
+            {'user': {'id': friend_1.id, 'username': 'friend_1'}, 'debt': 6.5, 'credit': 4.5, 'total': -2.0},
+            {'user': {'id': friend_2.id, 'username': 'friend_2'}, 'debt': 0.0, 'credit': 6.5, 'total': 6.5},
+        ])
+
+
+    def test_get_debt_accountings_of_returns_only_owned_items(self):
+        user = self._add_user(name='user')
+        friend = self._add_user(name='friend')
+
+        # item1 is shared, item2 belongs to the user and item3 to the buyer only
+        ticket, item_list, accounting_list = self._generate_test_ticket(buyer=friend, participant=user)
+        db.session.add(ticket)
+        db.session.commit()
+        friend_id = friend.id
+        user.id  # refresh the logged user before counting
+
+        with mock.patch.object(self.accounting_service.user_service, 'get_logged_user', return_value=user):
+            with self.count_queries() as statements:
+                accountings = self.accounting_service.get_debt_accountings_of(friend_id)
+                owned_items = [item['name'] for item in accountings[0]['ticket']['items']]
+
+        self.assertEqual(len(accountings), 1)
+        self.assertEqual(accountings[0]['id'], accounting_list[0].id)
+        self.assertListEqual(owned_items, ['item1', 'item3'])
+        self.assertEqual(len(statements), 2)
+        # the stored ticket is left untouched
+        self.assertEqual(len(Ticket.query.get(ticket.id).items), 3)
+
+    def test_pay_all_debts_accounting_to(self):
+        user = self._add_user(name='user')
+        friend = self._add_user(name='friend')
+
+        debt_ticket, _, debt_accountings = self._generate_test_ticket(buyer=friend, participant=user)
+        debt_accountings[0].paidPrice = 2.0
+        credit_ticket, _, credit_accountings = self._generate_test_ticket(buyer=user, participant=friend)
+        paid_ticket, _, paid_accountings = self._generate_test_ticket(buyer=user, participant=friend)
+        paid_accountings[0].paidPrice = paid_accountings[0].totalPrice
+        db.session.add_all([debt_ticket, credit_ticket, paid_ticket])
+        db.session.commit()
+
+        with mock.patch.object(self.accounting_service.user_service, 'get_logged_user', return_value=user):
+            with self.count_queries() as statements:
+                settlement = self.accounting_service.pay_all_debts_accounting_to(friend.id)
+            balances = self.accounting_service.get_balances()
+
+        self.assertDictEqual(settlement, {'settledAccountings': 2, 'settledAmount': 4.5 + 6.5})
+        self.assertEqual(len([statement for statement in statements if statement.startswith('UPDATE accountings')]), 1)
+        self.assertListEqual(balances, [])
+        for accounting in Accounting.query.all():
+            self.assertEqual(accounting.paidPrice, accounting.totalPrice)
+
+    def test_settled_accountings_are_locked_and_settled_once(self):
+        user = self._add_user(name='user')
+        friend = self._add_user(name='friend')
+
+        ticket, _, _ = self._generate_test_ticket(buyer=friend, participant=user)
+        db.session.add(ticket)
+        db.session.commit()
+
+        with mock.patch.object(self.accounting_service.user_service, 'get_logged_user', return_value=user), \
+                mock.patch.object(Query, 'with_for_update', autospec=True,
+                                  side_effect=Query.with_for_update) as with_for_update:
+            first = self.accounting_service.pay_all_debts_accounting_to(friend.id)
+            second = self.accounting_service.pay_all_debts_accounting_to(friend.id)
+
+        self.assertEqual(with_for_update.call_count, 2)
+        self.assertDictEqual(first, {'settledAccountings': 1, 'settledAmount': 6.5})
+        self.assertDictEqual(second, {'settledAccountings': 0, 'settledAmount': 0})
+        self.assertListEqual(rebuild_balances(dry_run=True), [])
+
+    def test_pay_debt_accounting_when_not_found(self):
+        user = self._add_user(name='user')
+        friend = self._add_user(name='friend')
+
+        credit_ticket, _, credit_accountings = self._generate_test_ticket(buyer=user, participant=friend)
+        db.session.add(credit_ticket)
+        db.session.commit()
+
+        # the logged user is not the debtor of this accounting
+        with mock.patch.object(self.accounting_service.user_service, 'get_logged_user', return_value=user):
+            with self.assertRaises(AccountingNotFoundError):
+                self.accounting_service.pay_debt_accounting(credit_accountings[0].id)
+
+    def test_settlement_plan(self):
+        user = self._add_user(name='user')
+        friend_1 = self._add_user(name='friend_1')
+        friend_2 = self._add_user(name='friend_2')
+
+        # user owes 6.5 to friend_1 and friend_2 owes 6.5 to user: a single transfer is enough
+        ticket_1, _, _ = self._generate_test_ticket(buyer=friend_1, participant=user)
+        ticket_2, _, _ = self._generate_test_ticket(buyer=user, participant=friend_2)
+        # friend_1 owes 6.5 to friend_2, user is not part of it
+        ticket_3, _, _ = self._generate_test_ticket(buyer=friend_2, participant=friend_1)
+        db.session.add_all([ticket_1, ticket_2, ticket_3])
+        db.session.commit()
+        others_accounting_id = ticket_3.accountings[0].id
+
+        with mock.patch.object(self.accounting_service.user_service, 'get_logged_user', return_value=user):
+            plan = self.accounting_service.get_settlement_plan([friend_1.id, friend_2.id])
+            applied_plan = self.accounting_service.apply_settlement_plan()
+
+        self.assertListEqual(plan['transfers'], [{'payer': {'id': friend_2.id, 'username': 'friend_2'},
+                                                  'payee': {'id': friend_1.id, 'username': 'friend_1'},
+                                                  'amount': 6.5}])
+        self.assertListEqual(applied_plan['transfers'], plan['transfers'])
+        self.assertEqual(applied_plan['settledAccountings'], 2)
+        self.assertListEqual(rebuild_balances(dry_run=True), [])
+        for accounting in Accounting.query.all():
+            if accounting.id == others_accounting_id:
+                self.assertEqual(accounting.paidPrice, 0.0)
+            else:
+                self.assertEqual(accounting.paidPrice, accounting.totalPrice)
+
+    def test_settlement_plan_rejects_users_without_open_accountings(self):
+        user = self._add_user(name='user')
+        friend_1 = self._add_user(name='friend_1')
+        friend_2 = self._add_user(name='friend_2')
+
+        ticket, _, _ = self._generate_test_ticket(buyer=friend_2, participant=friend_1)
+        db.session.add(ticket)
+        db.session.commit()
+
+        with mock.patch.object(self.accounting_service.user_service, 'get_logged_user', return_value=user):
+            with self.assertRaises(SettlementInputError):
+                self.accounting_service.get_settlement_plan([friend_1.id, friend_2.id])
+            with self.assertRaises(SettlementInputError):
+                self.accounting_service.apply_settlement_plan([friend_1.id, friend_2.id])
+
+        self.assertEqual(Accounting.query.one().paidPrice, 0.0)
+
+    def test_get_all_debts_accountings_is_paginated(self):
+        user = self._add_user(name='user')
+        friend = self._add_user(name='friend')
+
+        tickets = []
+        for day in range(1, 6):
+            ticket, _, _ = self._generate_test_ticket(buyer=friend, participant=user)
+            ticket.timestamp = datetime(2020, 5, day)
+            tickets.append(ticket)
+            db.session.add(ticket)
+        db.session.commit()
+
+        with mock.patch.object(self.accounting_service.user_service, 'get_logged_user', return_value=user):
+            first_page = self.accounting_service.get_all_debts_accountings(limit=2)
+            second_page = self.accounting_service.get_all_debts_accountings(cursor=first_page.next_cursor, limit=2)
+            last_page = self.accounting_service.get_all_debts_accountings(cursor=second_page.next_cursor, limit=2)
+            window = self.accounting_service.get_all_debts_accountings(date_from=datetime(2020, 5, 2),
+                                                                       date_to=datetime(2020, 5, 4))
+
+        # the newest first
+        ids = [ticket.accountings[0].id for ticket in reversed(tickets)]
+        self.assertListEqual([accounting['id'] for accounting in first_page], ids[0:2])
+        self.assertListEqual([accounting['id'] for accounting in second_page], ids[2:4])
+        self.assertListEqual([accounting['id'] for accounting in last_page], ids[4:])
+        self.assertIsNone(last_page.next_cursor)
+        self.assertListEqual([accounting['id'] for accounting in window], ids[2:4])
+
+    def test_the_pages_of_accountings_seek_on_an_index(self):
+        executed = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            executed.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            first_page = read_accountings_page(Accounting.user_to == 1, limit=2, with_items=False)
+            read_accountings_page(Accounting.user_to == 1, cursor=encode_cursor(datetime(2020, 5, 1), 10), limit=2,
+                                  with_items=False)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertListEqual(first_page, [])
+        # the first page and the next ones seek on the index, in its order
+        for statement, parameters in executed:
+            plan = [row[-1] for row in db.engine.execute('EXPLAIN QUERY PLAN ' + statement, parameters)]
+            self.assertTrue(any(line.startswith('SEARCH accountings USING INDEX ix_accountings_user_to_timestamp_id')
+                                for line in plan))
+            self.assertFalse(any('TEMP B-TREE' in line for line in plan))
+
+    def test_accountings_have_the_timestamp_of_their_ticket(self):
+        user = self._add_user(name='user')
+        friend = self._add_user(name='friend')
+        ticket, _, _ = self._generate_test_ticket(buyer=friend, participant=user)
+        db.session.add(ticket)
+        db.session.commit()
+        self.assertEqual(ticket.accountings[0].timestamp, ticket.timestamp)
+
+        ticket.timestamp = datetime(2020, 5, 1)
+        db.session.commit()
+        db.session.expire_all()
+
+        self.assertEqual(Accounting.query.one().timestamp, datetime(2020, 5, 1))
+
+
+class TestBalances(FlaskAppTest):
+    user_service = UserServiceBase()
+    ticket_service = TicketService(user_service=user_service)
+    accounting_service = AccountingService(user_service=user_service)
+
+    def assertBalancesMatchAccountings(self):
+        self.assertListEqual(rebuild_balances(dry_run=True), [])
+
+    def test_balances_follow_every_write(self):
+        user_buyer = self._add_user(name='buyer')
+        user_participant = self._add_user(name='participant')
+        item_dicts = [
+            {'name': 'item1', 'price': 5.0, 'participants': [{'username': 'buyer'}, {'username': 'participant'}]},
+            {'name': 'item2', 'price': 2.0, 'quantity': 2, 'participants': [{'username': 'participant'}]},
+        ]
+
+        with mock.patch.object(self.user_service, 'get_logged_user', return_value=user_buyer):
+            ticket = self.ticket_service.add_ticket(item_dicts)
+            self.assertEqual(Balance.query.get((user_buyer.id, user_participant.id)).amount, 6.5)
+            self.assertBalancesMatchAccountings()
+
+            self.accounting_service.mark_credit_accounting_paid(ticket.accountings[0].id)
+            self.assertBalancesMatchAccountings()
+
+            item_dicts[1]['price'] = 1.0
+            ticket = self.ticket_service.update_ticket(ticket, item_dicts)
+            self.assertBalancesMatchAccountings()
+
+        with mock.patch.object(self.user_service, 'get_logged_user', return_value=user_participant):
+            self.accounting_service.pay_all_debts_accounting_to(user_buyer.id)
+            self.assertBalancesMatchAccountings()
+
+        self.ticket_service.delete_ticket(ticket)
+        self.assertBalancesMatchAccountings()
+
+    def test_balance_deltas_are_upserted(self):
+        user_from = self._add_user(name='user_from').id
+        user_to = self._add_user(name='user_to').id
+        db.session.add(Balance(user_from=user_from, user_to=user_to, amount=1.0))
+        db.session.commit()
+
+        # the first pair is updated, the second inserted
+        with self.count_queries() as statements:
+            apply_balance_deltas(db.session.connection(), {(user_from, user_to): 2.0, (user_to, user_from): 3.0})
+        db.session.commit()
+
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith('INSERT INTO balances'))
+        self.assertEqual(Balance.query.get((user_from, user_to)).amount, 3.0)
+        self.assertEqual(Balance.query.get((user_to, user_from)).amount, 3.0)
+
+    def test_rebuild_balances_fixes_drift(self):
+        user_buyer = self._add_user(name='buyer')
+        user_participant = self._add_user(name='participant')
+        ticket, _, _ = self._generate_test_ticket(buyer=user_buyer, participant=user_participant)
+        db.session.add(ticket)
+        db.session.commit()
+
+        Balance.query.get((user_buyer.id, user_participant.id)).amount = 1.0
+        db.session.commit()
+
+        drifted = rebuild_balances()
+
+        self.assertListEqual(drifted, [((user_buyer.id, user_participant.id), 1.0, 6.5)])
+        self.assertEqual(Balance.query.get((user_buyer.id, user_participant.id)).amount, 6.5)
+        self.assertBalancesMatchAccountings()
+
 
 class TestUserService(FlaskAppTest):
     password = 'pw'
@@ -292,3 +672,53 @@ class TestUserService(FlaskAppTest):
 
 if __name__ == '__main__':
     unittest.main()
+
+
+class TestReaders(FlaskAppTest):
+
+    def setUp(self):
+        super().setUp()
+        self.user = self._add_user(name='user')
+        self.friend = self._add_user(name='friend')
+
+        for buyer, participant in [(self.user, self.friend), (self.friend, self.user), (self.friend, self.user)]:
+            ticket, _, _ = self._generate_test_ticket(buyer=buyer, participant=participant)
+            db.session.add(ticket)
+        db.session.commit()
+
+    def test_accountings_have_the_shape_of_the_orm_ones(self):
+        accountings = read_accountings_page(Accounting.user_to == self.user.id)
+        orm_accountings = Accounting.query.filter_by(user_to=self.user.id) \
+            .order_by(Accounting.timestamp.desc(), Accounting.id.desc()).all()
+
+        self.assertEqual(marshal(accountings, fields.accounting_fields),
+                         marshal(orm_accountings, fields.accounting_fields))
+
+    def test_tickets_have_the_shape_of_the_orm_ones(self):
+        tickets = read_tickets_page(self.friend.id)
+        orm_tickets = Ticket.query.filter_by(buyer_id=self.friend.id) \
+            .order_by(Ticket.timestamp.desc(), Ticket.id.desc()).all()
+
+        self.assertEqual(marshal(tickets, fields.ticket_fields), marshal(orm_tickets, fields.ticket_fields))
+
+
+class TestAuthorizationService(FlaskAppTest):
+
+    def test_decisions_take_one_query_and_are_remembered(self):
+        buyer = self._add_user(name='buyer')
+        participant = self._add_user(name='participant')
+        ticket, _, _ = self._generate_test_ticket(buyer=buyer, participant=participant)
+        db.session.add(ticket)
+        db.session.commit()
+        ticket_id, participant_id = ticket.id, participant.id
+
+        user_service = UserServiceBase()
+        authorization_service = AuthorizationService(user_service=user_service)
+        with mock.patch.object(user_service, 'get_logged_user_id', return_value=participant_id):
+            with self.count_queries() as statements:
+                self.assertTrue(authorization_service.can_access_ticket(ticket_id, READ))
+                self.assertTrue(authorization_service.can_access_ticket(ticket_id, READ))
+            self.assertFalse(authorization_service.can_access_ticket(ticket_id, MODIFY))
+            self.assertIsNone(authorization_service.can_access_ticket(ticket_id + 1, READ))
+
+        self.assertEqual(len(statements), 1)
@@ -0,0 +1,53 @@
+import random
+import unittest
+
+from .settlement import plan_settlement, net_positions_in_cents, EXACT_PLAN_MAX_MEMBERS
+
+
+class TestPlanSettlement(unittest.TestCase):
+
+    @staticmethod
+    def _apply(positions, transfers):
+        positions = dict(positions)
+        for debtor, creditor, amount in transfers:
+            positions[debtor] += amount
+            positions[creditor] -= amount
+        return positions
+
+    def test_plan_settles_every_position(self):
+        positions = {'a': 1000, 'b': -250, 'c': -750, 'd': 300, 'e': -300}
+
+        transfers = plan_settlement(positions)
+
+        self.assertTrue(all(amount > 0 for _, _, amount in transfers))
+        self.assertTrue(all(amount == 0 for amount in self._apply(positions, transfers).values()))
+
+    def test_small_groups_are_split_in_zero_sum_subgroups(self):
+        # greedily matching the largest creditor with the largest debtor would take 4 transfers
+        positions = {'a': 500, 'c': -500, 'b': 600, 'd': -300, 'e': -300}
+
+        transfers = plan_settlement(positions)
+
+        self.assertEqual(len(transfers), 3)
+        self.assertTrue(all(amount == 0 for amount in self._apply(positions, transfers).values()))
+
+    def test_large_groups_take_at_most_one_transfer_less_than_their_members(self):
+        generator = random.Random(42)
+        n_users = EXACT_PLAN_MAX_MEMBERS * 10
+        positions = {user: generator.randint(-10000, 10000) for user in range(n_users - 1)}
+        positions[n_users - 1] = -sum(positions.values())
+
+        transfers = plan_settlement(positions)
+
+        self.assertLessEqual(len(transfers), n_users - 1)
+        self.assertTrue(all(amount == 0 for amount in self._apply(positions, transfers).values()))
+
+    def test_net_positions_in_cents_have_no_residue(self):
+        positions = net_positions_in_cents({'a': 10.0 / 3, 'b': 10.0 / 3, 'c': -20.0 / 3})
+
+        self.assertEqual(sum(positions.values()), 0)
+        self.assertDictEqual(positions, {'a': 333, 'b': 333, 'c': -666})
+
+
+if __name__ == '__main__':
+    unittest.main()
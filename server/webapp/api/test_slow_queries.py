@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+import unittest
+
+from . import controllers as ctl, status
+from .slow_queries import slow_query_log, normalize_statement, parameter_shapes, full_scans
+from .test_services import FlaskAppTest
+from .. import db
+
+
+class TestSlowQueryLog(FlaskAppTest):
+    encoder = json.encoder.JSONEncoder()
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'slow-queries.log')
+
+    def tearDown(self):
+        slow_query_log.shutdown()
+        super().tearDown()
+
+    def enable(self, threshold_ms):
+        db.app.config.update(SLOW_QUERY_THRESHOLD_MS=threshold_ms, SLOW_QUERY_LOG_PATH=self.path)
+        slow_query_log.init_app(db.app, db.engine)
+
+    def read_log(self):
+        # the file is created with the first entry
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as file:
+            return [json.loads(line) for line in file]
+
+    def test_statements_over_the_threshold_are_logged_with_their_origin_and_plan(self):
+        token, _ = self._get_token_and_add_user()
+        self.enable(0)
+
+        response = self.client.get('api' + ctl.UsersAPI.resource_path + '?q=te',
+                                   headers=dict(self.content_type, Authorization='Bearer {}'.format(token)))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        slow_query, = [entry for entry in self.read_log() if entry['service'] == 'UserServiceREST.search_users']
+        self.assertEqual(slow_query['resource'], 'UsersAPI.get')
+        self.assertEqual(slow_query['endpoint'], 'api.usersapi')
+        self.assertEqual(slow_query['parameters'], ['str', 'str', 'int', 'int'])
+        self.assertTrue(any('ix_users_username_lower_id' in line for line in slow_query['plan']))
+        self.assertListEqual(slow_query['fullScans'], [])
+
+    def test_full_scans_are_reported(self):
+        self.enable(0)
+
+        db.session.execute('SELECT * FROM accountings WHERE paidPrice < totalPrice')
+
+        slow_query, = self.read_log()
+        self.assertListEqual(slow_query['fullScans'], ['accountings'])
+        self.assertIsNone(slow_query['resource'])
+
+    def test_statements_under_the_threshold_are_not_logged(self):
+        self.enable(10000)
+
+        db.session.execute('SELECT * FROM accountings')
+
+        self.assertListEqual(self.read_log(), [])
+
+
+class TestSlowQueryFormatting(unittest.TestCase):
+
+    def test_normalize_statement(self):
+        self.assertEqual(normalize_statement("SELECT *\n  FROM users WHERE id IN (?, ?, ?) AND username = 'x' "
+                                             "LIMIT 10"),
+                         'SELECT * FROM users WHERE id IN (?, ...) AND username = ? LIMIT ?')
+
+    def test_parameter_shapes(self):
+        self.assertListEqual(parameter_shapes((1, 'a', None)), ['int', 'str', 'NoneType'])
+        self.assertDictEqual(parameter_shapes([(1,), (2,)], executemany=True), {'rows': 2, 'row': ['int']})
+
+    def test_full_scans(self):
+        self.assertListEqual(full_scans(['SCAN accountings', 'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)',
+                                         'SCAN tickets USING INDEX ix_tickets_timestamp_id',
+                                         'Seq Scan on items  (cost=0.00..1.01 rows=1 width=4)']),
+                             ['accountings', 'items'])
@@ -0,0 +1,40 @@
+import unittest
+
+from .split import split_receipt
+
+
+class TestSplitReceipt(unittest.TestCase):
+
+    def test_split_receipt(self):
+        items = [
+            (5.0, 1, ['buyer', 'participant']),
+            (2.0, 2, ['participant']),
+            (3.0, 3, ['buyer']),
+        ]
+
+        self.assertDictEqual(split_receipt(items), {'buyer': 250 + 900, 'participant': 250 + 400})
+
+    def test_shares_add_up_to_the_receipt_total(self):
+        # 10.00 among three participants would be 3.33 each with a cent lost, the largest remainder gets it
+        items = [
+            (10.0, 1, ['a', 'b', 'c']),
+            (0.01, 1, ['a', 'b']),
+        ]
+
+        totals = split_receipt(items)
+
+        self.assertEqual(sum(totals.values()), 1001)
+        self.assertTrue(all(abs(cents - exact) < 1 for cents, exact in
+                            zip([totals['a'], totals['b'], totals['c']], [333.83, 333.83, 333.33])))
+
+    def test_prices_are_rounded_to_cents(self):
+        totals = split_receipt([(0.1, 3, ['a'])] * 100)
+
+        self.assertDictEqual(totals, {'a': 3000})
+
+    def test_empty_receipt(self):
+        self.assertDictEqual(split_receipt([]), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import json
+import os
+import tempfile
+
+from config import TestConfig
+from . import controllers as ctl, status
+from .test_controllers import APITest
+from .tracing import tracer, TRACE_ID_HEADER, KIND_SERVER, KIND_CLIENT
+from .. import create_app, db
+
+
+class TestTracing(APITest):
+
+    def start_app(self, **config):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'traces.jsonl')
+
+        tracing_config = type('TracingConfig', (TestConfig,), dict({'TRACING_EXPORT_PATH': self.path}, **config))
+        app = create_app(tracing_config)
+        self.client = app.test_client()
+        db.app = app
+
+        self.buyer_token, self.buyer = self._get_token_and_add_user('buyer')
+        self.participant = self._add_user('participant')
+        ticket, _, _ = self._generate_test_ticket(buyer=self.buyer, participant=self.participant)
+        db.session.add(ticket)
+        db.session.commit()
+        self.ticket_path = 'api' + ctl.TicketAPI.resource_path.replace('<int:id>', str(ticket.id))
+        # only the requests of the test are read
+        open(self.path, 'w').close()
+
+    def tearDown(self):
+        tracer.shutdown()
+        super().tearDown()
+
+    def read_spans(self):
+        traces = []
+        with open(self.path) as file:
+            for line in file:
+                resource_spans, = json.loads(line)['resourceSpans']
+                scope_spans, = resource_spans['scopeSpans']
+                traces.append(scope_spans['spans'])
+        return traces
+
+    def patch_ticket(self, **headers):
+        items = self.encoder.encode({'items': [{'name': 'item', 'quantity': 1, 'price': 4.0,
+                                                'participants': [{'username': 'participant'}]}]})
+        return self.client.patch(self.ticket_path, data=items,
+                                 headers=dict(self.content_type, **self.get_auth_dict(self.buyer_token), **headers))
+
+    def test_the_spans_of_a_request_are_linked_into_a_trace(self):
+        self.start_app()
+
+        response = self.patch_ticket()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        spans, = self.read_spans()
+        spans_by_name = {span['name']: span for span in spans}
+        root = spans_by_name['PATCH /api/ticket/<int:id>']
+        resource = spans_by_name['TicketAPI.patch']
+        update = spans_by_name['TicketService.update_ticket']
+
+        self.assertEqual(root['kind'], KIND_SERVER)
+        self.assertNotIn('parentSpanId', root)
+        self.assertEqual(resource['parentSpanId'], root['spanId'])
+        self.assertEqual(spans_by_name['AuthorizationService.check_ticket']['parentSpanId'], resource['spanId'])
+        self.assertEqual(update['parentSpanId'], resource['spanId'])
+        self.assertEqual({span['traceId'] for span in spans}, {response.headers[TRACE_ID_HEADER]})
+        self.assertIn({'key': 'http.status_code', 'value': {'intValue': '201'}}, root['attributes'])
+
+        # every statement is a child of the span that ran it, and ends within it
+        span_ids = {span['spanId']: span for span in spans}
+        statements = [span for span in spans if span['kind'] == KIND_CLIENT]
+        self.assertTrue(statements)
+        for statement in statements:
+            parent = span_ids[statement['parentSpanId']]
+            self.assertLessEqual(int(parent['startTimeUnixNano']), int(statement['startTimeUnixNano']))
+            self.assertLessEqual(int(statement['endTimeUnixNano']), int(parent['endTimeUnixNano']))
+        self.assertTrue(any(span_ids[statement['parentSpanId']] is update for statement in statements))
+
+    def test_requests_join_the_trace_of_the_caller(self):
+        self.start_app()
+        trace_id, parent_span_id = '4bf92f3577b34da6a3ce929d0e0e4736', '00f067aa0ba902b7'
+
+        self.patch_ticket(traceparent='00-{}-{}-01'.format(trace_id, parent_span_id))
+
+        spans, = self.read_spans()
+        root = spans[0]
+        self.assertEqual(root['traceId'], trace_id)
+        self.assertEqual(root['parentSpanId'], parent_span_id)
+
+    def test_requests_not_sampled_by_the_caller_are_not_traced(self):
+        self.start_app()
+
+        response = self.patch_ticket(traceparent='00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-00')
+
+        self.assertNotIn(TRACE_ID_HEADER, response.headers)
+        self.assertListEqual(self.read_spans(), [])
+
+    def test_the_spans_of_a_trace_are_capped(self):
+        self.start_app(TRACING_MAX_SPANS=3)
+
+        self.patch_ticket()
+
+        spans, = self.read_spans()
+        self.assertEqual(len(spans), 3)
+        dropped = {attribute['key']: attribute['value'] for attribute in spans[0]['attributes']}
+        self.assertGreater(int(dropped['tracing.dropped_spans']['intValue']), 0)
@@ -0,0 +1,57 @@
+import threading
+from datetime import datetime
+
+from .models import RevokedToken
+from .. import db
+
+
+def _expires_at(decoded_token):
+    # refresh tokens may be configured to never expire
+    exp = decoded_token.get('exp')
+    return datetime.utcfromtimestamp(exp) if exp is not None else datetime.max
+
+
+class TokenDenylist:
+    # the revoked refresh tokens: the table is shared by every worker, while the revocations already seen by this
+    # one are kept in memory until the tokens expire, so a replayed token does not even reach the database
+
+    def __init__(self):
+        self._revoked = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        with self._lock:
+            self._revoked.clear()
+
+    def _remember(self, jti, expires_at):
+        now = datetime.utcnow()
+        with self._lock:
+            self._revoked[jti] = expires_at
+            for expired_jti in [jti for jti, expires_at in self._revoked.items() if expires_at < now]:
+                del self._revoked[expired_jti]
+
+    def is_revoked(self, decoded_token):
+        jti = decoded_token['jti']
+        with self._lock:
+            if jti in self._revoked:
+                return True
+
+        expires_at = db.session.query(RevokedToken.expires_at).filter(RevokedToken.jti == jti).scalar()
+        if expires_at is None:
+            return False
+
+        self._remember(jti, expires_at)
+        return True
+
+    def revoke(self, decoded_token):
+        jti = decoded_token['jti']
+        expires_at = _expires_at(decoded_token)
+
+        db.session.merge(RevokedToken(jti=jti, expires_at=expires_at))
+        RevokedToken.query.filter(RevokedToken.expires_at < datetime.utcnow()).delete(synchronize_session=False)
+        db.session.commit()
+
+        self._remember(jti, expires_at)
+
+
+token_denylist = TokenDenylist()
@@ -0,0 +1,305 @@
+import json
+import logging
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+from functools import wraps
+from logging.handlers import RotatingFileHandler
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+DEFAULT_SERVICE_NAME = 'swam-server'
+DEFAULT_SAMPLE_RATE = 1.0
+DEFAULT_MAX_SPANS = 1000
+DEFAULT_LOG_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_LOG_BACKUPS = 5
+
+TRACEPARENT_HEADER = 'traceparent'
+TRACE_ID_HEADER = 'X-Trace-Id'
+
+# the span kinds and status codes of OTLP
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+_TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+logger = logging.getLogger('webapp.traces')
+logger.propagate = False
+
+
+def _new_id(bits):
+    return '{:0{}x}'.format(random.getrandbits(bits), bits // 4)
+
+
+def _attribute_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        # 64 bit integers are strings in the JSON encoding of OTLP
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _attributes(attributes):
+    return [{'key': key, 'value': _attribute_value(value)} for key, value in attributes.items()]
+
+
+class Span:
+    __slots__ = ('span_id', 'parent_span_id', 'name', 'kind', 'start', 'end', 'attributes', 'status', 'message')
+
+    def __init__(self, name, kind, parent_span_id, attributes):
+        self.span_id = _new_id(64)
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes
+        self.status = STATUS_UNSET
+        self.message = None
+
+    def fail(self, error):
+        self.status = STATUS_ERROR
+        self.message = '{}: {}'.format(type(error).__name__, error)
+
+    def to_dict(self, trace_id):
+        span = {
+            'traceId': trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end),
+            'attributes': _attributes(self.attributes),
+            'status': {'code': self.status},
+        }
+        if self.parent_span_id is not None:
+            span['parentSpanId'] = self.parent_span_id
+        if self.message is not None:
+            span['status']['message'] = self.message
+        return span
+
+
+class Trace:
+    # the spans of a request: the active ones are a stack, every new span is a child of the innermost one
+
+    def __init__(self, trace_id, parent_span_id, max_spans):
+        self.trace_id = trace_id
+        self.max_spans = max_spans
+        self.spans = []
+        self.dropped = 0
+        self._active = [None]
+        self._remote_parent_span_id = parent_span_id
+
+    def start(self, name, kind=KIND_INTERNAL, **attributes):
+        if len(self.spans) >= self.max_spans:
+            self.dropped += 1
+            return None
+
+        parent = self._active[-1]
+        span = Span(name, kind, parent.span_id if parent is not None else self._remote_parent_span_id, attributes)
+        self.spans.append(span)
+        self._active.append(span)
+        return span
+
+    def end(self, span):
+        if span is None or span not in self._active:
+            return
+        span.end = time.time_ns()
+        # the spans end in the reverse order they start, but an error may skip some of them
+        while self._active[-1] is not None:
+            if self._active.pop() is span:
+                break
+
+    @contextmanager
+    def span(self, name, kind=KIND_INTERNAL, **attributes):
+        span = self.start(name, kind, **attributes)
+        try:
+            yield span
+        except Exception as error:
+            if span is not None:
+                span.fail(error)
+            raise
+        finally:
+            self.end(span)
+
+
+def current_trace():
+    if not has_request_context():
+        return None
+    return g.get('trace')
+
+
+def traced(cls):
+    # class decorator: every method defined by the class runs in a span named after it
+    for name, attribute in list(vars(cls).items()):
+        if name.startswith('__'):
+            continue
+        if isinstance(attribute, staticmethod):
+            setattr(cls, name, staticmethod(_traced_function(attribute.__func__, cls.__name__, name)))
+        elif callable(attribute):
+            setattr(cls, name, _traced_function(attribute, cls.__name__, name))
+    return cls
+
+
+def _traced_function(function, class_name, name):
+    # the name of the attribute, the functions wrapped by transactional are all called 'annotation'
+    span_name = '{}.{}'.format(class_name, name)
+
+    @wraps(function)
+    def traced_function(*args, **kwargs):
+        trace = current_trace()
+        if trace is None:
+            return function(*args, **kwargs)
+        with trace.span(span_name):
+            return function(*args, **kwargs)
+
+    return traced_function
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.trace)
+
+
+class Tracer:
+    # a trace per sampled request, with the spans of the request, of the traced classes and of the SQL statements;
+    # the finished traces are written to TRACING_EXPORT_PATH as OTLP/JSON export requests, one per line, the same
+    # body a collector accepts on /v1/traces
+
+    def __init__(self):
+        self.enabled = False
+        self._handler = None
+
+    def init_app(self, app, engine):
+        self.shutdown()
+
+        path = app.config.get('TRACING_EXPORT_PATH')
+        if path is None:
+            return
+
+        self.service_name = app.config.get('TRACING_SERVICE_NAME', DEFAULT_SERVICE_NAME)
+        self.sample_rate = app.config.get('TRACING_SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+        self.max_spans = app.config.get('TRACING_MAX_SPANS', DEFAULT_MAX_SPANS)
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        max_bytes = app.config.get('TRACING_EXPORT_MAX_BYTES', DEFAULT_LOG_MAX_BYTES)
+        backups = app.config.get('TRACING_EXPORT_BACKUPS', DEFAULT_LOG_BACKUPS)
+        self._handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, delay=True)
+        self._handler.setFormatter(JSONFormatter())
+        logger.addHandler(self._handler)
+        logger.setLevel(logging.INFO)
+        self.enabled = True
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+        if not event.contains(engine, 'before_cursor_execute', self._before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.listen(engine, 'handle_error', self._handle_error)
+
+    def shutdown(self):
+        if self._handler is not None:
+            logger.removeHandler(self._handler)
+            self._handler.close()
+        self._handler = None
+        self.enabled = False
+
+    def _before_request(self):
+        if not self.enabled:
+            return
+
+        # a request coming with a W3C traceparent joins the trace of the caller, and follows its sampling decision
+        match = _TRACEPARENT.match(request.headers.get(TRACEPARENT_HEADER, ''))
+        if match:
+            trace_id, parent_span_id, flags = match.groups()
+            if not int(flags, 16) & 1:
+                return
+        elif random.random() < self.sample_rate:
+            trace_id, parent_span_id = _new_id(128), None
+        else:
+            return
+
+        trace = g.trace = Trace(trace_id, parent_span_id, self.max_spans)
+        route = request.url_rule.rule if request.url_rule is not None else request.path
+        g.trace_root = trace.start('{} {}'.format(request.method, route), KIND_SERVER, **{
+            'http.method': request.method,
+            'http.route': route,
+            'http.target': request.full_path.rstrip('?'),
+        })
+
+    @staticmethod
+    def _after_request(response):
+        trace = current_trace()
+        if trace is not None:
+            g.trace_root.attributes['http.status_code'] = response.status_code
+            if response.status_code >= 500:
+                g.trace_root.status = STATUS_ERROR
+            response.headers[TRACE_ID_HEADER] = trace.trace_id
+        return response
+
+    def _teardown_request(self, error):
+        trace = g.pop('trace', None)
+        if trace is None:
+            return
+
+        root = g.pop('trace_root')
+        if error is not None:
+            root.fail(error)
+        if trace.dropped:
+            root.attributes['tracing.dropped_spans'] = trace.dropped
+        trace.end(root)
+        self.export(trace)
+
+    def export(self, trace):
+        logger.info('trace', extra={'trace': {
+            'resourceSpans': [{
+                'resource': {'attributes': _attributes({'service.name': self.service_name,
+                                                        'process.pid': os.getpid()})},
+                'scopeSpans': [{
+                    'scope': {'name': __name__},
+                    'spans': [span.to_dict(trace.trace_id) for span in trace.spans if span.end is not None],
+                }],
+            }],
+        }})
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        trace = current_trace()
+        if trace is None or context is None:
+            return
+        operation = statement.split(None, 1)[0].upper() if statement.strip() else 'SQL'
+        context.trace_span = trace.start(operation, KIND_CLIENT, **{
+            'db.system': conn.dialect.name,
+            'db.statement': statement,
+            'db.operation': operation,
+        })
+
+    @staticmethod
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        trace = current_trace()
+        if trace is not None and context is not None:
+            trace.end(getattr(context, 'trace_span', None))
+
+    @staticmethod
+    def _handle_error(exception_context):
+        trace = current_trace()
+        context = exception_context.execution_context
+        span = getattr(context, 'trace_span', None)
+        if trace is not None and span is not None:
+            span.fail(exception_context.original_exception)
+            trace.end(span)
+
+
+tracer = Tracer()
@@ -0,0 +1,67 @@
+from functools import wraps
+
+from flask import g, request, Response
+from flask_jwt_extended import get_jwt_identity
+from flask_restful.utils import unpack
+from sqlalchemy import event
+from werkzeug.http import quote_etag
+
+from . import status
+from .cache import response_cache
+from .models import User
+from .. import db
+
+TOUCHED_USERS_KEY = 'touched_user_ids'
+
+
+def touch_users(*user_ids):
+    # the users whose data is changed by the current transaction, their version is bumped when it commits
+    db.session.info.setdefault(TOUCHED_USERS_KEY, set()).update(user_ids)
+
+
+@event.listens_for(db.session, 'before_commit')
+def _bump_data_versions(session):
+    user_ids = session.info.get(TOUCHED_USERS_KEY)
+    if user_ids:
+        session.execute(User.__table__.update()
+                        .where(User.id.in_(user_ids))
+                        .values(data_version=User.data_version + 1))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_cached_responses(session):
+    user_ids = session.info.pop(TOUCHED_USERS_KEY, None)
+    if user_ids:
+        response_cache.invalidate(*user_ids)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_touched_users(session):
+    session.info.pop(TOUCHED_USERS_KEY, None)
+
+
+def get_data_version(user_id):
+    return db.session.query(User.data_version).filter(User.id == user_id).scalar()
+
+
+def make_etag(user_id, data_version):
+    return '{}-{}'.format(user_id, data_version)
+
+
+def conditional(get):
+    # to be put right after jwt_required, it answers 304 before the resource loads anything; the cached responses
+    # are stored under the same version
+    @wraps(get)
+    def conditional_get(*args, **kwargs):
+        user_id = get_jwt_identity()
+        # the version is read before the data: a write in between makes the etag stale, never the response
+        data_version = g.data_version = get_data_version(user_id)
+        etag = make_etag(user_id, data_version)
+
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': quote_etag(etag)})
+
+        data, code, headers = unpack(get(*args, **kwargs))
+        return data, code, dict(headers or {}, ETag=quote_etag(etag))
+
+    return conditional_get